@@ -0,0 +1,154 @@
+"""
+Кэш результатов анализа, привязанный к "водяному знаку" данных в bayut_properties.
+
+Если таблица не менялась с прошлого запуска (тот же max(updated_at) и то же
+количество строк), а параметры анализа совпадают, публикаторы берут готовый
+DataFrame из кэша вместо повторного выполнения тяжелых запросов.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from schema_capabilities import get_schema_capabilities, LATEST_VIEW_NAME
+
+logger = logging.getLogger(__name__)
+
+# Параметры кэша из .env
+CACHE_DIR = os.getenv('ANALYSIS_CACHE_DIR', os.path.join('cache', 'analysis'))
+CACHE_MAX_AGE_HOURS = float(os.getenv('ANALYSIS_CACHE_MAX_AGE_HOURS', '168'))
+CACHE_MAX_MB = float(os.getenv('ANALYSIS_CACHE_MAX_MB', '200'))
+CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', '1') not in ('0', 'false', 'False', '')
+
+
+def get_data_watermark(conn):
+    """
+    Возвращает дешевый отпечаток состояния таблицы bayut_properties:
+    кортеж (max(updated_at), количество строк) или None, если его не удалось получить.
+    Если публикаторы читают представление последних снимков, в отпечаток добавляется
+    и его состояние: до обновления представления результат не должен кэшироваться
+    под новым водяным знаком таблицы.
+    """
+    from latest_listings import use_latest_view
+    
+    try:
+        cursor = conn.cursor()
+        capabilities = get_schema_capabilities(conn)
+        # Без колонки updated_at отпечатком служит только количество строк
+        if capabilities.has_updated_at:
+            cursor.execute("SELECT MAX(updated_at), COUNT(*) FROM bayut_properties")
+        else:
+            cursor.execute("SELECT NULL, COUNT(*) FROM bayut_properties")
+        max_updated_at, row_count = cursor.fetchone()
+        watermark = (max_updated_at.isoformat() if max_updated_at is not None else None, int(row_count))
+        if use_latest_view(capabilities):
+            cursor.execute(f"SELECT MAX(updated_at), COUNT(*) FROM {LATEST_VIEW_NAME}")
+            view_updated_at, view_count = cursor.fetchone()
+            watermark += (f"{view_updated_at.isoformat() if view_updated_at is not None else None}/{view_count}",)
+        cursor.close()
+        return watermark
+    except Exception as e:
+        # Сбрасываем прерванную транзакцию, чтобы соединение осталось пригодным
+        conn.rollback()
+        logger.warning(f"Не удалось получить водяной знак данных, кэш отключен: {e}")
+        return None
+
+
+def make_cache_key(kind, watermark, params=None):
+    """
+    Строит ключ кэша из типа анализа, водяного знака данных и параметров
+    (диапазон площади, топ-N и т.п.). Возвращает None, если водяной знак неизвестен.
+    """
+    if watermark is None or not CACHE_ENABLED:
+        return None
+    payload = json.dumps(
+        {'kind': kind, 'watermark': list(watermark), 'params': params or {}},
+        sort_keys=True,
+        default=str
+    )
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+    return f"{kind}_{digest}"
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+
+def load_cached_result(key):
+    """Возвращает DataFrame из кэша по ключу или None, если записи нет или она устарела."""
+    if key is None:
+        return None
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    if time.time() - os.path.getmtime(path) > CACHE_MAX_AGE_HOURS * 3600:
+        return None
+    try:
+        import pandas as pd
+
+        df = pd.read_parquet(path)
+        logger.info(f"Результат анализа загружен из кэша: {path}")
+        return df
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать кэш {path}: {e}")
+        return None
+
+
+def save_cached_result(key, df):
+    """Сохраняет DataFrame в кэш (Parquet) и выполняет вытеснение старых записей."""
+    if key is None or df is None:
+        return None
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    tmp_path = path + '.tmp'
+    try:
+        df.to_parquet(tmp_path, index=False)
+        # Атомарная замена, чтобы параллельный запуск не прочитал недописанный файл
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить результат в кэш {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    evict_cache()
+    return path
+
+
+def evict_cache(max_age_hours=None, max_mb=None):
+    """
+    Удаляет записи кэша старше max_age_hours, а затем самые старые записи,
+    пока суммарный размер кэша не станет меньше max_mb.
+    """
+    max_age_hours = CACHE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    max_mb = CACHE_MAX_MB if max_mb is None else max_mb
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.parquet'):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        stat = os.stat(path)
+        if now - stat.st_mtime > max_age_hours * 3600:
+            os.remove(path)
+            removed += 1
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    # Вытесняем самые старые записи, пока не уложимся в лимит размера
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    max_bytes = max_mb * 1024 * 1024
+    while entries and total_size > max_bytes:
+        _, size, path = entries.pop(0)
+        os.remove(path)
+        total_size -= size
+        removed += 1
+
+    if removed:
+        logger.info(f"Из кэша анализа удалено записей: {removed}")
+    return removed
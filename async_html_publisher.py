@@ -0,0 +1,244 @@
+"""
+Асинхронный конвейер HTML-отчетов о самых дешевых квартирах.
+
+В отличие от telegram_html_publisher.main(), все этапы выполняются в одном
+цикле событий: выборка через asyncpg, рендеринг карты и HTML в пуле процессов
+(не блокируя цикл), загрузка через aioftp и отправка в Telegram через aiohttp.
+Отчеты по нескольким диапазонам площади обрабатываются параллельно, поэтому
+загрузка одного отчета идет, пока выполняется запрос для другого.
+
+Использование:
+    python async_html_publisher.py [--profile]
+"""
+
+import os
+import asyncio
+import argparse
+from datetime import datetime
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import telegram_html_publisher as html_publisher
+from metrics import stage, configure as configure_metrics, write_openmetrics
+from profiling import add_profile_arguments, profile_call
+from query_builder import normalize_filters, build_cheapest_apartments_query, to_positional
+from listing_dedup import overfetch_filters, dedup_top_n
+from link_checker import LinkStatusCache, drop_dead_listings_async
+from schema_capabilities import TABLE_NAME, LATEST_VIEW_NAME
+from render_pool import SharedFrame, create_render_pool, render_html_report_task
+
+# Варианты отчета: имя файла, заголовок и фильтры запроса (см. query_builder.DEFAULT_CHEAPEST_FILTERS)
+REPORT_VARIANTS = [
+    {'name': 'cheapest_apartments', 'title': 'Самые дешевые квартиры в Дубае (до 40 кв.м.)',
+     'area_min': 0, 'area_max': 40, 'top_n': 3},
+    {'name': 'cheapest_apartments_40_60', 'title': 'Самые дешевые квартиры в Дубае (40-60 кв.м.)',
+     'area_min': 40, 'area_max': 60, 'top_n': 3},
+    {'name': 'cheapest_apartments_60_90', 'title': 'Самые дешевые квартиры в Дубае (60-90 кв.м.)',
+     'area_min': 60, 'area_max': 90, 'top_n': 3}
+]
+
+# Одновременных FTP-сессий не больше, чем допускает хостинг
+FTP_MAX_SESSIONS = int(os.getenv('FTP_MAX_SESSIONS', '2'))
+
+
+async def create_db_pool():
+    """Создает пул соединений asyncpg с параметрами из .env."""
+    import asyncpg
+
+    port = os.getenv("DB_PORT")
+    return await asyncpg.create_pool(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(port) if port else None,
+        min_size=1,
+        max_size=len(REPORT_VARIANTS)
+    )
+
+
+async def detect_source_table(pool):
+    """Выбирает представление последних снимков, если оно создано и заполнено, иначе bayut_properties."""
+    async with pool.acquire() as conn:
+        has_view = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = $1 AND ispopulated)",
+            LATEST_VIEW_NAME
+        )
+    return LATEST_VIEW_NAME if has_view else TABLE_NAME
+
+
+async def fetch_cheapest_apartments_async(pool, variant, table=TABLE_NAME, link_cache=None):
+    """Асинхронно извлекает топ-N самых дешевых квартир по регионам для варианта отчета."""
+    with stage(f"fetch_cheapest_apartments.{variant['name']}") as record:
+        # asyncpg сам кэширует подготовленные операторы на соединении,
+        # поэтому варианты с одинаковым набором фильтров используют один план
+        filters = normalize_filters(variant)
+        query, values = to_positional(*build_cheapest_apartments_query(overfetch_filters(filters), table))
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, *values)
+        record.rows = len(rows)
+    if not rows:
+        return None
+
+    import pandas as pd
+    df = pd.DataFrame([dict(row) for row in rows])
+    # asyncpg возвращает NUMERIC как Decimal, приводим к float для pandas и шаблонов
+    df[['area', 'price']] = df[['area', 'price']].astype(float)
+    # Повторные публикации и снятые объявления убираются так же, как в синхронном публикаторе
+    select = lambda frame: dedup_top_n(frame, filters['top_n'])
+    df = await drop_dead_listings_async(html_publisher.prepare_apartments_frame(df), select, link_cache)
+    return select(df)
+
+
+async def upload_to_ftp_async(local_file_path, remote_file_name, ftp_semaphore):
+    """Загружает файл на FTP-сервер через aioftp и возвращает его URL."""
+    import aioftp
+
+    if not all([html_publisher.FTP_HOST, html_publisher.FTP_USER, html_publisher.FTP_PASSWORD]):
+        print("ВНИМАНИЕ: Не указаны параметры FTP в .env файле")
+        return None
+
+    try:
+        async with ftp_semaphore:
+            with stage('upload_to_ftp') as record:
+                record.bytes = os.path.getsize(local_file_path)
+                async with aioftp.Client.context(
+                    html_publisher.FTP_HOST,
+                    html_publisher.FTP_PORT,
+                    html_publisher.FTP_USER,
+                    html_publisher.FTP_PASSWORD
+                ) as client:
+                    # Переходим в нужную директорию, при ее отсутствии создаем вместе с родительскими
+                    try:
+                        await client.change_directory(html_publisher.FTP_DIRECTORY)
+                    except aioftp.StatusCodeError:
+                        try:
+                            await client.make_directory(html_publisher.FTP_DIRECTORY)
+                        except aioftp.StatusCodeError:
+                            # Каталог (или его часть) мог одновременно создать параллельный сеанс
+                            await client.make_directory(html_publisher.FTP_DIRECTORY)
+                        await client.change_directory(html_publisher.FTP_DIRECTORY)
+                    await client.upload(local_file_path, remote_file_name, write_into=True)
+        return f"{html_publisher.BASE_URL}{remote_file_name}"
+    
+    except Exception as e:
+        print(f"Ошибка при загрузке файла на FTP: {e}")
+        return None
+
+
+async def send_telegram_message_async(session, message):
+    """Отправляет HTML-сообщение в Telegram через Bot API."""
+    url = f"{html_publisher.TELEGRAM_API_URL}/bot{html_publisher.TELEGRAM_BOT_TOKEN}/sendMessage"
+    with stage('telegram_send') as record:
+        record.bytes = len(message.encode('utf-8'))
+        async with session.post(url, json={
+            'chat_id': html_publisher.TELEGRAM_CHANNEL_ID,
+            'text': message,
+            'parse_mode': 'HTML'
+        }) as response:
+            if response.status == 200:
+                print(f"Сообщение успешно отправлено в Telegram чат {html_publisher.TELEGRAM_CHANNEL_ID}")
+                return True
+            print(f"Ошибка при отправке сообщения в Telegram: {await response.text()}")
+            return False
+
+
+async def run_report_variant(pool, variant, ftp_semaphore, render_executor, table=TABLE_NAME, link_cache=None):
+    """Выборка, рендеринг и загрузка одного варианта отчета. Возвращает (вариант, URL, локальный путь)."""
+    df = await fetch_cheapest_apartments_async(pool, variant, table, link_cache)
+    if df is None or df.empty:
+        print(f"Нет данных для отчета {variant['name']}.")
+        return variant, None, None
+
+    # Рендеринг карты и HTML загружает CPU, поэтому выполняется в пуле процессов;
+    # данные передаются воркеру через Arrow в разделяемой памяти, а не через pickle
+    loop = asyncio.get_running_loop()
+    with stage(f"render_html.{variant['name']}"), SharedFrame(df) as frame:
+        html_file_path, html_file_name = await loop.run_in_executor(
+            render_executor, render_html_report_task, frame.ref, variant['name'], variant['title']
+        )
+
+    report_url = await upload_to_ftp_async(html_file_path, html_file_name, ftp_semaphore)
+    return variant, report_url, html_file_path
+
+
+def build_report_message(results):
+    """Формирует одно сообщение Telegram со ссылками на все опубликованные отчеты."""
+    lines = [
+        "<b>🏢 Анализ рынка недвижимости в Дубае: самые дешевые квартиры</b>",
+        "",
+        "Обновлены интерактивные отчеты со списком самых дешевых квартир по всем регионам Дубая.",
+        "",
+        "<b>Что вы найдете в отчетах:</b>",
+        "• Интерактивная карта с маркерами квартир",
+        "• Топ-10 регионов с самыми низкими ценами",
+        "• Полная таблица всех квартир",
+        "",
+        f"<b>Дата обновления:</b> {datetime.now().strftime('%d.%m.%Y')}",
+        "",
+        "<b>Ссылки на отчеты:</b>"
+    ]
+    for variant, report_url, _ in results:
+        if report_url:
+            lines.append(f"• {variant['title']}: {report_url}")
+    return "\n".join(lines)
+
+
+async def main_async(variants=None):
+    """Асинхронно формирует, загружает и публикует все варианты отчета."""
+    import aiohttp
+
+    variants = variants or REPORT_VARIANTS
+    pool = await create_db_pool()
+    try:
+        ftp_semaphore = asyncio.Semaphore(FTP_MAX_SESSIONS)
+        table = await detect_source_table(pool)
+        # Один кэш проверок ссылок на все варианты: общие объявления проверяются один раз
+        link_cache = LinkStatusCache.load()
+        print(f"Формирование отчетов: {', '.join(v['name'] for v in variants)}")
+        with create_render_pool(max_workers=len(variants)) as render_executor:
+            results = await asyncio.gather(*(
+                run_report_variant(pool, variant, ftp_semaphore, render_executor, table, link_cache)
+                for variant in variants
+            ))
+    finally:
+        await pool.close()
+
+    for variant, report_url, local_path in results:
+        if local_path and not report_url:
+            print(f"Отчет {variant['name']} не загружен на FTP, сохранен локально: {local_path}")
+
+    if not any(report_url for _, report_url, _ in results):
+        print("Не удалось загрузить ни одного отчета на FTP.")
+        return False
+
+    if not (html_publisher.TELEGRAM_BOT_TOKEN and html_publisher.TELEGRAM_CHANNEL_ID):
+        print("ВНИМАНИЕ: Не указаны TELEGRAM_BOT_TOKEN или TELEGRAM_CHANNEL_ID")
+        return False
+
+    async with aiohttp.ClientSession() as session:
+        return await send_telegram_message_async(session, build_report_message(results))
+
+
+async def main():
+    """Основная функция"""
+    configure_metrics('telegram_html_async')
+    try:
+        success = await main_async()
+    finally:
+        # Сохраняем метрики этапов для мониторинга
+        write_openmetrics()
+    print("Готово!" if success else "Публикация отчетов завершилась с ошибками.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Асинхронная публикация HTML-отчетов о самых дешевых квартирах")
+    args = add_profile_arguments(parser).parse_args()
+    if args.profile:
+        profile_call(lambda: asyncio.run(main()), 'async_html_publisher', args.profile_top)
+    else:
+        asyncio.run(main())
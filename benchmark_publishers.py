@@ -0,0 +1,571 @@
+"""
+Сквозной бенчмарк всех трех публикаторов.
+
+Замеряет длительность каждого этапа (выборка из БД, обработка pandas, построение
+карты, рендеринг Jinja, загрузка на FTP, отправка в Telegram) на синтетических
+данных нескольких масштабов. Внешние сервисы заменяются локальными заглушками:
+PostgreSQL из параметров BENCH_DB_*, FTP-сервер pyftpdlib и имитация Bot API на aiohttp.
+
+Те же этапы с базовыми линиями pytest-benchmark: python -m pytest benchmarks
+(см. benchmarks/test_publisher_stages.py). Этот скрипт остается для сравнительных
+замеров вариантов реализации (флаги ниже).
+
+Использование:
+    python benchmark_publishers.py --scales small,medium --save baseline
+    python benchmark_publishers.py --scales small --compare bench_results/baseline.json
+    python benchmark_publishers.py --scales small --no-db
+    python benchmark_publishers.py --scales medium --query-plans
+    python benchmark_publishers.py --scales large --fetch-methods
+    python benchmark_publishers.py --scales large --parallel-fetch
+    python benchmark_publishers.py --scales large --map-markers
+    python benchmark_publishers.py --scales large --neighbourhood
+    python benchmark_publishers.py --scales small --outliers
+    python benchmark_publishers.py --scales large --dedup
+    python benchmark_publishers.py --scales small --no-db --link-check
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import statistics
+from datetime import datetime
+
+import pandas as pd
+import psycopg2
+
+import analysis_cache
+import link_checker
+from copy_fetch import read_sql_copy
+from parallel_fetch import parallel_read_query, close_fetch_pools
+import map_aggregation
+import neighbourhood_value
+from price_outliers import flag_price_outliers
+from listing_dedup import collapse_duplicates
+import telegram_html_publisher
+import price_changes_publisher
+import medium_apartments_publisher
+from mock_services import MockBotApi, MockListingSite, BENCH_BOT_TOKEN, BENCH_CHAT_ID
+from query_builder import build_cheapest_apartments_query, execute_prepared, statement_name, to_positional
+from synthetic_data import (BENCH_DB_PARAMS, BENCHMARK_SCALES, generate_benchmark_dataset, generate_price_changes,
+                            add_reposted_duplicates, load_into_postgres)
+
+# Каталог для сохранения результатов и базовых линий
+BENCH_RESULTS_DIR = os.getenv('BENCH_RESULTS_DIR', 'bench_results')
+
+# Наборы фильтров запроса самых дешевых квартир для проверки планов (--query-plans)
+QUERY_PLAN_CASES = {
+    'default': None,
+    'area_40_60_top5': {'area_min': 40, 'area_max': 60, 'top_n': 5},
+    'rooms_price': {'area_max': None, 'rooms': [1, 2], 'price_max': 2_000_000},
+    'locations_top10': {'area_max': None, 'locations': ['Dubai Marina', 'Business Bay'], 'top_n': 10}
+}
+
+# Объемы выборки для сравнения read_sql_query и COPY в Arrow (--fetch-methods)
+FETCH_BENCH_ROWS = (100_000, 1_000_000)
+
+# Количество партиций для сравнения параллельной выборки (--parallel-fetch)
+PARALLEL_BENCH_PARTITIONS = (1, 2, 4, 8)
+
+# Количество точек карты с MarkerCluster для сравнения с сеткой (--map-markers):
+# построение отдельных маркеров на всем рынке заняло бы слишком много времени
+MAP_BENCH_CLUSTER_POINTS = 5000
+
+# Количество квартир для попарного сравнения расстояний (--neighbourhood)
+NEIGHBOURHOOD_BENCH_PAIRWISE_POINTS = 5000
+
+# Размер набора изменений цен для поиска выбросов (--outliers)
+OUTLIER_BENCH_ROWS = 1_000_000
+
+# Количество ссылок и задержка ответа имитации сайта объявлений (--link-check)
+LINK_BENCH_LISTINGS = 2000
+LINK_BENCH_LATENCY = 0.05
+
+# Доля объявлений, повторно выставленных другим агентом (--dedup)
+DEDUP_BENCH_REPOST_RATE = 0.1
+
+
+def _serve_ftp(root, port_queue):
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', root, perm='elradfmwMT')
+    handler = FTPHandler
+    handler.authorizer = authorizer
+    server = FTPServer(('127.0.0.1', 0), handler)
+    port_queue.put(server.address[1])
+    server.serve_forever()
+
+
+class LocalFtpServer:
+    """
+    Локальный FTP-сервер pyftpdlib во временном каталоге.
+    Запускается в отдельном процессе: pyftpdlib меняет текущий каталог процесса.
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='bench_ftp_')
+        self._process = None
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve_ftp, args=(self.root, port_queue), daemon=True)
+        self._process.start()
+        return port_queue.get(timeout=30)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+
+def bench(results, stage, func, *args, repeat=3, **kwargs):
+    """Выполняет func repeat раз, записывает min/median длительности и возвращает последний результат."""
+    timings = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    results[stage] = {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'repeat': repeat
+    }
+    print(f"  {stage:<40} min {min(timings):8.3f} с   median {statistics.median(timings):8.3f} с")
+    return value
+
+
+def cheapest_frame_from_synthetic(df, area_max=40, top_n=3):
+    """Повторяет на pandas запрос fetch_cheapest_apartments_by_region (для режима без БД)."""
+    latest = df.sort_values('updated_at').groupby('id').tail(1)
+    band = latest[(latest['area'] <= area_max) & (latest['price'] > 0)].copy()
+    band['rank'] = band.groupby('location')['price'].rank(method='first').astype(int)
+    top = band[band['rank'] <= top_n].sort_values(['location', 'rank'])
+    coords = top['geography'].apply(telegram_html_publisher.parse_geography)
+    top['latitude'] = [c[0] for c in coords]
+    top['longitude'] = [c[1] for c in coords]
+    top['url'] = top['id'].apply(lambda x: f"https://www.bayut.com/property/{x}/")
+    return top.dropna(subset=['latitude', 'longitude'])
+
+
+def _plan_nodes(plan):
+    """Возвращает список узлов плана EXPLAIN (FORMAT JSON) в виде 'тип [индекс или таблица]'."""
+    node = plan['Node Type']
+    target = plan.get('Index Name') or plan.get('Relation Name')
+    nodes = [f"{node} [{target}]" if target else node]
+    for child in plan.get('Plans', []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def bench_query_plans(results, conn, repeat):
+    """
+    Замеряет запрос самых дешевых квартир с разными фильтрами: через подготовленный
+    оператор и без него, и сохраняет общий (generic) план, который сервер кэширует
+    для оператора. Последовательное сканирование bayut_properties отмечается в выводе.
+    """
+    for case, filters in QUERY_PLAN_CASES.items():
+        query, params = build_cheapest_apartments_query(filters)
+        df = bench(results, f"query.{case}.prepared", execute_prepared, conn, query, params, repeat=repeat)
+        results[f"query.{case}.prepared"]['rows'] = len(df)
+        bench(results, f"query.{case}.unprepared", pd.read_sql_query, query, conn, params=params, repeat=repeat)
+
+        # execute_prepared уже подготовил оператор; объясняем его общий план
+        positional_query, values = to_positional(query, params)
+        placeholders = f" ({', '.join(['%s'] * len(values))})" if values else ""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET plan_cache_mode = force_generic_plan")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE {statement_name(positional_query)}{placeholders}", values)
+            plan = cursor.fetchone()[0][0]['Plan']
+            cursor.execute("RESET plan_cache_mode")
+        finally:
+            cursor.close()
+        nodes = _plan_nodes(plan)
+        seq_scan = 'Seq Scan [bayut_properties]' in nodes
+        results[f"query.{case}.plan"] = {'nodes': nodes, 'seq_scan': seq_scan, 'total_cost': plan['Total Cost']}
+        print(f"  {'query.' + case + '.plan':<40} {' -> '.join(nodes)}"
+              + ("  <-- ПОСЛЕДОВАТЕЛЬНОЕ СКАНИРОВАНИЕ" if seq_scan else ""))
+
+
+def bench_fetch_methods(results, conn, repeat):
+    """Сравнивает выборку pd.read_sql_query и COPY TO STDOUT в Arrow на FETCH_BENCH_ROWS строк."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM bayut_properties")
+    total_rows = cursor.fetchone()[0]
+    cursor.close()
+
+    query = "SELECT * FROM bayut_properties LIMIT %(limit)s"
+    for rows in FETCH_BENCH_ROWS:
+        if rows > total_rows:
+            print(f"  (выборка {rows} строк пропущена: в таблице {total_rows} строк)")
+            continue
+        params = {'limit': rows}
+        bench(results, f"fetch.{rows}.read_sql_query", pd.read_sql_query, query, conn, params=params, repeat=repeat)
+        bench(results, f"fetch.{rows}.copy_arrow", read_sql_copy, query, conn, params, repeat=repeat)
+        speedup = results[f"fetch.{rows}.read_sql_query"]['median'] / results[f"fetch.{rows}.copy_arrow"]['median']
+        results[f"fetch.{rows}.copy_arrow"]['speedup'] = speedup
+        print(f"  {'fetch.' + str(rows) + '.speedup':<40} x{speedup:.2f}")
+
+
+def bench_parallel_fetch(results, repeat):
+    """Замеряет запрос самых дешевых квартир по всему рынку при разном количестве партиций по location."""
+    query, params = build_cheapest_apartments_query({'area_max': None, 'top_n': 20})
+    for partitions in PARALLEL_BENCH_PARTITIONS:
+        df = bench(results, f"parallel_fetch.k{partitions}", parallel_read_query, query, params,
+                   partition_by='location', partitions=partitions, db_params=BENCH_DB_PARAMS,
+                   order_by=['location', 'rank'], repeat=repeat)
+        results[f"parallel_fetch.k{partitions}"]['rows'] = len(df)
+    base = results[f"parallel_fetch.k{PARALLEL_BENCH_PARTITIONS[0]}"]['median']
+    for partitions in PARALLEL_BENCH_PARTITIONS[1:]:
+        speedup = base / results[f"parallel_fetch.k{partitions}"]['median']
+        results[f"parallel_fetch.k{partitions}"]['speedup'] = speedup
+        print(f"  {'parallel_fetch.k' + str(partitions) + '.speedup':<40} x{speedup:.2f}")
+    close_fetch_pools()
+
+
+def market_map_frame(dataset):
+    """Последние версии всех объявлений с координатами — карта всего рынка."""
+    latest = dataset.sort_values('updated_at').groupby('id').tail(1)
+    latest = latest[latest['price'] > 0].reset_index(drop=True)
+    coords = latest['geography'].str.extract(r'Широта: ([-\d.]+), Долгота: ([-\d.]+)').astype(float)
+    latest['latitude'] = coords[0]
+    latest['longitude'] = coords[1]
+    latest = latest.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+    latest['rank'] = latest.groupby('location')['price'].rank(method='first').astype(int)
+    latest['url'] = telegram_html_publisher.PROPERTY_URL_PREFIX + latest['id'].astype(str) + '/'
+    return latest
+
+
+def render_map(df, mode):
+    """Строит карту в заданном режиме маркеров и возвращает размер HTML в байтах."""
+    previous = map_aggregation.MAP_MARKER_MODE
+    map_aggregation.MAP_MARKER_MODE = mode
+    try:
+        return len(telegram_html_publisher.create_interactive_map(df).get_root().render().encode('utf-8'))
+    finally:
+        map_aggregation.MAP_MARKER_MODE = previous
+
+
+def bench_map_markers(results, dataset, repeat):
+    """Сравнивает карту всего рынка по сетке с MarkerCluster на выборке точек."""
+    market = market_map_frame(dataset)
+    levels = bench(results, 'map.build_grid_levels', map_aggregation.build_grid_levels, market, repeat=repeat)
+    results['map.build_grid_levels']['points'] = len(market)
+    results['map.build_grid_levels']['cells'] = int(sum(len(level) for level in levels.values()))
+
+    results['map.grid.bytes'] = bench(results, 'map.grid', render_map, market, 'grid', repeat=repeat)
+    sample = market.head(MAP_BENCH_CLUSTER_POINTS)
+    results['map.cluster.bytes'] = bench(results, f"map.cluster.{len(sample)}", render_map, sample, 'cluster',
+                                         repeat=1)
+    results['map.grid.sample.bytes'] = bench(results, f"map.grid.{len(sample)}", render_map, sample, 'grid',
+                                             repeat=repeat)
+    print(f"  {'map.grid.bytes':<40} {results['map.grid.bytes'] / 1e6:.2f} МБ ({len(market)} точек)")
+    print(f"  {'map.cluster.bytes':<40} {results['map.cluster.bytes'] / 1e6:.2f} МБ ({len(sample)} точек)")
+
+
+def pairwise_neighbour_medians(points, values, k):
+    """Медианы K ближайших соседей полным попарным перебором расстояний (для сравнения с KD-деревом)."""
+    import numpy as np
+    distances = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+    np.fill_diagonal(distances, np.inf)
+    nearest = np.argpartition(distances, k, axis=1)[:, :k]
+    return np.median(values[nearest], axis=1)
+
+
+def bench_neighbourhood(results, dataset, repeat):
+    """Сравнение с соседями по всему рынку через KD-дерево и попарный перебор на выборке."""
+    market = market_map_frame(dataset)
+    bench(results, 'neighbourhood.knn', neighbourhood_value.compute_neighbourhood_value, market, repeat=repeat)
+    bench(results, 'neighbourhood.radius_150', neighbourhood_value.compute_neighbourhood_value, market,
+          radius=150, repeat=repeat)
+    results['neighbourhood.knn']['points'] = len(market)
+
+    sample = market.head(NEIGHBOURHOOD_BENCH_PAIRWISE_POINTS)
+    points = neighbourhood_value.project_to_metres(sample['latitude'], sample['longitude'])
+    values = (sample['price'] / sample['area']).to_numpy(dtype=float)
+    k = neighbourhood_value.NEIGHBOURHOOD_K
+    bench(results, f"neighbourhood.knn.{len(sample)}", neighbourhood_value.neighbour_medians, points, values, k,
+          repeat=repeat)
+    bench(results, f"neighbourhood.pairwise.{len(sample)}", pairwise_neighbour_medians, points, values, k,
+          repeat=1)
+
+
+def static_price_change_mask(df):
+    """Прежний фильтр публикаторов: изменения от 0.1% до 25% по модулю."""
+    abs_pct_change = df['pct_change'].abs()
+    return df[(abs_pct_change <= 25) & (abs_pct_change > 0.1)]
+
+
+def bench_outliers(results, repeat):
+    """Поиск выбросов на OUTLIER_BENCH_ROWS изменениях цен и качество по заложенным отметкам."""
+    changes = generate_price_changes(OUTLIER_BENCH_ROWS)
+    bench(results, 'outliers.static_mask', static_price_change_mask, changes, repeat=repeat)
+    flagged = bench(results, 'outliers.robust', flag_price_outliers, changes, repeat=repeat)
+    results['outliers.robust']['rows'] = len(changes)
+
+    kept = static_price_change_mask(changes)
+    for label in ('typo', 'anomaly'):
+        expected = flagged['expected'] == label
+        detected = flagged['outlier'] == label
+        recall = (expected & detected).sum() / max(expected.sum(), 1)
+        precision = (expected & detected).sum() / max(detected.sum(), 1)
+        results[f"outliers.{label}"] = {'recall': float(recall), 'precision': float(precision)}
+        print(f"  {'outliers.' + label:<40} recall {recall:.3f}   precision {precision:.3f}")
+    static_anomalies = (changes['expected'] == 'anomaly').sum() - (kept['expected'] == 'anomaly').sum()
+    static_typos = (kept['expected'] == 'typo').sum()
+    print(f"  {'outliers.static_mask':<40} скрыто резких снижений {static_anomalies}, "
+          f"пропущено ошибок ввода {static_typos}")
+
+
+def bench_dedup(results, dataset, repeat):
+    """Схлопывание повторов на рынке с DEDUP_BENCH_REPOST_RATE повторных публикаций."""
+    market = market_map_frame(add_reposted_duplicates(dataset, DEDUP_BENCH_REPOST_RATE))
+    market = market.sort_values('price', kind='stable')
+    collapsed = bench(results, 'dedup.collapse_duplicates', collapse_duplicates, market, repeat=repeat)
+
+    objects = market['original_id'].nunique()
+    # Объединены разные объекты, если у одного оставшегося объявления копии с разными original_id
+    kept_objects = collapsed['original_id'].nunique()
+    results['dedup.collapse_duplicates'].update({
+        'rows': len(market), 'kept': len(collapsed), 'objects': int(objects), 'kept_objects': int(kept_objects)
+    })
+    print(f"  {'dedup.rows':<40} {len(market)} -> {len(collapsed)} (объектов {objects}, "
+          f"потеряно объектов при слиянии {objects - kept_objects})")
+
+
+def bench_link_check(results, repeat):
+    """Проверка LINK_BENCH_LISTINGS ссылок на имитации сайта с двумя хостами: без кэша, с кэшем и по одной."""
+    site = MockListingSite(latency=LINK_BENCH_LATENCY)
+    base_url = site.start()
+    # 127.0.0.1 и localhost — разные хосты для ограничения на хост
+    hosts = [base_url, base_url.replace('127.0.0.1', 'localhost')]
+    items = [(listing_id, f"{hosts[listing_id % 2]}/property/{listing_id}/")
+             for listing_id in range(1, LINK_BENCH_LISTINGS + 1)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            def cold():
+                return asyncio.run(link_checker.check_links(items, link_checker.LinkStatusCache(os.path.join(tmp, 'c.json'))))
+
+            statuses = bench(results, 'link_check.cold', cold, repeat=repeat)
+            cache = link_checker.LinkStatusCache(os.path.join(tmp, 'warm.json'))
+            asyncio.run(link_checker.check_links(items, cache))
+            cache.save()
+            calls_before = dict(site.calls)
+            bench(results, 'link_check.cached',
+                  lambda: asyncio.run(link_checker.check_links(items, link_checker.LinkStatusCache.load(cache.path))),
+                  repeat=repeat)
+            cached_requests = sum(site.calls.values()) - sum(calls_before.values())
+            subset = items[:LINK_BENCH_LISTINGS // 10]
+            bench(results, 'link_check.sequential_10pct',
+                  lambda: asyncio.run(link_checker.check_links(subset, concurrency=1, per_host=1)), repeat=1)
+    finally:
+        site.stop()
+
+    dead = sum(status == 'dead' for status in statuses.values())
+    expected_dead = sum(listing_id % 10 == 0 for listing_id, _ in items)
+    results['link_check.cold'].update({
+        'listings': len(items), 'dead': dead, 'unknown': sum(status == 'unknown' for status in statuses.values()),
+        'max_per_host': max(site.max_active.values()), 'cached_requests': cached_requests
+    })
+    print(f"  {'link_check.dead':<40} {dead} из {len(items)} (ожидалось {expected_dead}), "
+          f"запросов к хосту одновременно не больше {max(site.max_active.values())} "
+          f"(лимит {link_checker.LINK_CHECK_PER_HOST}), запросов при кэше {cached_requests}")
+
+
+def run_scale(scale, use_db, bot_api_url, repeat, query_plans=False, fetch_methods=False, parallel_fetch=False,
+              map_markers=False, neighbourhood=False, outliers=False, dedup=False, link_check=False):
+    """Прогоняет все этапы публикаторов на наборе данных заданного масштаба."""
+    results = {}
+    print(f"\nМасштаб '{scale}': {BENCHMARK_SCALES[scale]}")
+    dataset = bench(results, 'setup.generate_dataset', generate_benchmark_dataset, scale, repeat=1)
+    results['setup.generate_dataset']['rows'] = len(dataset)
+
+    conn = None
+    if use_db:
+        conn = psycopg2.connect(**BENCH_DB_PARAMS)
+        bench(results, 'setup.load_into_postgres', load_into_postgres, conn, dataset, repeat=1, truncate=True)
+
+    try:
+        if conn is not None and query_plans:
+            bench_query_plans(results, conn, repeat)
+        if conn is not None and fetch_methods:
+            bench_fetch_methods(results, conn, repeat)
+        if conn is not None and parallel_fetch:
+            bench_parallel_fetch(results, repeat)
+        if map_markers:
+            bench_map_markers(results, dataset, repeat)
+        if neighbourhood:
+            bench_neighbourhood(results, dataset, repeat)
+        if outliers:
+            bench_outliers(results, repeat)
+        if dedup:
+            bench_dedup(results, dataset, repeat)
+        if link_check:
+            bench_link_check(results, repeat)
+
+        # HTML-публикатор
+        if conn is not None:
+            cheapest_df = bench(results, 'html.fetch_cheapest_apartments_by_region',
+                                telegram_html_publisher.fetch_cheapest_apartments_by_region, conn,
+                                repeat=repeat)
+        else:
+            cheapest_df = cheapest_frame_from_synthetic(dataset)
+        results.setdefault('html.fetch_cheapest_apartments_by_region', {})['rows'] = len(cheapest_df)
+
+        bench(results, 'html.create_interactive_map',
+              telegram_html_publisher.create_interactive_map, cheapest_df, repeat=repeat)
+        html_path, html_name = bench(results, 'html.generate_html_report',
+                                     telegram_html_publisher.generate_html_report, cheapest_df, repeat=repeat)
+        results['html.generate_html_report']['bytes'] = os.path.getsize(html_path)
+        bench(results, 'html.upload_to_ftp', telegram_html_publisher.upload_to_ftp, html_path, html_name,
+              repeat=repeat)
+        bench(results, 'html.send_telegram_message',
+              lambda: asyncio.run(telegram_html_publisher.send_telegram_message(
+                  BENCH_BOT_TOKEN, BENCH_CHAT_ID, f"<b>Отчет</b>\n{html_name}")),
+              repeat=repeat)
+        os.remove(html_path)
+
+        # Публикаторы изменений цен
+        if conn is None:
+            print("  (этапы публикаторов изменений цен пропущены: нет базы данных)")
+            return results
+
+        for prefix, module in (('price_changes', price_changes_publisher),
+                               ('medium_apartments', medium_apartments_publisher)):
+            analysis = bench(results, f"{prefix}.find_price_change_apartments",
+                             lambda: asyncio.run(module.find_price_change_apartments()), repeat=repeat)
+            if not analysis:
+                continue
+            results[f"{prefix}.find_price_change_apartments"]['bytes'] = len(analysis.encode('utf-8'))
+            chunks = bench(results, f"{prefix}.split_text_into_chunks",
+                           module.split_text_into_chunks, analysis, repeat=repeat)
+            results[f"{prefix}.split_text_into_chunks"]['chunks'] = len(chunks)
+
+            publisher = module.TelegramPublisher()
+            publisher.api_url = f"{bot_api_url}/bot{BENCH_BOT_TOKEN}/sendMessage"
+            publisher.chat_id = BENCH_CHAT_ID
+            # Отправка включает паузы между частями, поэтому выполняется один раз
+            publisher.delivery_mode = 'chunks'
+            bench(results, f"{prefix}.send_message",
+                  lambda: asyncio.run(publisher.send_message(analysis)), repeat=1)
+            # Тот же анализ одним документом со сводкой
+            publisher.delivery_mode = 'document'
+            bench(results, f"{prefix}.send_document",
+                  lambda: asyncio.run(publisher.send_message(analysis)), repeat=repeat)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return results
+
+
+def compare_with_baseline(current, baseline_path, threshold):
+    """Печатает отношение текущих медиан к базовой линии и возвращает число регрессий."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+
+    regressions = 0
+    print(f"\nСравнение с базовой линией {baseline_path} (порог {threshold:.0%}):")
+    for scale, stages in current.items():
+        for stage, stats in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if not base or not base.get('median') or 'median' not in stats:
+                continue
+            ratio = stats['median'] / base['median']
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  <-- РЕГРЕССИЯ'
+                regressions += 1
+            print(f"  {scale:<8} {stage:<40} x{ratio:6.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов публикаторов")
+    parser.add_argument('--scales', default='small', help="Масштабы через запятую: " + ', '.join(BENCHMARK_SCALES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-db', action='store_true', help="Не использовать PostgreSQL (только этапы без БД)")
+    parser.add_argument('--save', help="Сохранить результаты как базовую линию с этим именем")
+    parser.add_argument('--compare', help="Путь к базовой линии для сравнения")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Допустимое замедление относительно базовой линии")
+    parser.add_argument('--query-plans', action='store_true',
+                        help="Замерить запрос самых дешевых квартир с разными фильтрами и показать его планы")
+    parser.add_argument('--fetch-methods', action='store_true',
+                        help="Сравнить выборку read_sql_query и COPY в Arrow на 100 тыс. и 1 млн строк")
+    parser.add_argument('--parallel-fetch', action='store_true',
+                        help="Сравнить выборку по всему рынку одним запросом и K партициями")
+    parser.add_argument('--map-markers', action='store_true',
+                        help="Сравнить карту всего рынка по сетке ячеек с MarkerCluster")
+    parser.add_argument('--neighbourhood', action='store_true',
+                        help="Сравнение цен с соседями через KD-дерево и попарным перебором")
+    parser.add_argument('--outliers', action='store_true',
+                        help="Поиск выбросов изменений цен на 1 млн строк (медиана/MAD против порога 25%%)")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Схлопывание повторных публикаций одной квартиры")
+    parser.add_argument('--link-check', action='store_true',
+                        help="Проверка ссылок на объявления на локальной имитации сайта")
+    args = parser.parse_args(argv)
+
+    # Кэш результатов анализа исказил бы повторные замеры
+    analysis_cache.CACHE_ENABLED = False
+    # Публикаторы не должны обращаться к настоящему сайту объявлений
+    link_checker.LINK_CHECK = False
+
+    bot_api = MockBotApi()
+    ftp_server = LocalFtpServer()
+    bot_api_url = bot_api.start()
+    ftp_port = ftp_server.start()
+
+    # Направляем публикаторы на локальные заглушки
+    telegram_html_publisher.TELEGRAM_API_URL = bot_api_url
+    telegram_html_publisher.FTP_HOST = '127.0.0.1'
+    telegram_html_publisher.FTP_PORT = ftp_port
+    telegram_html_publisher.FTP_USER = 'bench'
+    telegram_html_publisher.FTP_PASSWORD = 'bench'
+    telegram_html_publisher.FTP_DIRECTORY = '/reports/'
+    for module in (price_changes_publisher, medium_apartments_publisher):
+        module.DB_PARAMS.update(BENCH_DB_PARAMS)
+
+    all_results = {}
+    try:
+        for scale in [s.strip() for s in args.scales.split(',') if s.strip()]:
+            all_results[scale] = run_scale(scale, not args.no_db, bot_api_url, args.repeat, args.query_plans, args.fetch_methods,
+                                          args.parallel_fetch, args.map_markers, args.neighbourhood,
+                                          args.outliers, args.dedup, args.link_check)
+    finally:
+        bot_api.stop()
+        ftp_server.stop()
+
+    print(f"\nВызовы Bot API: {bot_api.calls}")
+
+    payload = {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'results': all_results
+    }
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    name = args.save or datetime.now().strftime('run_%Y%m%d_%H%M%S')
+    output_path = os.path.join(BENCH_RESULTS_DIR, f"{name}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в файл: {output_path}")
+
+    if args.compare:
+        regressions = compare_with_baseline(all_results, args.compare, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
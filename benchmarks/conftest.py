@@ -0,0 +1,81 @@
+"""
+Окружение бенчмарков pytest-benchmark: синтетические данные нескольких масштабов,
+база BENCH_DB_*, локальный FTP-сервер pyftpdlib и имитация Bot API на aiohttp.
+
+Масштабы задаются переменной BENCH_SCALES (через запятую, по умолчанию small).
+"""
+
+import os
+
+import psycopg2
+import pytest
+
+import analysis_cache
+import link_checker
+import telegram_html_publisher
+import price_changes_publisher
+import medium_apartments_publisher
+from benchmark_publishers import LocalFtpServer
+from mock_services import MockBotApi, BENCH_BOT_TOKEN, BENCH_CHAT_ID
+from synthetic_data import BENCH_DB_PARAMS, generate_benchmark_dataset, load_into_postgres
+
+BENCH_SCALES = [scale.strip() for scale in os.getenv('BENCH_SCALES', 'small').split(',') if scale.strip()]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_publishers():
+    """Кэш анализа исказил бы повторные замеры, а проверка ссылок обращалась бы к настоящему сайту."""
+    analysis_cache.CACHE_ENABLED = False
+    link_checker.LINK_CHECK = False
+    for module in (price_changes_publisher, medium_apartments_publisher):
+        module.DB_PARAMS.update(BENCH_DB_PARAMS)
+
+
+@pytest.fixture(scope='session')
+def bot_api():
+    api = MockBotApi()
+    url = api.start()
+    telegram_html_publisher.TELEGRAM_API_URL = url
+    yield url
+    api.stop()
+
+
+@pytest.fixture(scope='session')
+def ftp_server():
+    server = LocalFtpServer()
+    telegram_html_publisher.FTP_HOST = '127.0.0.1'
+    telegram_html_publisher.FTP_PORT = server.start()
+    telegram_html_publisher.FTP_USER = 'bench'
+    telegram_html_publisher.FTP_PASSWORD = 'bench'
+    telegram_html_publisher.FTP_DIRECTORY = '/reports/'
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session', params=BENCH_SCALES)
+def dataset(request):
+    return generate_benchmark_dataset(request.param)
+
+
+@pytest.fixture(scope='session')
+def bench_conn(dataset):
+    """Соединение с базой BENCH_DB_*, в которую загружен набор данных текущего масштаба."""
+    try:
+        conn = psycopg2.connect(**BENCH_DB_PARAMS)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"база BENCH_DB_* недоступна: {e}")
+    load_into_postgres(conn, dataset, truncate=True)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def bench_publisher(bot_api):
+    """Фабрика публикаторов изменений цен, отправляющих в имитацию Bot API."""
+    def make(module, delivery_mode):
+        publisher = module.TelegramPublisher()
+        publisher.api_url = f"{bot_api}/bot{BENCH_BOT_TOKEN}/sendMessage"
+        publisher.chat_id = BENCH_CHAT_ID
+        publisher.delivery_mode = delivery_mode
+        return publisher
+    return make
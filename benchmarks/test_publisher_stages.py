@@ -0,0 +1,93 @@
+"""
+Длительность этапов трех публикаторов: выборка из БД, карта, HTML, FTP, Telegram.
+
+Запуск и сравнение с сохраненной базовой линией:
+    python -m pytest benchmarks --benchmark-autosave
+    BENCH_SCALES=small,medium python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:20%
+"""
+
+import os
+import asyncio
+
+import pytest
+
+import telegram_html_publisher
+import price_changes_publisher
+import medium_apartments_publisher
+from benchmark_publishers import cheapest_frame_from_synthetic, BENCH_BOT_TOKEN, BENCH_CHAT_ID
+
+# Количество повторов каждого этапа
+BENCH_ROUNDS = int(os.getenv('BENCH_ROUNDS', '3'))
+
+PRICE_PUBLISHERS = {
+    'price_changes': price_changes_publisher,
+    'medium_apartments': medium_apartments_publisher
+}
+
+
+def run(benchmark, func, *args, rounds=BENCH_ROUNDS):
+    return benchmark.pedantic(func, args=args, rounds=rounds, iterations=1)
+
+
+@pytest.fixture(scope='module')
+def cheapest_df(dataset):
+    return cheapest_frame_from_synthetic(dataset)
+
+
+@pytest.fixture(scope='module')
+def html_report(cheapest_df):
+    path, name = telegram_html_publisher.generate_html_report(cheapest_df)
+    yield path, name
+    os.remove(path)
+
+
+@pytest.fixture(scope='module')
+def analyses(bench_conn):
+    return {name: asyncio.run(module.find_price_change_apartments()) for name, module in PRICE_PUBLISHERS.items()}
+
+
+def test_fetch_cheapest_apartments_by_region(benchmark, bench_conn):
+    df = run(benchmark, telegram_html_publisher.fetch_cheapest_apartments_by_region, bench_conn)
+    assert df is not None and not df.empty
+
+
+def test_create_interactive_map(benchmark, cheapest_df):
+    run(benchmark, telegram_html_publisher.create_interactive_map, cheapest_df)
+
+
+def test_generate_html_report(benchmark, cheapest_df):
+    path, _ = run(benchmark, telegram_html_publisher.generate_html_report, cheapest_df)
+    benchmark.extra_info['bytes'] = os.path.getsize(path)
+    os.remove(path)
+
+
+def test_upload_to_ftp(benchmark, ftp_server, html_report):
+    assert run(benchmark, telegram_html_publisher.upload_to_ftp, *html_report)
+
+
+def test_send_telegram_message(benchmark, bot_api, html_report):
+    message = f"<b>Отчет</b>\n{html_report[1]}"
+    assert run(benchmark, lambda: asyncio.run(
+        telegram_html_publisher.send_telegram_message(BENCH_BOT_TOKEN, BENCH_CHAT_ID, message)))
+
+
+@pytest.mark.parametrize('name', PRICE_PUBLISHERS)
+def test_find_price_change_apartments(benchmark, bench_conn, name):
+    analysis = run(benchmark, lambda: asyncio.run(PRICE_PUBLISHERS[name].find_price_change_apartments()))
+    assert analysis
+    benchmark.extra_info['bytes'] = len(analysis.encode('utf-8'))
+
+
+@pytest.mark.parametrize('name', PRICE_PUBLISHERS)
+def test_split_text_into_chunks(benchmark, analyses, name):
+    chunks = run(benchmark, PRICE_PUBLISHERS[name].split_text_into_chunks, analyses[name])
+    benchmark.extra_info['chunks'] = len(chunks)
+
+
+@pytest.mark.parametrize('delivery_mode', ['chunks', 'document'])
+@pytest.mark.parametrize('name', PRICE_PUBLISHERS)
+def test_send_analysis(benchmark, bench_publisher, analyses, name, delivery_mode):
+    publisher = bench_publisher(PRICE_PUBLISHERS[name], delivery_mode)
+    # Серия сообщений включает паузы между частями, поэтому отправляется один раз
+    rounds = 1 if delivery_mode == 'chunks' else BENCH_ROUNDS
+    assert run(benchmark, lambda: asyncio.run(publisher.send_message(analyses[name])), rounds=rounds)
@@ -0,0 +1,199 @@
+"""
+Единая точка входа для публикаторов и служебных команд.
+
+Тяжелые зависимости (pandas, folium, psycopg2, python-telegram-bot, aiohttp)
+импортируются только внутри подкоманд, которым они нужны, поэтому --help
+и служебные команды запускаются мгновенно.
+
+Использование:
+    python cli.py html [--profile]
+    python cli.py html-async [--profile]
+    python cli.py price-changes [--profile]
+    python cli.py medium-apartments [--profile]
+    python cli.py snapshot sync --partition-by date
+    python cli.py synthetic load --scale small --truncate
+    python cli.py benchmark --scales small --no-db
+    python cli.py region-history wow
+    python cli.py neighbourhood-value --k 15
+    python cli.py price-alerts listen
+    python cli.py link-check 123456 789012
+    python cli.py import-budget
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Бюджеты времени импорта модулей (мс, кумулятивно по python -X importtime).
+# Публикаторы импортируются примерно за 50-70 мс (в основном asyncio); один импорт
+# pandas занимает около 450 мс, поэтому бюджет сразу ловит возврат тяжелых импортов
+IMPORT_BUDGETS_MS = {
+    'cli': 30,
+    'telegram_html_publisher': 150,
+    'price_changes_publisher': 150,
+    'medium_apartments_publisher': 150,
+    'async_html_publisher': 150
+}
+
+# Пакеты, которые модуль не должен загружать при импорте
+_HEAVY_PACKAGES = ('pandas', 'numpy', 'pyarrow', 'psycopg2', 'dotenv', 'folium', 'telegram', 'jinja2')
+FORBIDDEN_AT_IMPORT = {
+    'cli': _HEAVY_PACKAGES + ('aiohttp', 'asyncio'),
+    'telegram_html_publisher': _HEAVY_PACKAGES + ('aiohttp',),
+    'price_changes_publisher': _HEAVY_PACKAGES + ('aiohttp',),
+    'medium_apartments_publisher': _HEAVY_PACKAGES + ('aiohttp',),
+    'async_html_publisher': _HEAVY_PACKAGES + ('aiohttp', 'asyncpg', 'aioftp')
+}
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def _load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def _run_publisher(module_name, args):
+    """Импортирует модуль публикатора и запускает его main() (с профилированием при --profile)."""
+    _load_env()
+    import asyncio
+    import importlib
+    from profiling import profile_call
+
+    module = importlib.import_module(module_name)
+    if asyncio.iscoroutinefunction(module.main):
+        target = lambda: asyncio.run(module.main())
+    else:
+        target = module.main
+
+    if args.profile:
+        return profile_call(target, module_name, args.profile_top)
+    return target()
+
+
+def _run_tool(module_name, argv):
+    """Передает оставшиеся аргументы в main(argv) служебного модуля."""
+    _load_env()
+    import importlib
+    return importlib.import_module(module_name).main(argv)
+
+
+def measure_import(module_name, runs=3):
+    """
+    Замеряет время импорта модуля в отдельном интерпретаторе через python -X importtime.
+    Возвращает (лучшее кумулятивное время в мс, множество загруженных пакетов верхнего уровня).
+    """
+    best_ms = None
+    packages = set()
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+            cwd=cwd, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Не удалось импортировать {module_name}:\n{completed.stderr[-2000:]}")
+        cumulative_ms = None
+        for line in completed.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if not match:
+                continue
+            name = match.group(4)
+            packages.add(name.split('.')[0])
+            if name == module_name:
+                cumulative_ms = int(match.group(2)) / 1000
+        if cumulative_ms is not None and (best_ms is None or cumulative_ms < best_ms):
+            best_ms = cumulative_ms
+    return best_ms, packages
+
+
+def check_import_budgets(budgets=None, runs=3):
+    """Проверяет бюджеты времени импорта и запрещенные зависимости. Возвращает число нарушений."""
+    budgets = budgets or IMPORT_BUDGETS_MS
+    violations = 0
+    for module_name, budget_ms in budgets.items():
+        elapsed_ms, packages = measure_import(module_name, runs)
+        forbidden = sorted(set(FORBIDDEN_AT_IMPORT.get(module_name, ())) & packages)
+        status = 'OK'
+        if elapsed_ms is None or elapsed_ms > budget_ms:
+            status = 'ПРЕВЫШЕН БЮДЖЕТ'
+            violations += 1
+        if forbidden:
+            status = f"ЛИШНИЕ ИМПОРТЫ: {', '.join(forbidden)}"
+            violations += 1
+        elapsed_text = f"{elapsed_ms:8.1f}" if elapsed_ms is not None else '       ?'
+        print(f"{module_name:<32} {elapsed_text} мс / {budget_ms:>6} мс   {status}")
+    return violations
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Публикаторы аналитики рынка недвижимости Дубая")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, help_text in (
+        ('html', "HTML-отчет о самых дешевых квартирах (FTP + Telegram)"),
+        ('html-async', "Асинхронная публикация HTML-отчетов по нескольким диапазонам площади"),
+        ('price-changes', "Анализ изменений цен на квартиры до 40 кв.м."),
+        ('medium-apartments', "Анализ изменений цен на квартиры 40-60 кв.м.")
+    ):
+        publisher_parser = subparsers.add_parser(command, help=help_text)
+        publisher_parser.add_argument('--profile', action='store_true',
+                                      help="Профилировать запуск (cProfile + tracemalloc)")
+        publisher_parser.add_argument('--profile-top', type=int, default=30,
+                                      help="Количество функций в текстовой сводке профиля")
+
+    for command, help_text in (
+        ('snapshot', "Локальный Parquet-снимок bayut_properties"),
+        ('synthetic', "Генерация синтетических данных"),
+        ('benchmark', "Бенчмарк этапов публикаторов"),
+        ('region-history', "Временной ряд агрегатов цен по регионам"),
+        ('neighbourhood-value', "Сравнение цены за кв.м. с ближайшими соседями"),
+        ('price-alerts', "Оповещения о снижении цен через LISTEN/NOTIFY"),
+        ('link-check', "Проверка, что объявления еще опубликованы")
+    ):
+        tool_parser = subparsers.add_parser(command, help=help_text, add_help=False)
+        tool_parser.add_argument('tool_args', nargs=argparse.REMAINDER)
+
+    budget_parser = subparsers.add_parser('import-budget', help="Проверить бюджеты времени импорта модулей")
+    budget_parser.add_argument('--runs', type=int, default=3, help="Количество замеров на модуль (берется лучший)")
+    return parser
+
+
+PUBLISHER_MODULES = {
+    'html': 'telegram_html_publisher',
+    'html-async': 'async_html_publisher',
+    'price-changes': 'price_changes_publisher',
+    'medium-apartments': 'medium_apartments_publisher'
+}
+
+TOOL_MODULES = {
+    'snapshot': 'local_snapshot',
+    'synthetic': 'synthetic_data',
+    'benchmark': 'benchmark_publishers',
+    'region-history': 'region_history',
+    'neighbourhood-value': 'neighbourhood_value',
+    'price-alerts': 'price_alerts',
+    'link-check': 'link_checker'
+}
+
+
+def main(argv=None):
+    parser = build_parser()
+    # Опции служебных команд (включая --help) передаются в их собственные парсеры
+    args, extra_args = parser.parse_known_args(argv)
+    if extra_args and args.command not in TOOL_MODULES:
+        parser.error(f"неизвестные аргументы: {' '.join(extra_args)}")
+
+    if args.command in PUBLISHER_MODULES:
+        _run_publisher(PUBLISHER_MODULES[args.command], args)
+    elif args.command in TOOL_MODULES:
+        _run_tool(TOOL_MODULES[args.command], extra_args + args.tool_args)
+    elif args.command == 'import-budget':
+        if check_import_budgets(runs=args.runs):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
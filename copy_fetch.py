@@ -0,0 +1,84 @@
+"""
+Выборка результатов запроса через COPY ... TO STDOUT прямо в Arrow.
+
+pd.read_sql_query получает строки через курсор psycopg2 как кортежи Python и
+затем собирает из них DataFrame. Здесь сервер отдает результат одним потоком
+COPY в формате CSV, а многопоточный парсер pyarrow разбирает его в колоночные
+буферы без создания объектов Python для каждой строки. Типы колонок берутся
+из описания запроса (NUMERIC -> float64, как и в read_sql_query).
+
+Ответ на COPY не содержит типов колонок (в протоколе PostgreSQL CopyOutResponse
+передает только их количество, и cursor.description после copy_expert пуст),
+поэтому описание запрашивается отдельным запросом LIMIT 0 — один раз для каждого
+текста запроса и базы данных, дальше используется сохраненное.
+"""
+
+import io
+
+import pyarrow as pa
+
+# OID типов PostgreSQL -> типы Arrow (остальные колонки читаются как строки)
+PG_TYPE_OIDS = {
+    16: pa.bool_(),
+    20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+    700: pa.float64(), 701: pa.float64(), 1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC')
+}
+
+# Типы колонок: (база данных, текст запроса, типы параметров) -> {колонка: тип Arrow}
+_column_types_cache = {}
+
+
+def _arrow_column_types(cursor, query):
+    """Получает имена и типы колонок результата, не выполняя сам запрос (LIMIT 0)."""
+    cursor.execute(f"SELECT * FROM ({query}\n) AS copy_query LIMIT 0")
+    return {column.name: PG_TYPE_OIDS.get(column.type_code, pa.string()) for column in cursor.description}
+
+
+def _params_signature(params):
+    """Типы параметров запроса: от них, а не от значений, зависят типы подставленных литералов."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return tuple(sorted((name, type(value).__name__) for name, value in params.items()))
+    return tuple(type(value).__name__ for value in params)
+
+
+def read_sql_copy(query, conn, params=None):
+    """
+    Выполняет запрос через COPY (query) TO STDOUT и возвращает DataFrame.
+    COPY не поддерживает связанные параметры, поэтому они подставляются на клиенте
+    через cursor.mogrify с тем же экранированием, что и в обычном execute.
+    """
+    from pyarrow import csv
+    from psycopg2.extensions import encodings
+
+    cursor = conn.cursor()
+    try:
+        sql = cursor.mogrify(query, params).decode(encodings.get(conn.encoding, 'utf-8'))
+        sql = sql.strip().rstrip(';')
+        cache_key = (conn.dsn, query, _params_signature(params))
+        column_types = _column_types_cache.get(cache_key)
+        if column_types is None:
+            column_types = _column_types_cache[cache_key] = _arrow_column_types(cursor, sql)
+
+        buffer = io.BytesIO()
+        cursor.copy_expert(f"COPY ({sql}\n) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')", buffer)
+    finally:
+        cursor.close()
+
+    table = csv.read_csv(
+        pa.BufferReader(buffer.getbuffer()),
+        convert_options=csv.ConvertOptions(
+            column_types=column_types,
+            # PostgreSQL выводит boolean в CSV как t/f
+            true_values=['t'],
+            false_values=['f'],
+            # Пустое значение без кавычек — NULL, пустая строка в кавычках — ''
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False
+        )
+    )
+    return table.to_pandas()
@@ -0,0 +1,144 @@
+"""
+Материализованное представление последних снимков объявлений.
+
+Всем публикаторам нужна последняя версия каждого объявления, а публикаторам
+изменений цен — еще и предыдущая цена. Вместо оконных функций и самосоединения
+при каждом запуске это считается один раз в представлении bayut_latest_listings
+(последний снимок + предыдущая цена и изменение), которое обновляется
+REFRESH MATERIALIZED VIEW CONCURRENTLY после каждой загрузки данных.
+Публикаторы используют его, когда оно есть (флаг has_latest_view в
+schema_capabilities), и выполняют простые запросы по индексам.
+
+Использование:
+    python latest_listings.py create
+    python latest_listings.py refresh [--blocking]
+"""
+
+import time
+import logging
+import argparse
+
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import local_snapshot
+from schema_capabilities import LATEST_VIEW_NAME, TABLE_NAME, invalidate_schema_cache
+
+logger = logging.getLogger(__name__)
+
+# Цены <= 0 и записи без даты не участвуют в истории цен, как и в запросах публикаторов
+CREATE_LATEST_VIEW_SQL = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS {LATEST_VIEW_NAME} AS
+WITH price_history AS (
+    SELECT
+        id, title, price, rooms, area, location, property_url, geography, updated_at,
+        LAG(price) OVER (PARTITION BY id ORDER BY updated_at) AS prev_price,
+        LAG(updated_at) OVER (PARTITION BY id ORDER BY updated_at) AS prev_updated_at,
+        ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) AS rn
+    FROM {TABLE_NAME}
+    WHERE price > 0 AND updated_at IS NOT NULL
+)
+SELECT
+    id, title, price, rooms, area, location, property_url, geography, updated_at,
+    prev_price,
+    prev_updated_at,
+    CASE
+        WHEN prev_price IS NOT NULL AND prev_price <> 0
+        THEN (price - prev_price) / prev_price * 100
+        ELSE NULL
+    END AS pct_change,
+    price - prev_price AS absolute_change
+FROM price_history
+WHERE rn = 1
+"""
+
+# Уникальный индекс обязателен для REFRESH ... CONCURRENTLY
+LATEST_VIEW_INDEXES = [
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {LATEST_VIEW_NAME}_id_idx ON {LATEST_VIEW_NAME} (id)",
+    f"CREATE INDEX IF NOT EXISTS {LATEST_VIEW_NAME}_location_price_idx ON {LATEST_VIEW_NAME} (location, price)",
+    f"CREATE INDEX IF NOT EXISTS {LATEST_VIEW_NAME}_area_idx ON {LATEST_VIEW_NAME} (area)",
+    f"CREATE INDEX IF NOT EXISTS {LATEST_VIEW_NAME}_changes_idx ON {LATEST_VIEW_NAME} (area) "
+    f"WHERE pct_change IS NOT NULL"
+]
+
+
+def use_latest_view(capabilities):
+    """
+    Можно ли выполнять запросы к представлению: оно создано и заполнено,
+    а аналитика идет в PostgreSQL, а не в локальный снимок.
+    """
+    return capabilities.has_latest_view and local_snapshot.ANALYSIS_SOURCE != 'snapshot'
+
+
+def ensure_latest_view(conn):
+    """Создает представление и его индексы, если их еще нет."""
+    cursor = conn.cursor()
+    cursor.execute(CREATE_LATEST_VIEW_SQL)
+    for statement in LATEST_VIEW_INDEXES:
+        cursor.execute(statement)
+    conn.commit()
+    cursor.close()
+    # Публикаторы должны увидеть новое представление, не дожидаясь истечения кэша схемы
+    invalidate_schema_cache()
+
+
+def latest_view_exists(conn):
+    """Проверяет наличие представления напрямую в каталоге, минуя кэш схемы."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_matviews WHERE matviewname = %s", (LATEST_VIEW_NAME,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def refresh_latest_view(conn, concurrently=True):
+    """
+    Обновляет представление после загрузки данных. CONCURRENTLY не блокирует
+    чтение публикаторами во время обновления. Возвращает длительность в секундах.
+    """
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{LATEST_VIEW_NAME}"
+    )
+    cursor.execute(f"ANALYZE {LATEST_VIEW_NAME}")
+    conn.commit()
+    cursor.close()
+    duration = time.perf_counter() - start
+    logger.info(f"Представление {LATEST_VIEW_NAME} обновлено за {duration:.2f} с")
+    return duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Материализованное представление {LATEST_VIEW_NAME}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('create', help="Создать представление и индексы")
+    refresh_parser = subparsers.add_parser('refresh', help="Обновить представление после загрузки данных")
+    refresh_parser.add_argument('--blocking', action='store_true',
+                                help="Обновить без CONCURRENTLY (быстрее, но блокирует чтение)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    import psycopg2
+    conn = psycopg2.connect(**local_snapshot.DB_PARAMS)
+    try:
+        if args.command == 'create':
+            ensure_latest_view(conn)
+            print(f"Представление {LATEST_VIEW_NAME} создано")
+        else:
+            duration = refresh_latest_view(conn, concurrently=not args.blocking)
+            print(f"Представление {LATEST_VIEW_NAME} обновлено за {duration:.2f} с")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
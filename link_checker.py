@@ -0,0 +1,249 @@
+"""
+Проверка, что объявления из отчетов еще опубликованы.
+
+Отчеты ссылаются на https://www.bayut.com/property/{id}/ и property_url, и часть
+ссылок к моменту публикации уже не работает. Здесь кандидаты в отчет проверяются
+асинхронно через aiohttp: сначала запросом HEAD (без тела ответа), и только если
+сервер не поддерживает HEAD — запросом GET. Одновременно выполняется не больше
+LINK_CHECK_CONCURRENCY запросов и не больше LINK_CHECK_PER_HOST к одному хосту.
+
+Каждое объявление получает статус:
+    'alive'   — ссылка отвечает (код меньше 400);
+    'dead'    — объявление снято (404 или 410), в отчет не попадает;
+    'unknown' — тайм-аут, ошибка соединения, 403, 429, 5xx: объявление остается
+                в отчете, статус не кэшируется и будет проверен в следующий раз.
+
+Статусы 'alive' и 'dead' хранятся в файле LINK_CHECK_CACHE по id объявления
+LINK_CHECK_TTL_HOURS часов, поэтому каждая ссылка проверяется не чаще раза в сутки.
+
+Проверка обращается к сайту при каждой публикации, поэтому включается явно: LINK_CHECK=1.
+
+Использование:
+    python link_checker.py 123456 789012
+    python link_checker.py https://www.bayut.com/property/details-123456.html --no-cache
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from urllib.parse import urlsplit
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Проверять ли ссылки кандидатов перед публикацией
+LINK_CHECK = os.getenv('LINK_CHECK', '0') not in ('0', 'false', 'False', '')
+
+# Общее количество одновременных запросов и количество запросов к одному хосту
+LINK_CHECK_CONCURRENCY = int(os.getenv('LINK_CHECK_CONCURRENCY', '20'))
+LINK_CHECK_PER_HOST = int(os.getenv('LINK_CHECK_PER_HOST', '4'))
+
+# Тайм-аут одной проверки, секунд
+LINK_CHECK_TIMEOUT = float(os.getenv('LINK_CHECK_TIMEOUT', '10'))
+
+# Сколько часов результат проверки считается актуальным
+LINK_CHECK_TTL_HOURS = float(os.getenv('LINK_CHECK_TTL_HOURS', '24'))
+
+# Файл с результатами проверок
+LINK_CHECK_CACHE = os.getenv('LINK_CHECK_CACHE', os.path.join('cache', 'link_status.json'))
+
+# Сколько раз дополнять отчет после удаления снятых объявлений
+LINK_CHECK_MAX_ROUNDS = 3
+
+PROPERTY_URL_PREFIX = "https://www.bayut.com/property/"
+
+DEAD_STATUSES = (404, 410)
+
+# Коды, которыми сервер сообщает, что не поддерживает HEAD (CDN иногда отвечают 403)
+HEAD_UNSUPPORTED_STATUSES = (403, 405, 501)
+
+USER_AGENT = "Mozilla/5.0 (compatible; dubai-apartments-link-checker)"
+
+
+class LinkStatusCache:
+    """Результаты проверок ссылок по id объявления с ограниченным сроком жизни."""
+
+    def __init__(self, path=None, ttl_hours=None):
+        self.path = path or LINK_CHECK_CACHE
+        self.ttl = (LINK_CHECK_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+        # id (строкой) -> [статус, время проверки (unix)]
+        self.entries = {}
+
+    @classmethod
+    def load(cls, path=None, ttl_hours=None):
+        """Загружает результаты проверок (пустые, если файла нет или он поврежден)."""
+        cache = cls(path, ttl_hours)
+        if os.path.exists(cache.path):
+            try:
+                with open(cache.path, 'r', encoding='utf-8') as f:
+                    cache.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать кэш проверок ссылок {cache.path}: {e}")
+        return cache
+
+    def get(self, listing_id, now=None):
+        """Статус объявления, если он проверялся не раньше чем LINK_CHECK_TTL_HOURS назад, иначе None."""
+        entry = self.entries.get(str(listing_id))
+        if entry is None or (now or time.time()) - entry[1] >= self.ttl:
+            return None
+        return entry[0]
+
+    def set(self, listing_id, status, now=None):
+        if status in ('alive', 'dead'):
+            self.entries[str(listing_id)] = [status, now or time.time()]
+
+    def save(self, now=None):
+        """Сохраняет актуальные записи (атомарно, через временный файл), устаревшие отбрасываются."""
+        now = now or time.time()
+        self.entries = {key: entry for key, entry in self.entries.items() if now - entry[1] < self.ttl}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def listing_url(listing_id, property_url=None):
+    """Ссылка объявления: property_url из БД или адрес по id."""
+    if isinstance(property_url, str) and property_url.startswith('http'):
+        return property_url
+    return f"{PROPERTY_URL_PREFIX}{listing_id}/"
+
+
+def listing_urls(df):
+    """Пары (id, ссылка) для строк DataFrame (колонки id и, если есть, property_url или url)."""
+    url_column = next((column for column in ('property_url', 'url') if column in df.columns), None)
+    urls = df[url_column] if url_column else [None] * len(df)
+    return [(listing_id, listing_url(listing_id, url)) for listing_id, url in zip(df['id'], urls)]
+
+
+def classify_status(status):
+    if status in DEAD_STATUSES:
+        return 'dead'
+    if status < 400:
+        return 'alive'
+    return 'unknown'
+
+
+async def check_url(session, url, timeout=None):
+    """Статус одной ссылки: HEAD, а при отказе сервера обрабатывать HEAD — GET без чтения тела."""
+    import aiohttp
+
+    timeout = aiohttp.ClientTimeout(total=LINK_CHECK_TIMEOUT if timeout is None else timeout)
+    try:
+        async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+            status = response.status
+        if status in HEAD_UNSUPPORTED_STATUSES:
+            async with session.get(url, allow_redirects=True, timeout=timeout) as response:
+                status = response.status
+        return classify_status(status)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.debug(f"Не удалось проверить {url}: {e!r}")
+        return 'unknown'
+
+
+async def check_links(items, cache=None, concurrency=None, per_host=None, timeout=None):
+    """
+    Проверяет ссылки items — пары (id, ссылка) — и возвращает словарь id -> статус.
+    Объявления с актуальным результатом в cache не проверяются повторно, новые
+    результаты записываются в cache (сохранение — cache.save()).
+    """
+    import aiohttp
+
+    concurrency = concurrency or LINK_CHECK_CONCURRENCY
+    per_host = per_host or LINK_CHECK_PER_HOST
+    statuses = {}
+    pending = []
+    for listing_id, url in items:
+        cached = cache.get(listing_id) if cache is not None else None
+        if cached is not None:
+            statuses[listing_id] = cached
+        elif listing_id not in statuses:
+            statuses[listing_id] = None
+            pending.append((listing_id, url))
+
+    if not pending:
+        return statuses
+
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+
+    async def check(listing_id, url):
+        host = urlsplit(url).netloc
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        # Сначала место в очереди хоста: ожидающие занятый хост не держат общие места.
+        # Тайм-аут считается только с момента отправки запроса, а не с ожидания очереди
+        async with host_limit, limit:
+            status = await check_url(session, url, timeout)
+        statuses[listing_id] = status
+        if cache is not None:
+            cache.set(listing_id, status)
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT}) as session:
+        await asyncio.gather(*(check(listing_id, url) for listing_id, url in pending))
+    return statuses
+
+
+async def drop_dead_listings_async(df, select=None, cache=None):
+    """
+    Убирает из df снятые с публикации объявления. select(df) возвращает строки,
+    которые попадут в отчет (например, топ-3 каждой локации): проверяются только они,
+    а после удаления снятых — пришедшие им на смену.
+    """
+    if not LINK_CHECK or df is None or df.empty:
+        return df
+    select = select or (lambda frame: frame)
+    cache = cache or LinkStatusCache.load()
+    dead_ids = set()
+    with stage('link_check') as record:
+        for _ in range(LINK_CHECK_MAX_ROUNDS):
+            candidates = select(df)
+            if candidates is None or candidates.empty:
+                break
+            statuses = await check_links(listing_urls(candidates), cache)
+            dead = {listing_id for listing_id, status in statuses.items() if status == 'dead'}
+            if not dead:
+                break
+            dead_ids |= dead
+            df = df[~df['id'].isin(dead)]
+        record.rows = len(df)
+    cache.save()
+    if dead_ids:
+        print(f"Исключено снятых с публикации объявлений: {len(dead_ids)}")
+    return df
+
+
+def drop_dead_listings(df, select=None, cache=None):
+    """
+    Синхронный вариант drop_dead_listings_async для кода без цикла событий;
+    внутри цикла событий нужно вызывать await drop_dead_listings_async(...).
+    """
+    if not LINK_CHECK or df is None or df.empty:
+        return df
+    return asyncio.run(drop_dead_listings_async(df, select, cache))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка, что объявления еще опубликованы")
+    parser.add_argument('listings', nargs='+', help="id объявлений или ссылки на них")
+    parser.add_argument('--no-cache', action='store_true', help="Не использовать сохраненные результаты проверок")
+    args = parser.parse_args(argv)
+
+    items = [(item, item) if item.startswith('http') else (item, listing_url(item)) for item in args.listings]
+    cache = None if args.no_cache else LinkStatusCache.load()
+    statuses = asyncio.run(check_links(items, cache))
+    if cache is not None:
+        cache.save()
+    for listing_id, url in items:
+        print(f"{statuses[listing_id]:<8} {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Схлопывание повторно опубликованных объявлений.
+
+Одну и ту же квартиру часто выставляют несколько агентов, каждый под своим id,
+и топ-3 региона или список изменений цен заполняется копиями одного объекта.
+Здесь объявления раскладываются по корзинам точного хеша нормализованных
+признаков (слова заголовка, площадь с округлением, координаты с округлением,
+количество спален, регион). Внутри корзины объявления упорядочиваются по цене,
+и соседние цены, отличающиеся не больше чем на DEDUP_PRICE_TOLERANCE, считаются
+одним объектом. От каждого объекта остается одно объявление (первое в текущем
+порядке DataFrame), количество копий записывается в колонку duplicates.
+
+Все шаги — группировка по хешу и одна сортировка, без попарного сравнения.
+"""
+
+import os
+
+# Включено ли схлопывание повторов в отчетах
+LISTING_DEDUP = os.getenv('LISTING_DEDUP', '1') not in ('0', 'false', 'False', '')
+
+# Допустимое относительное различие цен копий одного объекта
+DEDUP_PRICE_TOLERANCE = float(os.getenv('DEDUP_PRICE_TOLERANCE', '0.02'))
+
+# Шаг округления площади, кв.м.
+DEDUP_AREA_STEP = float(os.getenv('DEDUP_AREA_STEP', '1'))
+
+# Количество знаков после запятой у координат (4 знака — около 11 м)
+DEDUP_COORD_DECIMALS = int(os.getenv('DEDUP_COORD_DECIMALS', '4'))
+
+# Во сколько раз больше объявлений на регион запрашивается, чтобы после схлопывания осталось top_n
+DEDUP_OVERFETCH = int(os.getenv('DEDUP_OVERFETCH', '3'))
+
+
+def normalize_titles(titles):
+    """Заголовок без регистра, знаков препинания и порядка слов: множество слов через пробел."""
+    words = titles.fillna('').astype(str).str.lower().str.replace(r'[^\w]+', ' ', regex=True).str.split()
+    return words.map(lambda items: ' '.join(sorted(set(items))))
+
+
+def _coordinates(df):
+    if 'latitude' in df.columns and 'longitude' in df.columns:
+        return df['latitude'], df['longitude']
+    if 'geography' in df.columns:
+        from neighbourhood_value import extract_coordinates
+        coords = extract_coordinates(df['geography'])
+        return coords['latitude'], coords['longitude']
+    return None, None
+
+
+def duplicate_keys(df):
+    """Ключи корзин: нормализованные признаки, по которым совпадают копии одного объекта."""
+    import pandas as pd
+
+    keys = pd.DataFrame(index=df.index)
+    if 'title' in df.columns:
+        keys['title'] = normalize_titles(df['title'])
+    if 'area' in df.columns:
+        keys['area'] = (df['area'].astype(float) / DEDUP_AREA_STEP).round()
+    latitude, longitude = _coordinates(df)
+    if latitude is not None:
+        keys['latitude'] = latitude.astype(float).round(DEDUP_COORD_DECIMALS)
+        keys['longitude'] = longitude.astype(float).round(DEDUP_COORD_DECIMALS)
+    for column in ('rooms', 'location'):
+        if column in df.columns:
+            keys[column] = df[column]
+    return keys
+
+
+def duplicate_clusters(df, price_tolerance=None):
+    """
+    Номер объекта для каждой строки df: строки одной корзины с ценами, отличающимися
+    по цепочке не больше чем на price_tolerance, получают один номер.
+    """
+    import numpy as np
+
+    price_tolerance = DEDUP_PRICE_TOLERANCE if price_tolerance is None else price_tolerance
+    if df.empty:
+        return np.zeros(0, dtype=np.int64)
+    keys = duplicate_keys(df)
+    bucket = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+    price = df['price'].to_numpy(dtype=np.float64)
+
+    order = np.lexsort((price, bucket))
+    sorted_bucket = bucket[order]
+    sorted_price = price[order]
+    # Новый объект начинается при смене корзины или при скачке цены больше допуска
+    new_cluster = np.ones(len(order), dtype=bool)
+    new_cluster[1:] = (
+        (sorted_bucket[1:] != sorted_bucket[:-1])
+        | (sorted_price[1:] > sorted_price[:-1] * (1 + price_tolerance))
+    )
+    clusters = np.empty(len(order), dtype=np.int64)
+    clusters[order] = np.cumsum(new_cluster) - 1
+    return clusters
+
+
+def collapse_duplicates(df, price_tolerance=None):
+    """
+    Оставляет по одному объявлению на объект — первое в текущем порядке df
+    (например, самое дешевое или с наибольшим изменением цены) —
+    и добавляет колонку duplicates с количеством отброшенных копий.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if df.empty:
+        return df.assign(duplicates=pd.Series(dtype='int64'))
+    clusters = duplicate_clusters(df, price_tolerance)
+    counts = np.bincount(clusters)
+    first = ~pd.Series(clusters).duplicated().to_numpy()
+    result = df[first].copy()
+    result['duplicates'] = counts[clusters[first]] - 1
+    return result
+
+
+def overfetch_filters(filters):
+    """Фильтры запроса самых дешевых квартир с запасом строк на регион для последующего схлопывания."""
+    if not LISTING_DEDUP:
+        return filters
+    return {**filters, 'top_n': filters['top_n'] * DEDUP_OVERFETCH}
+
+
+def dedup_top_n(df, top_n):
+    """
+    Схлопывает копии в выборке самых дешевых квартир (полученной с overfetch_filters)
+    и заново ранжирует регионы, оставляя top_n различных объектов в каждом.
+    Без LISTING_DEDUP копии не схлопываются, но ранги пересчитываются и выборка
+    обрезается так же: после удаления снятых объявлений места в регионе сдвигаются.
+    """
+    if df is None or df.empty:
+        return df
+    df = df.sort_values(['location', 'price'], kind='stable')
+    if LISTING_DEDUP:
+        df = collapse_duplicates(df)
+    # Объявления без региона ранжируются отдельной группой, как в PARTITION BY location запроса
+    df['rank'] = df.groupby('location', dropna=False, sort=False).cumcount() + 1
+    return df[df['rank'] <= top_n].reset_index(drop=True)
@@ -0,0 +1,258 @@
+"""
+Локальный колоночный снимок таблицы bayut_properties для офлайн-аналитики.
+
+Команда sync зеркалирует таблицу в партиционированные Parquet-файлы
+(по дате обновления или по локации) и дозагружает только строки с updated_at
+новее последней синхронизации. Аналитические запросы затем выполняются
+на воркере через DuckDB, не нагружая рабочую базу PostgreSQL.
+
+Использование:
+    python local_snapshot.py sync [--partition-by date|location] [--full]
+    python local_snapshot.py info
+"""
+
+import os
+import re
+import json
+import shutil
+import logging
+import argparse
+from datetime import datetime
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Каталог снимка и источник данных для аналитики ('postgres' или 'snapshot')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join('snapshot', 'bayut_properties'))
+ANALYSIS_SOURCE = os.getenv('ANALYSIS_SOURCE', 'postgres')
+SYNC_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', '50000'))
+
+# Способ выборки из PostgreSQL: 'copy' — COPY TO STDOUT в Arrow, 'cursor' — курсор psycopg2
+ANALYSIS_FETCH_METHOD = os.getenv('ANALYSIS_FETCH_METHOD', 'copy')
+
+STATE_FILE = '_sync_state.json'
+PARTITION_COLUMNS = {
+    'date': 'snapshot_date',
+    'location': 'location_key'
+}
+
+# Параметры подключения к базе данных из .env (общие с telegram_html_publisher.connect_to_db);
+# незаданные параметры psycopg2 не передает, и для них действуют значения по умолчанию libpq
+DB_PARAMS = {
+    'dbname': os.getenv("DB_NAME"),
+    'user': os.getenv("DB_USER"),
+    'password': os.getenv("DB_PASSWORD"),
+    'host': os.getenv("DB_HOST"),
+    'port': os.getenv("DB_PORT")
+}
+
+
+def _state_path(snapshot_dir):
+    return os.path.join(snapshot_dir, STATE_FILE)
+
+
+def load_sync_state(snapshot_dir=SNAPSHOT_DIR):
+    """Возвращает состояние последней синхронизации или пустой словарь."""
+    path = _state_path(snapshot_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_sync_state(snapshot_dir, state):
+    path = _state_path(snapshot_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _add_partition_column(df, partition_by):
+    """Добавляет в DataFrame колонку, по которой партиционируется снимок."""
+    import pandas as pd
+
+    if partition_by == 'date':
+        dates = pd.to_datetime(df['updated_at'], errors='coerce')
+        df['snapshot_date'] = dates.dt.strftime('%Y-%m-%d').fillna('unknown')
+    else:
+        df['location_key'] = (
+            df['location'].fillna('unknown').astype(str)
+            .map(lambda x: re.sub(r'[^0-9A-Za-z]+', '_', x).strip('_').lower() or 'unknown')
+        )
+    return df
+
+
+def sync_snapshot(conn, partition_by='date', full=False, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Синхронизирует снимок с таблицей bayut_properties.
+
+    При первом запуске (или с full=True) выгружается вся таблица, далее только строки
+    с updated_at больше сохраненного водяного знака. Строки, обновленные на месте,
+    попадают в снимок новой версией, поэтому снимок хранит и историю цен.
+    Возвращает количество выгруженных строк.
+    """
+    import pandas as pd
+
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f"Неизвестный способ партиционирования: {partition_by}")
+
+    state = load_sync_state(snapshot_dir)
+    if state and state.get('partition_by') != partition_by and not full:
+        raise ValueError(
+            f"Снимок партиционирован по '{state.get('partition_by')}', "
+            f"для смены схемы используйте --full"
+        )
+
+    if full and os.path.isdir(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+        state = {}
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    last_updated_at = state.get('last_updated_at')
+    if last_updated_at:
+        query = "SELECT * FROM bayut_properties WHERE updated_at > %s ORDER BY updated_at"
+        params = (last_updated_at,)
+    else:
+        query = "SELECT * FROM bayut_properties ORDER BY updated_at NULLS FIRST"
+        params = None
+
+    # Именованный (серверный) курсор отдает строки пачками, не загружая всю таблицу в память
+    cursor = conn.cursor(name='bayut_snapshot_sync')
+    cursor.itersize = SYNC_BATCH_SIZE
+    cursor.execute(query, params)
+
+    total_rows = 0
+    max_updated_at = last_updated_at
+    columns = None
+    while True:
+        rows = cursor.fetchmany(SYNC_BATCH_SIZE)
+        if not rows:
+            break
+        if columns is None:
+            columns = [desc[0] for desc in cursor.description]
+        df = pd.DataFrame(rows, columns=columns)
+        df = _add_partition_column(df, partition_by)
+        df.to_parquet(snapshot_dir, partition_cols=[PARTITION_COLUMNS[partition_by]], index=False)
+
+        batch_max = pd.to_datetime(df['updated_at'], errors='coerce').max()
+        if not pd.isna(batch_max):
+            max_updated_at = batch_max.isoformat()
+        total_rows += len(df)
+        logger.info(f"В снимок выгружено строк: {total_rows}")
+    cursor.close()
+    conn.commit()
+
+    _save_sync_state(snapshot_dir, {
+        'partition_by': partition_by,
+        'last_updated_at': max_updated_at,
+        'last_sync': datetime.now().isoformat(),
+        'total_rows': state.get('total_rows', 0) + total_rows
+    })
+    return total_rows
+
+
+def _pyformat_to_duckdb(query):
+    """Переводит плейсхолдеры psycopg2 (%(name)s) в именованные параметры DuckDB ($name)."""
+    query = re.sub(r'%\((\w+)\)s', r'$\1', query)
+    return query.replace('%%', '%')
+
+
+def query_snapshot(query, params=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Выполняет SQL-запрос к локальному снимку через DuckDB и возвращает DataFrame.
+    Снимок доступен в запросе как таблица bayut_properties, поэтому подходят
+    те же запросы, что и для PostgreSQL.
+    """
+    import duckdb
+
+    if not os.path.isdir(snapshot_dir):
+        raise FileNotFoundError(f"Локальный снимок не найден: {snapshot_dir}. Выполните local_snapshot.py sync")
+
+    con = duckdb.connect()
+    try:
+        pattern = os.path.join(snapshot_dir, '**', '*.parquet').replace("'", "''")
+        con.execute(
+            f"CREATE VIEW bayut_properties AS "
+            f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+        )
+        return con.execute(_pyformat_to_duckdb(query), params or {}).df()
+    finally:
+        con.close()
+
+
+def analysis_source_params(snapshot_dir=None):
+    """
+    Параметры источника данных для ключа кэша анализа. Водяной знак берется из
+    PostgreSQL, поэтому при чтении из снимка в ключ добавляется состояние снимка:
+    результат по устаревшему снимку не должен попасть в кэш под свежим водяным знаком.
+    """
+    if ANALYSIS_SOURCE != 'snapshot':
+        return {'analysis_source': ANALYSIS_SOURCE}
+    state = load_sync_state(snapshot_dir or SNAPSHOT_DIR)
+    return {
+        'analysis_source': ANALYSIS_SOURCE,
+        'snapshot_updated_at': state.get('last_updated_at'),
+        'snapshot_rows': state.get('total_rows')
+    }
+
+
+def read_analysis_query(query, conn, params=None, prepared=False):
+    """
+    Выполняет аналитический запрос в источнике, заданном ANALYSIS_SOURCE:
+    в рабочей базе PostgreSQL или в локальном снимке через DuckDB.
+    Из PostgreSQL результат по умолчанию забирается через COPY в Arrow (ANALYSIS_FETCH_METHOD=copy).
+    COPY не выполняет подготовленные операторы, поэтому запросы с prepared=True
+    всегда выполняются через PREPARE/EXECUTE и курсор.
+    """
+    if ANALYSIS_SOURCE == 'snapshot':
+        return query_snapshot(query, params)
+    if prepared:
+        from query_builder import execute_prepared
+        return execute_prepared(conn, query, params)
+    if ANALYSIS_FETCH_METHOD == 'copy':
+        from copy_fetch import read_sql_copy
+        return read_sql_copy(query, conn, params)
+    import pandas as pd
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный снимок bayut_properties в Parquet")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help="Синхронизировать снимок с базой данных")
+    sync_parser.add_argument('--partition-by', choices=sorted(PARTITION_COLUMNS), default='date')
+    sync_parser.add_argument('--full', action='store_true', help="Пересоздать снимок с нуля")
+    subparsers.add_parser('info', help="Показать состояние снимка")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if args.command == 'info':
+        state = load_sync_state()
+        if not state:
+            print(f"Снимок не найден в каталоге {SNAPSHOT_DIR}")
+        else:
+            print(json.dumps(state, ensure_ascii=False, indent=2))
+        return
+
+    import psycopg2
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        rows = sync_snapshot(conn, partition_by=args.partition_by, full=args.full)
+        print(f"Синхронизация завершена, выгружено строк: {rows}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
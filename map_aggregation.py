@@ -0,0 +1,232 @@
+"""
+Агрегация маркеров карты по сетке на стороне сервера.
+
+MarkerCluster получает в браузер каждую точку и группирует их на JavaScript,
+а folium создает объект Python на каждый маркер, поэтому карта всего Дубая
+с сотнями тысяч объявлений строится и открывается очень медленно.
+
+Здесь координаты один раз проецируются в Web Mercator и переводятся в целые
+номера ячеек на самом подробном уровне; ячейки остальных уровней получаются
+сдвигом битов (иерархия как у тайлов карты). Для каждого уровня масштаба NumPy
+считает количество объявлений, минимальную цену, объявление с минимальной ценой
+и центр ячейки. На страницу попадают только эти ячейки, а браузер рисует
+ячейки текущего масштаба в видимой области. Ячейки каждого уровня лежат на
+странице отдельным блоком JSON и разбираются браузером только при первом
+переходе на этот уровень, поэтому открытие карты не ждет разбора всех уровней.
+"""
+
+import os
+import html
+import json
+
+import numpy as np
+import pandas as pd
+
+# Режим маркеров: 'auto' — сетка при большом количестве точек, 'cluster' — MarkerCluster, 'grid' — всегда сетка
+MAP_MARKER_MODE = os.getenv('MAP_MARKER_MODE', 'auto')
+
+# Начиная с этого количества точек режим 'auto' переключается на сетку
+MAP_GRID_THRESHOLD = int(os.getenv('MAP_GRID_THRESHOLD', '2000'))
+
+# Уровни масштаба, для которых считаются ячейки (на меньших и больших используется ближайший)
+MAP_GRID_MIN_ZOOM = int(os.getenv('MAP_GRID_MIN_ZOOM', '8'))
+MAP_GRID_MAX_ZOOM = int(os.getenv('MAP_GRID_MAX_ZOOM', '15'))
+
+# Размер ячейки на экране в пикселях (степень двойки, тайл — 256 пикселей)
+MAP_GRID_CELL_PIXELS = 64
+
+TILE_PIXELS = 256
+
+
+def use_grid_markers(points, mode=None):
+    """Нужно ли строить карту по сетке, а не отдельными маркерами."""
+    mode = mode or MAP_MARKER_MODE
+    if mode == 'grid':
+        return True
+    if mode == 'cluster':
+        return False
+    return points >= MAP_GRID_THRESHOLD
+
+
+def cell_bits(zoom, cell_pixels=MAP_GRID_CELL_PIXELS):
+    """Количество бит номера ячейки по каждой оси на уровне масштаба zoom."""
+    return zoom + int(np.log2(TILE_PIXELS // cell_pixels))
+
+
+def mercator_cells(latitude, longitude, bits):
+    """Номера ячеек (x, y) в проекции Web Mercator для сетки 2**bits x 2**bits."""
+    latitude = np.clip(np.asarray(latitude, dtype=np.float64), -85.05112878, 85.05112878)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    x = (longitude + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(latitude))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+    size = 1 << bits
+    cell_x = np.clip((x * size).astype(np.int64), 0, size - 1)
+    cell_y = np.clip((y * size).astype(np.int64), 0, size - 1)
+    return cell_x, cell_y
+
+
+def aggregate_cells(keys, latitude, longitude, price):
+    """
+    Группирует точки по номерам ячеек. Возвращает словарь массивов: центр ячейки
+    (среднее координат), количество, минимальная цена и индекс самой дешевой точки.
+    """
+    # Внутри ячейки точки упорядочены по цене, поэтому первая точка группы — самая дешевая
+    order = np.lexsort((price, keys))
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_keys)])
+    return {
+        'latitude': np.add.reduceat(latitude[order], starts) / counts,
+        'longitude': np.add.reduceat(longitude[order], starts) / counts,
+        'count': counts,
+        'min_price': price[order][starts],
+        'cheapest': order[starts]
+    }
+
+
+def build_grid_levels(df, min_zoom=MAP_GRID_MIN_ZOOM, max_zoom=MAP_GRID_MAX_ZOOM):
+    """
+    Считает ячейки для каждого уровня масштаба от min_zoom до max_zoom.
+    Возвращает словарь zoom -> DataFrame (latitude, longitude, count, min_price, cheapest),
+    где cheapest — позиция самой дешевой квартиры ячейки в df.
+    """
+    latitude = df['latitude'].to_numpy(dtype=np.float64)
+    longitude = df['longitude'].to_numpy(dtype=np.float64)
+    price = df['price'].to_numpy(dtype=np.float64)
+
+    # Проекция выполняется один раз на самом подробном уровне, остальные уровни — сдвиг битов
+    finest_bits = cell_bits(max_zoom)
+    cell_x, cell_y = mercator_cells(latitude, longitude, finest_bits)
+
+    levels = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        shift = finest_bits - cell_bits(zoom)
+        keys = ((cell_x >> shift) << 32) | (cell_y >> shift)
+        levels[zoom] = pd.DataFrame(aggregate_cells(keys, latitude, longitude, price))
+    return levels
+
+
+def build_grid_payload(df, url_prefix, min_zoom=MAP_GRID_MIN_ZOOM, max_zoom=MAP_GRID_MAX_ZOOM):
+    """
+    Сериализует ячейки всех уровней для страницы. Возвращает общие данные слоя
+    (JSON с префиксом ссылок, диапазоном уровней и названиями регионов, уже
+    экранированными для HTML) и словарь zoom -> JSON ячеек уровня. Ячейка — массив
+    [широта, долгота, количество, минимальная цена, номер региона, id самой дешевой квартиры].
+    """
+    codes, locations = pd.factorize(df['location'], sort=True)
+    ids = df['id'].to_numpy()
+    levels = build_grid_levels(df, min_zoom, max_zoom)
+
+    cells = {}
+    for zoom, level in levels.items():
+        cheapest = level['cheapest'].to_numpy()
+        rows = pd.DataFrame({
+            'latitude': level['latitude'].round(5),
+            'longitude': level['longitude'].round(5),
+            'count': level['count'],
+            'min_price': level['min_price'].round().astype('int64'),
+            'location': codes[cheapest],
+            'id': ids[cheapest]
+        })
+        # JSON встраивается в тег <script>, поэтому экранируем закрывающие теги
+        cells[zoom] = rows.to_json(orient='values').replace('</', '<\\/')
+
+    # Названия регионов попадают во всплывающие окна как HTML
+    payload = (
+        '{"url_prefix":' + json.dumps(url_prefix)
+        + ',"min_zoom":' + str(min_zoom)
+        + ',"max_zoom":' + str(max_zoom)
+        + ',"locations":' + json.dumps([html.escape(str(location)) for location in locations], ensure_ascii=False)
+        + '}'
+    )
+    return payload.replace('</', '<\\/'), cells
+
+
+# Слой карты: при каждом изменении масштаба или области рисует ячейки ближайшего
+# рассчитанного уровня, попадающие в видимую область (с запасом в половину экрана).
+# Ячейки уровня читаются из блока <script type="application/json"> при первом обращении
+GRID_LAYER_SCRIPT = """
+{% macro html(this, kwargs) %}
+{% for zoom, cells in this.cells.items() %}
+<script type="application/json" id="{{ this.get_name() }}_zoom_{{ zoom }}">{{ cells }}</script>
+{% endfor %}
+{% endmacro %}
+
+{% macro script(this, kwargs) %}
+(function() {
+    var map = {{ this._parent.get_name() }};
+    var data = {{ this.payload }};
+    var levels = {};
+    var layer = L.layerGroup().addTo(map);
+
+    function levelCells(zoom) {
+        if (!levels[zoom]) {
+            levels[zoom] = JSON.parse(document.getElementById('{{ this.get_name() }}_zoom_' + zoom).textContent);
+        }
+        return levels[zoom];
+    }
+
+    function formatPrice(value) {
+        return value.toLocaleString('en-US') + ' AED';
+    }
+
+    function cellIcon(cell) {
+        var count = cell[2];
+        var size = count < 10 ? 30 : count < 100 ? 36 : count < 1000 ? 44 : 52;
+        var color = count < 10 ? '#3a8a4a' : count < 100 ? '#d6a419' : '#d6542c';
+        return L.divIcon({
+            className: 'grid-cell',
+            iconSize: [size, size],
+            html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size + 'px;'
+                + 'border-radius:50%;background:' + color + ';opacity:0.85;color:#fff;'
+                + 'text-align:center;font:bold 12px sans-serif">' + count + '</div>'
+        });
+    }
+
+    function cellPopup(cell) {
+        var location = data.locations[cell[4]];
+        var link = '<a href="' + data.url_prefix + cell[5] + '/" target="_blank">Открыть самое дешевое</a>';
+        if (cell[2] === 1) {
+            return '<b>' + location + '</b><br><b>Цена:</b> ' + formatPrice(cell[3]) + '<br>' + link;
+        }
+        return '<b>Объявлений:</b> ' + cell[2] + '<br><b>От:</b> ' + formatPrice(cell[3])
+            + ' (' + location + ')<br>' + link;
+    }
+
+    function render() {
+        var zoom = Math.max(data.min_zoom, Math.min(data.max_zoom, map.getZoom()));
+        var bounds = map.getBounds().pad(0.5);
+        var cells = levelCells(zoom);
+        layer.clearLayers();
+        for (var i = 0; i < cells.length; i++) {
+            var cell = cells[i];
+            if (!bounds.contains([cell[0], cell[1]])) {
+                continue;
+            }
+            var marker = cell[2] === 1
+                ? L.marker([cell[0], cell[1]])
+                : L.marker([cell[0], cell[1]], {icon: cellIcon(cell)});
+            marker.bindPopup(cellPopup(cell));
+            layer.addLayer(marker);
+        }
+    }
+
+    map.on('zoomend moveend', render);
+    render();
+})();
+{% endmacro %}
+"""
+
+
+def add_grid_layer(map_obj, df, url_prefix):
+    """Добавляет на карту folium слой ячеек, рассчитанных build_grid_payload."""
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    layer = MacroElement()
+    layer._name = 'GridAggregateLayer'
+    layer._template = Template(GRID_LAYER_SCRIPT)
+    layer.payload, layer.cells = build_grid_payload(df, url_prefix)
+    layer.add_to(map_obj)
+    return layer
@@ -5,18 +5,30 @@
 import os
 import logging
 import asyncio
+import argparse
 import ssl
 import re
 import html
-import psycopg2
-import pandas as pd
-import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import aiohttp
 
-# Загрузка переменных окружения
-load_dotenv()
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from analysis_cache import get_data_watermark, make_cache_key, load_cached_result, save_cached_result
+from local_snapshot import read_analysis_query, analysis_source_params
+from schema_capabilities import get_schema_capabilities, LATEST_VIEW_NAME
+from latest_listings import use_latest_view
+from parallel_fetch import parallel_fetch_enabled, parallel_read_query
+from listing_dedup import LISTING_DEDUP, collapse_duplicates
+from publish_state import PUBLISH_MODE, PublishState, top_per_location
+from link_checker import drop_dead_listings_async
+from telegram_document import (TELEGRAM_DELIVERY_MODE, use_document_delivery, render_analysis_document,
+                               build_caption, send_document)
+from metrics import stage, timed, configure as configure_metrics, write_openmetrics
+from profiling import add_profile_arguments, profile_call
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,10 +37,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Создаем SSL-контекст
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+# SSL-контекст создается при первой отправке: загрузка сертификатов заметно замедляет импорт
+_ssl_context = None
+
+
+def get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+        _ssl_context.check_hostname = False
+        _ssl_context.verify_mode = ssl.CERT_NONE
+    return _ssl_context
 
 # Параметры подключения к базе данных из .env
 DB_PARAMS = {
@@ -39,6 +58,39 @@ DB_PARAMS = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+# Адрес Telegram Bot API (для локальных тестов можно указать заглушку)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Параметры анализа: диапазон площади квартир (кв.м.)
+ANALYSIS_PARAMS = {
+    'area_min': 40,
+    'area_max': 60
+}
+
+# Изменения цен из представления последних снимков (см. latest_listings.py):
+# предыдущая цена и процент изменения уже посчитаны при обновлении представления
+LATEST_VIEW_CHANGES_QUERY = f"""
+SELECT
+    id,
+    title,
+    price,
+    rooms,
+    area,
+    location,
+    property_url,
+    geography,
+    updated_at AS current_updated_at,
+    prev_updated_at,
+    prev_price,
+    pct_change,
+    absolute_change
+FROM {LATEST_VIEW_NAME}
+WHERE pct_change IS NOT NULL
+AND ABS(pct_change) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%%)
+AND area > %(area_min)s AND area <= %(area_max)s
+ORDER BY ABS(pct_change) DESC
+"""
+
 def clean_html_and_sanitize(text):
     """
     Очищает текст от HTML-тегов и специальных символов, 
@@ -103,8 +155,219 @@ def split_text_into_chunks(text, max_length=3000):
     
     return chunks
 
-def find_price_change_apartments():
-    """Находит объявления с самыми резкими изменениями в стоимости по локациям"""
+def query_demo_price_changes(conn, capabilities):
+    """
+    Загружает последние объявления и генерирует для них демонстрационные изменения цен.
+    Используется, когда по схеме или данным нельзя вычислить реальную историю цен.
+    """
+    from synthetic_data import add_demo_price_changes
+
+    # Сортировка по дате обновления возможна только при наличии колонки updated_at
+    if capabilities.has_updated_at:
+        columns, order_by = "id, title, price, rooms, area, location, property_url, updated_at", "updated_at DESC"
+    else:
+        columns, order_by = "id, title, price, rooms, area, location, property_url", "id DESC"
+    query = f"""
+    SELECT {columns}
+    FROM bayut_properties
+    WHERE price > 0
+    AND area > %(area_min)s AND area <= %(area_max)s  -- Фильтруем квартиры 40-60 кв.м.
+    ORDER BY {order_by}
+    LIMIT 1000
+    """
+    
+    df = read_analysis_query(query, conn, params=ANALYSIS_PARAMS)
+    
+    # Создаем воспроизводимые демонстрационные данные с меньшими колебаниями
+    return add_demo_price_changes(df)
+
+@timed('query_price_changes', rows=len)
+def query_price_changes(conn):
+    """Выполняет запрос изменений цен и возвращает DataFrame с колонками pct_change, prev_price и т.д."""
+    # Вариант запроса выбирается заранее по кэшированным возможностям схемы
+    capabilities = get_schema_capabilities(conn)
+    
+    if not capabilities.supports_price_history:
+        missing_columns = [col for col in ('updated_at', 'id', 'price') if not capabilities.has_column(col)]
+        print(f"В таблице отсутствуют необходимые колонки: {', '.join(missing_columns)}")
+        print("Создаем демонстрационные данные...")
+        return query_demo_price_changes(conn, capabilities)
+    
+    if use_latest_view(capabilities):
+        # Вместо оконных функций и самосоединения — простой запрос по индексам представления
+        print("Выполнение запроса изменений цен к представлению последних снимков...")
+        changes_df = read_analysis_query(LATEST_VIEW_CHANGES_QUERY, conn, params=ANALYSIS_PARAMS)
+        if changes_df.empty:
+            print("Не удалось найти изменения цен в базе данных. Используем альтернативный метод...")
+            return query_demo_price_changes(conn, capabilities)
+        return changes_df
+    
+    print("Выполнение запроса для получения изменений цен...")
+    print("Фильтруем квартиры 40-60 кв.м. напрямую в SQL-запросе для оптимизации выборки")
+    
+    # Запрос для получения последней и предпоследней цены для каждого ID
+    # Используем оконные функции SQL для эффективного вычисления изменений
+    query = """
+    WITH price_history AS (
+        SELECT 
+            id,
+            price,
+            updated_at,
+            LAG(price) OVER (PARTITION BY id ORDER BY updated_at) AS prev_price,
+            LAG(updated_at) OVER (PARTITION BY id ORDER BY updated_at) AS prev_updated_at,
+            ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) AS rn
+        FROM bayut_properties
+        WHERE price > 0 AND updated_at IS NOT NULL
+    ),
+    price_changes AS (
+        SELECT 
+            ph.id,
+            ph.price AS current_price,
+            ph.prev_price,
+            ph.updated_at AS current_updated_at,
+            ph.prev_updated_at,
+            CASE 
+                WHEN ph.prev_price IS NOT NULL AND ph.prev_price <> 0 
+                THEN (ph.price - ph.prev_price) / ph.prev_price * 100
+                ELSE NULL
+            END AS pct_change,
+            CASE 
+                WHEN ph.prev_price IS NOT NULL 
+                THEN ph.price - ph.prev_price
+                ELSE NULL
+            END AS absolute_change
+        FROM price_history ph
+        WHERE ph.rn = 1 AND ph.prev_price IS NOT NULL
+    )
+    SELECT 
+        bp.id, 
+        bp.title, 
+        bp.price, 
+        bp.rooms, 
+        bp.area, 
+        bp.location, 
+        bp.property_url,
+        bp.geography,
+        pc.current_updated_at,
+        pc.prev_updated_at,
+        pc.prev_price,
+        pc.pct_change,
+        pc.absolute_change
+    FROM price_changes pc
+    JOIN bayut_properties bp ON pc.id = bp.id
+    WHERE pc.pct_change IS NOT NULL 
+    AND ABS(pc.pct_change) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%%)
+    AND bp.area > %(area_min)s AND bp.area <= %(area_max)s  -- Фильтруем квартиры 40-60 кв.м.
+    ORDER BY ABS(pc.pct_change) DESC
+    """
+    
+    # Выполняем SQL-запрос
+    if parallel_fetch_enabled():
+        # Окна вычисляются по id, поэтому запрос делится по id; порядок ORDER BY ABS(pct_change) DESC
+        # восстанавливается после объединения частей
+        changes_df = parallel_read_query(
+            query, ANALYSIS_PARAMS, partition_by='id', db_params=DB_PARAMS,
+            order_by='pct_change', ascending=False, key=lambda column: column.abs()
+        )
+    else:
+        changes_df = read_analysis_query(query, conn, params=ANALYSIS_PARAMS)
+    
+    if changes_df.empty:
+        print("Не удалось найти изменения цен в базе данных. Используем альтернативный метод...")
+        return query_demo_price_changes(conn, capabilities)
+    
+    return changes_df
+
+def format_price_changes_report(sorted_df, header=None):
+    """
+    Формирует текстовый отчет: топ-3 объявления с наибольшими изменениями цен по каждой локации.
+    sorted_df должен быть отсортирован по убыванию abs_pct_change. Если в нем есть колонка rank
+    (место в топе локации), номера объявлений берутся из нее; header заменяет заголовок отчета.
+    """
+    import pandas as pd
+
+    # Группируем по локации и берем топ-3 с наибольшими изменениями
+    result = []
+    if header:
+        result.append(header)
+    else:
+        result.append("Топ-3 объявления с самыми резкими изменениями цен на квартиры 40-60 кв.м. по локациям:\n")
+    
+    # Получаем уникальные локации и сортируем их
+    locations = sorted(sorted_df['location'].unique())
+    
+    for location in locations:
+        if not location or pd.isna(location):
+            continue
+            
+        # Получаем топ-3 объявления с наибольшими изменениями для этой локации
+        location_top = sorted_df[sorted_df['location'] == location].head(3)
+        
+        if len(location_top) == 0:
+            continue
+            
+        result.append(f"Локация: {location}")
+        result.append("------------------------------")
+        
+        for i, (_, row) in enumerate(location_top.iterrows(), 1):
+            position = int(row['rank']) if 'rank' in row else i
+            price = float(row['price']) if not pd.isna(row['price']) else 0
+            prev_price = float(row['prev_price']) if not pd.isna(row['prev_price']) else 0
+            pct_change = float(row['pct_change']) if not pd.isna(row['pct_change']) else 0
+            
+            # Форматирование чисел
+            formatted_price = f"{price:,.2f}"
+            formatted_prev_price = f"{prev_price:,.2f}"
+            
+            # Добавляем эмодзи и знак для изменения цены
+            change_symbol = "📈" if pct_change > 0 else "📉"
+            change_sign = "+" if pct_change > 0 else ""
+            formatted_pct_change = f"{change_symbol} {change_sign}{pct_change:.2f}%"
+            if row.get('outlier') == 'anomaly':
+                formatted_pct_change += " ⚠️ нетипично для локации"
+            
+            area = float(row['area']) if not pd.isna(row['area']) else 0
+            formatted_area = f"{area:.2f}"
+            
+            rooms = int(row['rooms']) if not pd.isna(row['rooms']) else 0
+            
+            # Добавляем информацию о датах изменения цены, если она доступна
+            date_info = ""
+            if 'current_updated_at' in row and 'prev_updated_at' in row and not pd.isna(row['current_updated_at']) and not pd.isna(row['prev_updated_at']):
+                current_date = row['current_updated_at'].strftime('%d.%m.%Y') if hasattr(row['current_updated_at'], 'strftime') else str(row['current_updated_at'])
+                prev_date = row['prev_updated_at'].strftime('%d.%m.%Y') if hasattr(row['prev_updated_at'], 'strftime') else str(row['prev_updated_at'])
+                date_info = f"\n   Последнее обновление: {current_date}\n   Предыдущее обновление: {prev_date}"
+            
+            result.append(f"{position}. {row['title']}")
+            result.append(f"   ID: {row['id']}")
+            result.append(f"   Текущая цена: {formatted_price} AED")
+            result.append(f"   Предыдущая цена: {formatted_prev_price} AED")
+            result.append(f"   Изменение: {formatted_pct_change}{date_info}")
+            result.append(f"   Площадь: {formatted_area} кв.м.")
+            result.append(f"   Спальни: {rooms}")
+            result.append(f"   Ссылка: {row['property_url']}")
+            if row.get('duplicates', 0) > 0:
+                result.append(f"   Повторных объявлений других агентов: {int(row['duplicates'])}")
+            result.append("")
+        
+        result.append("")
+    
+    # Собираем результат в строку
+    analysis = "\n".join(result)
+    return analysis
+
+@timed('find_price_change_apartments', size=lambda analysis: len(analysis.encode('utf-8')))
+async def find_price_change_apartments(publish_state=None):
+    """
+    Находит объявления с самыми резкими изменениями в стоимости по локациям.
+    Если передан publish_state (см. publish_state.py) и полный отчет еще не нужен,
+    в отчет попадают только новые и изменившиеся с прошлой публикации объявления;
+    если таких нет, возвращается пустая строка.
+    """
+    import psycopg2
+    from synthetic_data import add_demo_price_changes
+    from price_outliers import flag_price_outliers
+
     try:
         # Создаем директорию для сохранения результатов анализа
         reports_dir = "reports"
@@ -112,148 +375,18 @@ def find_price_change_apartments():
         
         # Подключаемся к базе данных
         print("Подключение к базе данных...")
-        conn = psycopg2.connect(**DB_PARAMS)
+        with stage('connect_to_db'):
+            conn = psycopg2.connect(**DB_PARAMS)
         print("Подключение к базе данных успешно")
         
-        # Проверяем наличие столбца updated_at и id
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'bayut_properties' 
-            AND column_name IN ('updated_at', 'id', 'price')
-        """)
-        available_columns = [col[0] for col in cursor.fetchall()]
-        
-        required_columns = ['updated_at', 'id', 'price']
-        missing_columns = [col for col in required_columns if col not in available_columns]
-        
-        if missing_columns:
-            print(f"В таблице отсутствуют необходимые колонки: {', '.join(missing_columns)}")
-            print("Создаем демонстрационные данные...")
-            # Если отсутствуют нужные колонки, используем демонстрационные данные
-            query = """
-            SELECT id, title, price, rooms, area, location, property_url, updated_at
-            FROM bayut_properties
-            WHERE price > 0
-            AND area > 40 AND area <= 60  -- Фильтруем квартиры 40-60 кв.м.
-            ORDER BY updated_at DESC
-            LIMIT 1000
-            """
-            
-            df = pd.read_sql_query(query, conn)
-            
-            # Создаем демонстрационные данные об изменениях цен
-            df['pct_change'] = np.random.uniform(-5, 8, size=len(df))  # Более реалистичные изменения для недвижимости
-            df['absolute_change'] = df['price'] * df['pct_change'] / 100
-            df['prev_price'] = df['price'] - df['absolute_change']
-            changes_df = df
-            
+        # Ключ кэша строится по водяному знаку данных, параметрам диапазона площади и источнику данных
+        cache_key = make_cache_key('price_changes', get_data_watermark(conn), {**ANALYSIS_PARAMS, **analysis_source_params()})
+        changes_df = load_cached_result(cache_key)
+        if changes_df is None:
+            changes_df = query_price_changes(conn)
+            save_cached_result(cache_key, changes_df)
         else:
-            print("Выполнение запроса для получения изменений цен...")
-            print("Фильтруем квартиры 40-60 кв.м. напрямую в SQL-запросе для оптимизации выборки")
-            
-            # Запрос для получения последней и предпоследней цены для каждого ID
-            # Используем оконные функции SQL для эффективного вычисления изменений
-            query = """
-            WITH price_history AS (
-                SELECT 
-                    id,
-                    price,
-                    updated_at,
-                    LAG(price) OVER (PARTITION BY id ORDER BY updated_at) AS prev_price,
-                    LAG(updated_at) OVER (PARTITION BY id ORDER BY updated_at) AS prev_updated_at,
-                    ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) AS rn
-                FROM bayut_properties
-                WHERE price > 0 AND updated_at IS NOT NULL
-            ),
-            price_changes AS (
-                SELECT 
-                    ph.id,
-                    ph.price AS current_price,
-                    ph.prev_price,
-                    ph.updated_at AS current_updated_at,
-                    ph.prev_updated_at,
-                    CASE 
-                        WHEN ph.prev_price IS NOT NULL AND ph.prev_price <> 0 
-                        THEN (ph.price - ph.prev_price) / ph.prev_price * 100
-                        ELSE NULL
-                    END AS pct_change,
-                    CASE 
-                        WHEN ph.prev_price IS NOT NULL 
-                        THEN ph.price - ph.prev_price
-                        ELSE NULL
-                    END AS absolute_change
-                FROM price_history ph
-                WHERE ph.rn = 1 AND ph.prev_price IS NOT NULL
-            )
-            SELECT 
-                bp.id, 
-                bp.title, 
-                bp.price, 
-                bp.rooms, 
-                bp.area, 
-                bp.location, 
-                bp.property_url,
-                pc.current_updated_at,
-                pc.prev_updated_at,
-                pc.prev_price,
-                pc.pct_change,
-                pc.absolute_change
-            FROM price_changes pc
-            JOIN bayut_properties bp ON pc.id = bp.id
-            WHERE pc.pct_change IS NOT NULL 
-            AND ABS(pc.pct_change) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%)
-            AND bp.area > 40 AND bp.area <= 60  -- Фильтруем квартиры 40-60 кв.м.
-            ORDER BY ABS(pc.pct_change) DESC
-            """
-            
-            try:
-                # Выполняем SQL-запрос
-                changes_df = pd.read_sql_query(query, conn)
-                
-                if changes_df.empty:
-                    print("Не удалось найти изменения цен в базе данных. Используем альтернативный метод...")
-                    
-                    # Используем альтернативный запрос для получения всех записей
-                    alt_query = """
-                    SELECT id, title, price, rooms, area, location, property_url, updated_at
-                    FROM bayut_properties
-                    WHERE price > 0
-                    AND area > 40 AND area <= 60  -- Фильтруем квартиры 40-60 кв.м.
-                    ORDER BY updated_at DESC
-                    LIMIT 1000
-                    """
-                    
-                    df = pd.read_sql_query(alt_query, conn)
-                    
-                    # Создаем демонстрационные данные с меньшими колебаниями
-                    df['pct_change'] = np.random.uniform(-5, 8, size=len(df))
-                    df['absolute_change'] = df['price'] * df['pct_change'] / 100
-                    df['prev_price'] = df['price'] - df['absolute_change']
-                    changes_df = df
-                
-            except Exception as e:
-                print(f"Ошибка при выполнении SQL-запроса: {e}")
-                print("Используем запасной метод...")
-                
-                # Запасной запрос для получения всех записей
-                simple_query = """
-                SELECT id, title, price, rooms, area, location, property_url, updated_at
-                FROM bayut_properties
-                WHERE price > 0
-                AND area > 40 AND area <= 60  -- Фильтруем квартиры 40-60 кв.м.
-                ORDER BY updated_at DESC
-                LIMIT 1000
-                """
-                
-                df = pd.read_sql_query(simple_query, conn)
-                
-                # Создаем демонстрационные данные с меньшими колебаниями
-                df['pct_change'] = np.random.uniform(-5, 8, size=len(df))
-                df['absolute_change'] = df['price'] * df['pct_change'] / 100
-                df['prev_price'] = df['price'] - df['absolute_change']
-                changes_df = df
+            print("Данные не изменились с прошлого запуска, используем кэшированный результат анализа")
         
         # Закрываем соединение с базой
         conn.close()
@@ -268,89 +401,51 @@ def find_price_change_apartments():
         # Создаем колонку для сортировки по абсолютному значению процентного изменения
         if 'pct_change' in changes_df.columns:
             changes_df['abs_pct_change'] = changes_df['pct_change'].abs()
-            # Отфильтруем нереалистичные изменения цен для недвижимости (больше 25%)
+            # Отмечаем нетипичные для локации изменения (робастный z-score по медиане и MAD)
+            # и исключаем ошибки ввода цены (лишний или пропущенный ноль)
+            changes_df = flag_price_outliers(changes_df)
+            typos = changes_df['outlier'] == 'typo'
+            if typos.any():
+                print(f"Исключено изменений с ошибками ввода цены: {int(typos.sum())}")
             # И исключим объявления с незначительными изменениями цены (меньше 0.1%)
-            changes_df = changes_df[(changes_df['abs_pct_change'] <= 25) & (changes_df['abs_pct_change'] > 0.1)]
+            changes_df = changes_df[~typos & (changes_df['abs_pct_change'] > 0.1)]
             sorted_df = changes_df.sort_values('abs_pct_change', ascending=False)
+            if LISTING_DEDUP:
+                # Одна квартира, выставленная несколькими агентами, остается в отчете один раз
+                # (с наибольшим изменением цены среди копий)
+                sorted_df = collapse_duplicates(sorted_df)
+                duplicates = int(sorted_df['duplicates'].sum())
+                if duplicates:
+                    print(f"Схлопнуто повторных объявлений: {duplicates}")
         else:
             print("Колонка pct_change отсутствует. Создаем...")
-            # Генерируем случайные изменения, но исключаем нулевые/близкие к нулю изменения
-            # Создаем случайные изменения в диапазоне от -5% до -0.1% и от 0.1% до 8%
-            changes = []
-            for _ in range(len(changes_df)):
-                # Генерируем случайное число, исключая диапазон [-0.1, 0.1]
-                val = np.random.uniform(-5, 8)
-                if -0.1 <= val <= 0.1:
-                    # Если попало в "мертвую зону", перегенерируем
-                    val = np.random.choice([-np.random.uniform(0.1, 5), np.random.uniform(0.1, 8)])
-                changes.append(val)
-                
-            changes_df['pct_change'] = changes
+            # Генерируем воспроизводимые изменения от -5% до -0.1% и от 0.1% до 8%
+            # (без "мертвой зоны" около нуля) одним векторным вызовом
+            changes_df = add_demo_price_changes(changes_df)
             changes_df['abs_pct_change'] = changes_df['pct_change'].abs()
-            changes_df['absolute_change'] = changes_df['price'] * changes_df['pct_change'] / 100
-            changes_df['prev_price'] = changes_df['price'] - changes_df['absolute_change']
             sorted_df = changes_df.sort_values('abs_pct_change', ascending=False)
         
-        # Группируем по локации и берем топ-3 с наибольшими изменениями
-        result = []
-        result.append("Топ-3 объявления с самыми резкими изменениями цен на квартиры 40-60 кв.м. по локациям:\n")
-        
-        # Получаем уникальные локации и сортируем их
-        locations = sorted(sorted_df['location'].unique())
-        
-        for location in locations:
-            if not location or pd.isna(location):
-                continue
-                
-            # Получаем топ-3 объявления с наибольшими изменениями для этой локации
-            location_top = sorted_df[sorted_df['location'] == location].head(3)
-            
-            if len(location_top) == 0:
-                continue
-                
-            result.append(f"Локация: {location}")
-            result.append("------------------------------")
-            
-            for i, (_, row) in enumerate(location_top.iterrows(), 1):
-                price = float(row['price']) if not pd.isna(row['price']) else 0
-                prev_price = float(row['prev_price']) if not pd.isna(row['prev_price']) else 0
-                pct_change = float(row['pct_change']) if not pd.isna(row['pct_change']) else 0
-                
-                # Форматирование чисел
-                formatted_price = f"{price:,.2f}"
-                formatted_prev_price = f"{prev_price:,.2f}"
-                
-                # Добавляем эмодзи и знак для изменения цены
-                change_symbol = "📈" if pct_change > 0 else "📉"
-                change_sign = "+" if pct_change > 0 else ""
-                formatted_pct_change = f"{change_symbol} {change_sign}{pct_change:.2f}%"
-                
-                area = float(row['area']) if not pd.isna(row['area']) else 0
-                formatted_area = f"{area:.2f}"
-                
-                rooms = int(row['rooms']) if not pd.isna(row['rooms']) else 0
-                
-                # Добавляем информацию о датах изменения цены, если она доступна
-                date_info = ""
-                if 'current_updated_at' in row and 'prev_updated_at' in row and not pd.isna(row['current_updated_at']) and not pd.isna(row['prev_updated_at']):
-                    current_date = row['current_updated_at'].strftime('%d.%m.%Y') if hasattr(row['current_updated_at'], 'strftime') else str(row['current_updated_at'])
-                    prev_date = row['prev_updated_at'].strftime('%d.%m.%Y') if hasattr(row['prev_updated_at'], 'strftime') else str(row['prev_updated_at'])
-                    date_info = f"\n   Последнее обновление: {current_date}\n   Предыдущее обновление: {prev_date}"
-                
-                result.append(f"{i}. {row['title']}")
-                result.append(f"   ID: {row['id']}")
-                result.append(f"   Текущая цена: {formatted_price} AED")
-                result.append(f"   Предыдущая цена: {formatted_prev_price} AED")
-                result.append(f"   Изменение: {formatted_pct_change}{date_info}")
-                result.append(f"   Площадь: {formatted_area} кв.м.")
-                result.append(f"   Спальни: {rooms}")
-                result.append(f"   Ссылка: {row['property_url']}")
-                result.append("")
-            
-            result.append("")
+        # Снятые с публикации объявления не попадают в отчет; проверяются только кандидаты в топ локаций
+        sorted_df = await drop_dead_listings_async(sorted_df, top_per_location)
         
-        # Собираем результат в строку
-        analysis = "\n".join(result)
+        # Формируем текстовый отчет по локациям
+        if publish_state is not None and not publish_state.full_digest_due():
+            # Публикуем только объявления, которых не было в прошлом отчете или у которых изменились цена или место
+            top_df = top_per_location(sorted_df)
+            delta_df = top_df[publish_state.changed_mask(top_df)]
+            publish_state.stage(top_df, full=False)
+            print(f"Новых и изменившихся объявлений с прошлой публикации: {len(delta_df)} из {len(top_df)}")
+            if delta_df.empty:
+                return ""
+            analysis = format_price_changes_report(
+                delta_df,
+                header="Новые и изменившиеся с прошлой публикации объявления среди самых резких "
+                       "изменений цен на квартиры 40-60 кв.м.:\n"
+            )
+        else:
+            analysis = format_price_changes_report(sorted_df)
+            if publish_state is not None:
+                publish_state.stage(top_per_location(sorted_df), full=True)
         
         # Сохраняем результат в файл с датой и временем
         current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -374,11 +469,14 @@ class TelegramPublisher:
         """Инициализация класса"""
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.chat_id = os.getenv('TELEGRAM_CHANNEL_ID')
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        self.api_url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/sendMessage"
+        # Способ доставки длинного анализа: серия сообщений или один документ (см. telegram_document.py)
+        self.delivery_mode = TELEGRAM_DELIVERY_MODE
         # Отладочный вывод
         print(f"TELEGRAM_BOT_TOKEN: {self.bot_token}")
         print(f"TELEGRAM_CHANNEL_ID: {self.chat_id}")
     
+    @timed('telegram_send')
     async def send_message(self, text):
         """Отправляет сообщение в Telegram, разбивая на части"""
         # Очищаем текст от HTML-тегов и специальных символов
@@ -387,8 +485,15 @@ class TelegramPublisher:
         # Используем улучшенный алгоритм разбиения текста
         chunks = split_text_into_chunks(text, max_length=3000)
         
+        # Длинный анализ отправляем одним документом со сводкой вместо серии сообщений с паузами
+        if use_document_delivery(len(chunks), self.delivery_mode):
+            return await self.send_document(text)
+        
+        # aiohttp загружается только при отправке, чтобы не замедлять запуск
+        import aiohttp
+        
         try:
-            connector = aiohttp.TCPConnector(ssl=ssl_context)
+            connector = aiohttp.TCPConnector(ssl=get_ssl_context())
             async with aiohttp.ClientSession(connector=connector) as session:
                 # Отправляем каждый чанк
                 for i, chunk in enumerate(chunks):
@@ -464,12 +569,51 @@ class TelegramPublisher:
             logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
             return False
 
+    @timed('telegram_send_document')
+    async def send_document(self, text):
+        """Отправляет очищенный текст анализа одним HTML-документом с краткой сводкой в подписи"""
+        import aiohttp
+        
+        now = datetime.now()
+        title = f"💰 ИЗМЕНЕНИЯ ЦЕН НА НЕДВИЖИМОСТЬ - {now.strftime('%d.%m.%Y %H:%M')}"
+        document = render_analysis_document(text, title)
+        caption = build_caption(title, [
+            "🔎 КВАРТИРЫ 40-60 КВ. М.",
+            f"📍 Локаций: {text.count('Локация: ')}, объявлений: {text.count('   ID: ')}",
+            "📎 Полный отчет со ссылками на объявления — во вложении.",
+            "",
+            "#недвижимость #ОАЭ #ценынаквартиры #инвестиции #квартиры #доходность"
+        ])
+        
+        try:
+            connector = aiohttp.TCPConnector(ssl=get_ssl_context())
+            async with aiohttp.ClientSession(connector=connector) as session:
+                success, error_text = await send_document(
+                    session, self.api_url, self.chat_id, f"medium_apartments_{now.strftime('%Y%m%d_%H%M')}.html",
+                    document, caption
+                )
+            if success:
+                logger.info(f"Анализ отправлен в Telegram одним документом ({len(document)} байт)")
+            else:
+                logger.error(f"Ошибка при отправке документа в Telegram: {error_text}")
+            return success
+        except Exception as e:
+            logger.error(f"Ошибка при отправке документа в Telegram: {e}")
+            return False
+
     async def publish_analysis(self):
         """Публикует результаты анализа в Telegram"""
         try:
             # Получаем анализ
             logger.info("Получение анализа квартир с изменениями цен...")
-            analysis = find_price_change_apartments()
+            # В режиме delta отправляются только изменения с прошлой публикации
+            publish_state = PublishState.load('medium_apartments') if PUBLISH_MODE == 'delta' else None
+            analysis = await find_price_change_apartments(publish_state)
+            
+            if analysis == "":
+                logger.info("С прошлой публикации изменений нет, отправка не требуется")
+                publish_state.save()
+                return True
             
             if not analysis:
                 logger.error("Не удалось получить анализ")
@@ -485,6 +629,8 @@ class TelegramPublisher:
             
             if success:
                 logger.info("Анализ успешно опубликован в Telegram")
+                if publish_state is not None:
+                    publish_state.save()
             else:
                 logger.error("Ошибка при публикации анализа в Telegram")
                 
@@ -497,12 +643,20 @@ class TelegramPublisher:
 async def main():
     """Основная функция"""
     logger.info("Запуск скрипта публикации анализа изменений цен на квартиры 40-60 кв.м. в Telegram")
+    configure_metrics('medium_apartments')
     publisher = TelegramPublisher()
     success = await publisher.publish_analysis()
+    # Сохраняем метрики этапов для мониторинга
+    write_openmetrics()
     if success:
         print("Анализ успешно опубликован в Telegram")
     else:
         print("Ошибка при публикации анализа в Telegram")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Публикация анализа изменений цен на квартиры 40-60 кв.м. в Telegram")
+    args = add_profile_arguments(parser).parse_args()
+    if args.profile:
+        profile_call(lambda: asyncio.run(main()), 'medium_apartments_publisher', args.profile_top)
+    else:
+        asyncio.run(main())
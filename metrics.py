@@ -0,0 +1,210 @@
+"""
+Замеры длительности этапов публикаторов и экспорт метрик в формате OpenMetrics.
+
+Этапы (подключение к БД, выборки, построение карты, рендеринг, загрузка на FTP,
+отправка в Telegram) оборачиваются в контекстный менеджер stage() или декоратор
+timed(). Для каждого этапа фиксируются длительность, количество строк, размер
+в байтах и ошибки; результат записывается в текстовый файл для textfile-коллектора
+node_exporter или отдается по HTTP.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Каталог для файлов метрик (по одному файлу на публикатор)
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+
+_lock = threading.Lock()
+_publisher = 'default'
+# (этап) -> {'count', 'sum', 'last', 'rows', 'bytes', 'errors'}
+_stages = {}
+
+
+def configure(publisher):
+    """Задает имя публикатора, которое попадает в метку publisher всех метрик."""
+    global _publisher
+    _publisher = publisher
+
+
+class StageRecord:
+    """Данные одного выполнения этапа; внутри блока можно указать rows и bytes."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.bytes = None
+        self.duration = None
+
+
+def _record(record, failed):
+    with _lock:
+        stats = _stages.setdefault(record.name, {
+            'count': 0, 'sum': 0.0, 'last': 0.0, 'rows': None, 'bytes': None, 'errors': 0
+        })
+        stats['count'] += 1
+        stats['sum'] += record.duration
+        stats['last'] = record.duration
+        if record.rows is not None:
+            stats['rows'] = record.rows
+        if record.bytes is not None:
+            stats['bytes'] = record.bytes
+        if failed:
+            stats['errors'] += 1
+    logger.info(
+        f"Этап {record.name}: {record.duration:.3f} с"
+        + (f", строк: {record.rows}" if record.rows is not None else "")
+        + (f", байт: {record.bytes}" if record.bytes is not None else "")
+    )
+
+
+@contextmanager
+def stage(name):
+    """Контекстный менеджер, замеряющий длительность этапа name."""
+    record = StageRecord(name)
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield record
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record.duration = time.perf_counter() - start
+        _record(record, failed)
+
+
+def _measure_result(record, result, rows, size):
+    if result is None:
+        return
+    if rows is not None:
+        record.rows = rows(result)
+    if size is not None:
+        record.bytes = size(result)
+
+
+def timed(name, rows=None, size=None):
+    """
+    Декоратор для синхронных и асинхронных функций. Необязательные rows и size —
+    функции, вычисляющие количество строк и размер в байтах по результату.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name) as record:
+                    result = await func(*args, **kwargs)
+                    _measure_result(record, result, rows, size)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = func(*args, **kwargs)
+                _measure_result(record, result, rows, size)
+                return result
+        return wrapper
+    return decorator
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_openmetrics():
+    """Возвращает текущие метрики в текстовом формате OpenMetrics."""
+    publisher = _escape(_publisher)
+    with _lock:
+        stages = {name: dict(stats) for name, stats in sorted(_stages.items())}
+
+    def labels(stage_name):
+        return f'{{publisher="{publisher}",stage="{_escape(stage_name)}"}}'
+
+    lines = [
+        "# HELP publisher_stage_duration_seconds Длительность выполнения этапа.",
+        "# TYPE publisher_stage_duration_seconds summary",
+        "# UNIT publisher_stage_duration_seconds seconds"
+    ]
+    for name, stats in stages.items():
+        lines.append(f"publisher_stage_duration_seconds_count{labels(name)} {stats['count']}")
+        lines.append(f"publisher_stage_duration_seconds_sum{labels(name)} {stats['sum']:.6f}")
+
+    lines += [
+        "# HELP publisher_stage_last_duration_seconds Длительность последнего выполнения этапа.",
+        "# TYPE publisher_stage_last_duration_seconds gauge",
+        "# UNIT publisher_stage_last_duration_seconds seconds"
+    ]
+    for name, stats in stages.items():
+        lines.append(f"publisher_stage_last_duration_seconds{labels(name)} {stats['last']:.6f}")
+
+    lines += [
+        "# HELP publisher_stage_rows Количество строк, обработанных этапом.",
+        "# TYPE publisher_stage_rows gauge"
+    ]
+    for name, stats in stages.items():
+        if stats['rows'] is not None:
+            lines.append(f"publisher_stage_rows{labels(name)} {stats['rows']}")
+
+    lines += [
+        "# HELP publisher_stage_bytes Размер данных, сформированных или переданных этапом.",
+        "# TYPE publisher_stage_bytes gauge",
+        "# UNIT publisher_stage_bytes bytes"
+    ]
+    for name, stats in stages.items():
+        if stats['bytes'] is not None:
+            lines.append(f"publisher_stage_bytes{labels(name)} {stats['bytes']}")
+
+    lines += [
+        "# HELP publisher_stage_errors Количество завершившихся ошибкой выполнений этапа.",
+        "# TYPE publisher_stage_errors counter"
+    ]
+    for name, stats in stages.items():
+        lines.append(f"publisher_stage_errors_total{labels(name)} {stats['errors']}")
+
+    lines += [
+        "# HELP publisher_last_run_timestamp_seconds Время записи метрик.",
+        "# TYPE publisher_last_run_timestamp_seconds gauge",
+        f'publisher_last_run_timestamp_seconds{{publisher="{publisher}"}} {time.time():.3f}',
+        "# EOF"
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_openmetrics(path=None):
+    """Атомарно записывает метрики в файл (по умолчанию metrics/<publisher>.prom)."""
+    path = path or os.path.join(METRICS_DIR, f"{_publisher}.prom")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_openmetrics())
+    os.replace(tmp_path, path)
+    return path
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Запускает HTTP-эндпоинт с метриками в фоновом потоке (для долгоживущих процессов)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_openmetrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
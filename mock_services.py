@@ -0,0 +1,107 @@
+"""
+Локальные имитации внешних HTTP-сервисов для тестов и бенчмарков:
+Telegram Bot API и страницы объявлений bayut.com. Серверы aiohttp работают
+в отдельном потоке со своим циклом событий, start() возвращает базовый адрес.
+"""
+
+import time
+import asyncio
+import threading
+
+from aiohttp import web
+
+BENCH_BOT_TOKEN = '123456:BENCHMARK'
+BENCH_CHAT_ID = '-1000000000001'
+
+
+class MockBotApi:
+    """Имитация Telegram Bot API на aiohttp, работающая в отдельном потоке."""
+
+    def __init__(self):
+        self.calls = {}
+        self.port = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._message_id = 0
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        # Тело запроса читаем полностью, как это делал бы настоящий сервер
+        await request.read()
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            self._message_id += 1
+            result = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(BENCH_CHAT_ID), 'type': 'channel'}
+            }
+        return web.json_response({'ok': True, 'result': result})
+
+    def _add_routes(self, app):
+        app.router.add_post('/bot{token}/{method}', self._handle)
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            self._add_routes(app)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class MockListingSite(MockBotApi):
+    """
+    Имитация страниц объявлений: id, кратные 10, сняты (404), на id с остатком 1
+    HEAD не поддерживается (405, ответ только на GET), остальные опубликованы.
+    Считает запросы и наибольшее количество одновременных запросов к каждому хосту.
+    """
+
+    def __init__(self, latency=0.05):
+        super().__init__()
+        self.latency = latency
+        self.active = {}
+        self.max_active = {}
+
+    async def _handle(self, request):
+        host = request.host
+        self.calls[request.method] = self.calls.get(request.method, 0) + 1
+        self.active[host] = self.active.get(host, 0) + 1
+        self.max_active[host] = max(self.max_active.get(host, 0), self.active[host])
+        try:
+            await asyncio.sleep(self.latency)
+            listing_id = int(request.match_info['id'])
+            if listing_id % 10 == 0:
+                return web.Response(status=404)
+            if listing_id % 10 == 1 and request.method == 'HEAD':
+                return web.Response(status=405)
+            return web.Response(text='<html></html>', content_type='text/html')
+        finally:
+            self.active[host] -= 1
+
+    def _add_routes(self, app):
+        # GET в aiohttp обрабатывает и HEAD
+        app.router.add_get('/property/{id}/', self._handle)
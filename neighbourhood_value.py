@@ -0,0 +1,238 @@
+"""
+Сравнение цены квартиры с ее географическими соседями.
+
+Ранг внутри текстового региона (location) — грубое сравнение: регионы
+разного размера, а названия в объявлениях не всегда совпадают. Здесь по
+координатам всех актуальных объявлений строится KD-дерево (scipy.spatial.cKDTree),
+и для каждой квартиры цена за квадратный метр сравнивается с медианой
+K ближайших соседей или всех соседей в радиусе R метров. Построение дерева и
+запросы к нему — O(N log N) вместо попарного сравнения всех объявлений.
+
+Использование:
+    python neighbourhood_value.py [--k 15] [--top 20]
+    python neighbourhood_value.py --radius 500 --area-max 40 --csv best_value.csv
+"""
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from local_snapshot import read_analysis_query
+from schema_capabilities import get_schema_capabilities, LATEST_VIEW_NAME, TABLE_NAME
+from latest_listings import use_latest_view
+
+# Количество ближайших соседей для сравнения
+NEIGHBOURHOOD_K = int(os.getenv('NEIGHBOURHOOD_K', '15'))
+
+# Минимальное количество соседей в радиусе, чтобы сравнение считалось надежным
+NEIGHBOURHOOD_MIN_NEIGHBOURS = int(os.getenv('NEIGHBOURHOOD_MIN_NEIGHBOURS', '5'))
+
+# Количество точек, для которых соседи в радиусе ищутся за один запрос к дереву
+NEIGHBOURHOOD_CHUNK = 2000
+
+# Средний радиус Земли в метрах
+EARTH_RADIUS_M = 6371008.8
+
+# Актуальные объявления с координатами: из представления последних снимков или по updated_at
+LATEST_VIEW_LISTINGS_QUERY = f"""
+SELECT id, title, location, rooms, area, price, geography
+FROM {LATEST_VIEW_NAME}
+WHERE price > 0 AND area > 0 AND geography IS NOT NULL
+"""
+
+LATEST_LISTINGS_QUERY = f"""
+SELECT id, title, location, rooms, area, price, geography
+FROM (
+    SELECT
+        id, title, location, rooms, area, price, geography,
+        ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) as rn
+    FROM {TABLE_NAME}
+) ranked
+WHERE rn = 1 AND price > 0 AND area > 0 AND geography IS NOT NULL
+"""
+
+ALL_LISTINGS_QUERY = f"""
+SELECT id, title, location, rooms, area, price, geography
+FROM {TABLE_NAME}
+WHERE price > 0 AND area > 0 AND geography IS NOT NULL
+"""
+
+
+def extract_coordinates(geography):
+    """Разбирает строки 'Широта: ..., Долгота: ...' в колонки latitude и longitude (векторно)."""
+    coords = geography.str.extract(r'Широта:\s*([-\d.]+),\s*Долгота:\s*([-\d.]+)')
+    return pd.DataFrame({
+        'latitude': pd.to_numeric(coords[0], errors='coerce'),
+        'longitude': pd.to_numeric(coords[1], errors='coerce')
+    }, index=geography.index)
+
+
+def fetch_listings(conn, area_min=None, area_max=None):
+    """Загружает актуальные объявления с координатами (при необходимости в диапазоне площади)."""
+    capabilities = get_schema_capabilities(conn)
+    if use_latest_view(capabilities):
+        query = LATEST_VIEW_LISTINGS_QUERY
+    elif capabilities.has_updated_at:
+        query = LATEST_LISTINGS_QUERY
+    else:
+        query = ALL_LISTINGS_QUERY
+    df = read_analysis_query(query, conn)
+
+    if area_min is not None:
+        df = df[df['area'] > area_min]
+    if area_max is not None:
+        df = df[df['area'] <= area_max]
+    df = pd.concat([df, extract_coordinates(df['geography'])], axis=1)
+    return df.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+
+
+def project_to_metres(latitude, longitude):
+    """
+    Переводит координаты в метры в локальной равнопромежуточной проекции вокруг
+    средней широты. На масштабе города расстояния искажаются меньше чем на 0,1%.
+    """
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_lat = np.cos(latitude.mean())
+    return np.column_stack((EARTH_RADIUS_M * longitude * cos_lat, EARTH_RADIUS_M * latitude))
+
+
+def _segment_medians(rows, neighbours, values, count):
+    """Медианы values по группам соседей: rows — номер квартиры, neighbours — номер соседа."""
+    order = np.lexsort((values[neighbours], rows))
+    sorted_values = values[neighbours][order]
+    lengths = np.bincount(rows, minlength=count)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    medians = np.full(count, np.nan)
+    has = lengths > 0
+    lower = starts[has] + (lengths[has] - 1) // 2
+    upper = starts[has] + lengths[has] // 2
+    medians[has] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return medians, lengths
+
+
+def neighbour_medians(points, values, k=None, radius=None):
+    """
+    Для каждой точки считает медиану values ее соседей (сама точка не учитывается):
+    K ближайших или всех в радиусе radius метров. Возвращает (медианы,
+    количество соседей, расстояние до самого дальнего учтенного соседя).
+    """
+    from scipy.spatial import cKDTree
+
+    count = len(points)
+    tree = cKDTree(points)
+
+    if radius is not None:
+        medians = np.full(count, np.nan)
+        lengths = np.zeros(count, dtype=np.int64)
+        distances = np.zeros(count)
+        # В плотных районах в радиус попадают тысячи соседей, поэтому точки обрабатываются порциями
+        for start in range(0, count, NEIGHBOURHOOD_CHUNK):
+            chunk = slice(start, min(start + NEIGHBOURHOOD_CHUNK, count))
+            chunk_points = points[chunk]
+            neighbour_lists = tree.query_ball_point(chunk_points, r=radius, workers=-1, return_sorted=False)
+            chunk_lengths = np.fromiter((len(items) for items in neighbour_lists), dtype=np.int64,
+                                        count=len(neighbour_lists))
+            rows = np.repeat(np.arange(len(neighbour_lists)), chunk_lengths)
+            neighbours = np.concatenate(neighbour_lists).astype(np.int64)
+            keep = neighbours != rows + start
+            rows, neighbours = rows[keep], neighbours[keep]
+            medians[chunk], lengths[chunk] = _segment_medians(rows, neighbours, values, len(neighbour_lists))
+            np.maximum.at(distances[chunk], rows, np.hypot(*(points[neighbours] - chunk_points[rows]).T))
+        return medians, lengths, distances
+
+    k = min(k or NEIGHBOURHOOD_K, count - 1)
+    if k < 1:
+        return np.full(count, np.nan), np.zeros(count, dtype=np.int64), np.zeros(count)
+    # Запрашиваем на одного соседа больше: среди найденных обычно есть сама точка
+    distances, indices = tree.query(points, k=k + 1, workers=-1)
+    is_self = indices == np.arange(count)[:, None]
+    # Сама точка (или лишний сосед, если точка совпала с другими координатами) уходит в конец строки
+    order = np.argsort(is_self, axis=1, kind='stable')[:, :k]
+    indices = np.take_along_axis(indices, order, axis=1)
+    distances = np.take_along_axis(distances, order, axis=1)
+    return np.median(values[indices], axis=1), np.full(count, k), distances.max(axis=1)
+
+
+def compute_neighbourhood_value(df, k=None, radius=None):
+    """
+    Добавляет к объявлениям цену за кв.м., медиану соседей, отношение к ней
+    и скидку в процентах (положительная — дешевле соседей).
+    """
+    df = df.copy()
+    df['price_per_sqm'] = df['price'].astype(float) / df['area'].astype(float)
+    points = project_to_metres(df['latitude'], df['longitude'])
+    medians, neighbours, distances = neighbour_medians(points, df['price_per_sqm'].to_numpy(), k, radius)
+    df['neighbour_median_per_sqm'] = medians
+    df['neighbours'] = neighbours
+    df['neighbour_distance_m'] = distances
+    df['value_ratio'] = df['price_per_sqm'] / df['neighbour_median_per_sqm']
+    df['discount_pct'] = (1 - df['value_ratio']) * 100
+    return df
+
+
+def best_value(df, top=20, min_neighbours=None):
+    """Квартиры с наибольшей скидкой к соседям при достаточном количестве соседей."""
+    min_neighbours = NEIGHBOURHOOD_MIN_NEIGHBOURS if min_neighbours is None else min_neighbours
+    reliable = df[(df['neighbours'] >= min_neighbours) & df['value_ratio'].notna()]
+    return reliable.nsmallest(top, 'value_ratio')
+
+
+def format_best_value_report(df, radius=None):
+    """Текстовый отчет о квартирах, заметно дешевле своего окружения."""
+    if df.empty:
+        return "Нет квартир с достаточным количеством соседей для сравнения."
+    if radius is not None:
+        basis = f"соседей в радиусе {radius:g} м"
+    else:
+        # При малом количестве квартир K уменьшается до их количества минус один (см. neighbour_medians)
+        basis = f"{int(df['neighbours'].max())} ближайших соседей"
+    lines = [f"🏷 Лучшие предложения относительно медианы {basis}\n"]
+    for position, row in enumerate(df.itertuples(index=False), 1):
+        lines.append(
+            f"{position}. {row.location}: {int(row.price):,} AED, {row.area:.1f} кв.м.\n"
+            f"   {row.price_per_sqm:,.0f} AED/кв.м. против {row.neighbour_median_per_sqm:,.0f} у соседей "
+            f"(-{row.discount_pct:.1f}%, соседей: {row.neighbours}, до {row.neighbour_distance_m:,.0f} м)\n"
+            f"   https://www.bayut.com/property/{row.id}/\n"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение цены за кв.м. с ближайшими соседями")
+    parser.add_argument('--k', type=int, default=None, help=f"Количество соседей (по умолчанию {NEIGHBOURHOOD_K})")
+    parser.add_argument('--radius', type=float, default=None, help="Радиус в метрах вместо K соседей")
+    parser.add_argument('--area-min', type=float, default=None)
+    parser.add_argument('--area-max', type=float, default=None)
+    parser.add_argument('--top', type=int, default=20, help="Количество квартир в отчете")
+    parser.add_argument('--csv', default=None, help="Сохранить оценку всех квартир в CSV")
+    args = parser.parse_args(argv)
+
+    import psycopg2
+    from local_snapshot import DB_PARAMS
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        listings = fetch_listings(conn, args.area_min, args.area_max)
+    finally:
+        conn.close()
+    if listings.empty:
+        print("Данные не найдены в БД.")
+        return
+
+    scored = compute_neighbourhood_value(listings, args.k, args.radius)
+    if args.csv:
+        scored.drop(columns='geography').to_csv(args.csv, index=False)
+        print(f"Оценка {len(scored)} квартир сохранена в {args.csv}")
+    print(format_best_value_report(best_value(scored, args.top), args.radius))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Параллельная выборка аналитического запроса по партициям на нескольких соединениях.
+
+Запрос делится на K непересекающихся частей по хешу location или по остатку
+от деления id: каждое обращение к bayut_properties в запросе заменяется
+подзапросом с условием партиции. Части выполняются одновременно на соединениях
+из пула, а результаты объединяются с общим шагом сортировки и топ-N.
+
+Деление нужно выбирать по ключу оконных функций запроса, тогда каждая часть
+вычисляется точно: ranked_apartments (PARTITION BY location) делится по location,
+price_history (PARTITION BY id) — по id.
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import local_snapshot
+
+# Количество партиций (1 — выборка одним запросом)
+PARALLEL_FETCH_PARTITIONS = int(os.getenv('PARALLEL_FETCH_PARTITIONS', '1'))
+
+# Условия партиций: номер партиции k из K
+PARTITION_PREDICATES = {
+    'location': "mod(abs(hashtext(coalesce(location, ''))), {partitions}) = {index}",
+    'id': "mod(abs(id), {partitions}) = {index}"
+}
+
+# Слова, которые могут идти сразу после имени таблицы и не являются ее псевдонимом
+SQL_KEYWORDS = {'where', 'join', 'on', 'group', 'order', 'limit', 'left', 'right', 'inner', 'full',
+                'cross', 'window', 'union', 'having', 'offset', 'using'}
+
+# Пулы соединений: параметры подключения -> ThreadedConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def parallel_fetch_enabled(partitions=None):
+    """Параллельная выборка включена и аналитика идет в PostgreSQL (не в локальный снимок)."""
+    partitions = partitions or PARALLEL_FETCH_PARTITIONS
+    return partitions > 1 and local_snapshot.ANALYSIS_SOURCE != 'snapshot'
+
+
+def partition_query(query, partition_by, index, partitions, table='bayut_properties'):
+    """Заменяет каждое обращение FROM/JOIN к таблице подзапросом с условием партиции."""
+    predicate = PARTITION_PREDICATES[partition_by].format(partitions=partitions, index=index)
+    pattern = re.compile(rf'\b(FROM|JOIN)\s+{table}\b(\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+
+    def replace(match):
+        alias = match.group(3)
+        suffix = ''
+        if alias is None or alias.lower() in SQL_KEYWORDS:
+            # Псевдонима нет: сохраняем имя таблицы, чтобы ссылки table.column остались верными
+            suffix = match.group(2) or ''
+            alias = table
+        return f"{match.group(1)} (SELECT * FROM {table} WHERE {predicate}) AS {alias}{suffix}"
+
+    partitioned, count = pattern.subn(replace, query)
+    if not count:
+        raise ValueError(f"В запросе нет обращений к таблице {table}")
+    return partitioned
+
+
+def get_fetch_pool(db_params, size):
+    """Возвращает (и при первом вызове создает) пул соединений для параллельной выборки."""
+    from psycopg2.pool import ThreadedConnectionPool
+
+    key = tuple(sorted((name, str(value)) for name, value in db_params.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.maxconn < size:
+            if pool is not None:
+                pool.closeall()
+            pool = ThreadedConnectionPool(1, size, **db_params)
+            _pools[key] = pool
+    return pool
+
+
+def close_fetch_pools():
+    """Закрывает все соединения пулов параллельной выборки."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+
+def _fetch_partition(pool, query, params):
+    conn = pool.getconn()
+    try:
+        df = local_snapshot.read_analysis_query(query, conn, params)
+        conn.commit()
+        return df
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def parallel_read_query(query, params=None, partition_by='location', partitions=None, db_params=None,
+                        order_by=None, ascending=True, key=None, limit=None, table='bayut_properties'):
+    """
+    Выполняет запрос K частями параллельно и объединяет результат.
+    table — таблица или представление, к которому обращается запрос.
+
+    order_by/ascending/key повторяют ORDER BY запроса для объединенного результата
+    (key передается в DataFrame.sort_values, например abs для ORDER BY ABS(...)),
+    limit — общий топ-N после объединения.
+    """
+    partitions = partitions or PARALLEL_FETCH_PARTITIONS
+    db_params = db_params or local_snapshot.DB_PARAMS
+    pool = get_fetch_pool(db_params, partitions)
+
+    queries = [partition_query(query, partition_by, index, partitions, table) for index in range(partitions)]
+    with ThreadPoolExecutor(max_workers=partitions) as executor:
+        parts = list(executor.map(lambda part_query: _fetch_partition(pool, part_query, params), queries))
+
+    import pandas as pd
+
+    non_empty = [part for part in parts if not part.empty]
+    if not non_empty:
+        return parts[0]
+    df = pd.concat(non_empty, ignore_index=True)
+    if order_by is not None:
+        df = df.sort_values(order_by, ascending=ascending, key=key, kind='stable', ignore_index=True)
+    if limit is not None:
+        df = df.head(limit)
+    return df
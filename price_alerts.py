@@ -0,0 +1,405 @@
+"""
+Оповещения о снижении цен почти в реальном времени через LISTEN/NOTIFY.
+
+Публикаторы изменений цен пересчитывают все изменения только при запуске по
+расписанию. Здесь триггер на bayut_properties при каждой вставке или изменении
+цены отправляет NOTIFY с id объявления и новой ценой, а постоянно работающий
+асинхронный слушатель (asyncpg) собирает уведомления в пакеты, сравнивает
+каждую цену с последней известной ценой объявления из словаря в памяти и
+отправляет в Telegram оповещения о снижениях больше порога — через несколько
+секунд после загрузки данных и без сканирования таблицы.
+
+Словарь последних цен заполняется один раз при запуске (из представления
+последних снимков, если оно есть) и дальше обновляется только уведомлениями.
+Цена объявления со снижением записывается в словарь только после доставки
+оповещения: недоставленные оповещения отправляются повторно со следующим пакетом.
+
+Использование:
+    python price_alerts.py install
+    python price_alerts.py listen [--dry-run]
+    python price_alerts.py uninstall
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from schema_capabilities import TABLE_NAME, LATEST_VIEW_NAME
+
+logger = logging.getLogger(__name__)
+
+# Канал уведомлений об изменениях цен
+PRICE_ALERT_CHANNEL = os.getenv('PRICE_ALERT_CHANNEL', 'bayut_price_changes')
+
+# Минимальное снижение цены для оповещения, %
+PRICE_ALERT_DROP_PCT = float(os.getenv('PRICE_ALERT_DROP_PCT', '5'))
+
+# Пакет уведомлений обрабатывается через столько секунд после первого уведомления в нем
+PRICE_ALERT_BATCH_SECONDS = float(os.getenv('PRICE_ALERT_BATCH_SECONDS', '2'))
+
+# Максимальный размер пакета уведомлений
+PRICE_ALERT_BATCH_SIZE = int(os.getenv('PRICE_ALERT_BATCH_SIZE', '1000'))
+
+# Диапазон площади квартир для оповещений (кв.м.), пустое значение — без ограничения
+PRICE_ALERT_AREA_MAX = float(os.getenv('PRICE_ALERT_AREA_MAX')) if os.getenv('PRICE_ALERT_AREA_MAX') else None
+
+# Максимальная длина одного сообщения Telegram с оповещениями
+TELEGRAM_MESSAGE_LIMIT = 3500
+
+# Параметры Telegram
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Триггер отправляет уведомление только при вставке снимка или изменении цены;
+# полезная нагрузка — небольшой JSON, без обращения к другим строкам таблицы
+CREATE_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {TABLE_NAME}_price_notify() RETURNS trigger AS $$
+BEGIN
+    IF NEW.price IS NULL OR NEW.price <= 0 THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW.price IS NOT DISTINCT FROM OLD.price THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('{PRICE_ALERT_CHANNEL}', json_build_object(
+        'id', NEW.id,
+        'price', NEW.price,
+        'area', NEW.area,
+        'location', NEW.location,
+        'title', NEW.title,
+        'property_url', NEW.property_url
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {TABLE_NAME}_price_notify ON {TABLE_NAME};
+CREATE TRIGGER {TABLE_NAME}_price_notify
+AFTER INSERT OR UPDATE OF price ON {TABLE_NAME}
+FOR EACH ROW EXECUTE FUNCTION {TABLE_NAME}_price_notify();
+"""
+
+DROP_TRIGGER_SQL = f"""
+DROP TRIGGER IF EXISTS {TABLE_NAME}_price_notify ON {TABLE_NAME};
+DROP FUNCTION IF EXISTS {TABLE_NAME}_price_notify();
+"""
+
+# Последние цены объявлений для начального заполнения словаря
+LATEST_VIEW_PRICES_QUERY = f"SELECT id, price FROM {LATEST_VIEW_NAME}"
+
+LATEST_PRICES_QUERY = f"""
+SELECT DISTINCT ON (id) id, price
+FROM {TABLE_NAME}
+WHERE price > 0 AND updated_at IS NOT NULL
+ORDER BY id, updated_at DESC
+"""
+
+
+async def connect():
+    """Открывает соединение asyncpg с параметрами из .env."""
+    import asyncpg
+
+    port = os.getenv("DB_PORT")
+    return await asyncpg.connect(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(port) if port else None
+    )
+
+
+async def load_last_prices(conn):
+    """Загружает последнюю цену каждого объявления: {id: цена}."""
+    has_view = await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = $1 AND ispopulated)",
+        LATEST_VIEW_NAME
+    )
+    rows = await conn.fetch(LATEST_VIEW_PRICES_QUERY if has_view else LATEST_PRICES_QUERY)
+    return {row['id']: float(row['price']) for row in rows}
+
+
+def parse_notification(notification):
+    """
+    Проверяет уведомление и приводит цену и площадь к числам.
+    Возвращает None, если нет id или цена не положительное число.
+    """
+    try:
+        listing_id = notification['id']
+        price = float(notification['price'])
+        area = notification.get('area')
+        area = float(area) if area is not None else None
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return None
+    if listing_id is None or not math.isfinite(price) or price <= 0:
+        return None
+    return {**notification, 'price': price, 'area': area}
+
+
+def _price_drop_alert(notification, prev_price, drop_pct, area_max):
+    """Оповещение о снижении цены объявления или None, если оповещать не о чем."""
+    from price_outliers import price_typo_mask
+
+    price = notification['price']
+    if prev_price is None or prev_price <= 0 or price >= prev_price:
+        return None
+    if area_max is not None and notification['area'] is not None and notification['area'] > area_max:
+        return None
+    pct_change = (price - prev_price) / prev_price * 100
+    if -pct_change < drop_pct:
+        return None
+    # Снижение ровно в 10 раз — пропущенный ноль, а не реальная цена
+    if price_typo_mask([math.log10(price / prev_price)])[0]:
+        logger.info(f"Объявление {notification['id']}: пропущено снижение в 10**n раз (ошибка ввода)")
+        return None
+    return {**notification, 'prev_price': prev_price, 'pct_change': pct_change}
+
+
+def find_price_drops(notifications, last_prices, drop_pct=None, area_max=None):
+    """
+    Сравнивает новые цены пакета с последними известными.
+    Если объявление изменилось несколько раз за пакет, учитывается последняя цена;
+    некорректные уведомления пропускаются. Цены объявлений без оповещения сразу
+    записываются в last_prices, а со снижением — только после доставки оповещения
+    (см. PriceAlertListener.process_batch).
+    Возвращает список оповещений о снижениях не меньше drop_pct процентов.
+    """
+    drop_pct = PRICE_ALERT_DROP_PCT if drop_pct is None else drop_pct
+    area_max = PRICE_ALERT_AREA_MAX if area_max is None else area_max
+
+    latest = {}
+    for notification in notifications:
+        parsed = parse_notification(notification)
+        if parsed is None:
+            logger.warning(f"Пропущено некорректное уведомление: {str(notification)[:200]}")
+            continue
+        latest[parsed['id']] = parsed
+
+    alerts = []
+    for listing_id, notification in latest.items():
+        alert = _price_drop_alert(notification, last_prices.get(listing_id), drop_pct, area_max)
+        if alert is None:
+            last_prices[listing_id] = notification['price']
+        else:
+            alerts.append(alert)
+
+    alerts.sort(key=lambda alert: alert['pct_change'])
+    return alerts
+
+
+def format_alert(alert):
+    """Текст оповещения об одном снижении цены."""
+    import html
+
+    area = f", {float(alert['area']):.1f} кв.м." if alert.get('area') is not None else ""
+    url = alert.get('property_url') or f"https://www.bayut.com/property/{alert['id']}/"
+    return (
+        f"📉 <b>{html.escape(str(alert.get('title') or alert['id']))}</b>\n"
+        f"{html.escape(str(alert.get('location') or ''))}{area}\n"
+        f"{alert['prev_price']:,.0f} → {float(alert['price']):,.0f} AED ({alert['pct_change']:.1f}%)\n"
+        f"<a href=\"{html.escape(url)}\">Открыть объявление</a>"
+    )
+
+
+def build_alert_messages(alerts):
+    """
+    Собирает оповещения пакета в сообщения не длиннее TELEGRAM_MESSAGE_LIMIT.
+    Возвращает пары (текст сообщения, оповещения в нем).
+    """
+    header = f"🔔 СНИЖЕНИЕ ЦЕН - {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+    messages, current, current_alerts = [], header, []
+    for alert in alerts:
+        text = format_alert(alert) + "\n\n"
+        if len(current) + len(text) > TELEGRAM_MESSAGE_LIMIT and current_alerts:
+            messages.append((current.rstrip(), current_alerts))
+            current, current_alerts = header, []
+        current += text
+        current_alerts.append(alert)
+    if current_alerts:
+        messages.append((current.rstrip(), current_alerts))
+    return messages
+
+
+async def send_alert_messages(session, messages):
+    """
+    Отправляет сообщения с оповещениями в Telegram по порядку и возвращает
+    количество доставленных. Ошибка сети, тайм-аут, 429 или 5xx прерывают
+    отправку: оставшиеся сообщения повторяются позже. Прочие ответы с ошибкой
+    (сообщение не принято) не повторяются.
+    """
+    import aiohttp
+
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    for sent, message in enumerate(messages):
+        try:
+            async with session.post(url, json={
+                'chat_id': TELEGRAM_CHANNEL_ID,
+                'text': message,
+                'parse_mode': 'HTML',
+                'disable_web_page_preview': True
+            }) as response:
+                status = response.status
+                error = None if status == 200 else await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.error(f"Не удалось отправить оповещение в Telegram: {e!r}")
+            return sent
+        if error is not None:
+            logger.error(f"Ошибка при отправке оповещения в Telegram ({status}): {error}")
+            if status == 429 or status >= 500:
+                return sent
+    return len(messages)
+
+
+class PriceAlertListener:
+    """Слушатель канала уведомлений: пакетирует уведомления и отправляет оповещения о снижениях."""
+
+    def __init__(self, dry_run=False, batch_seconds=None, batch_size=None):
+        self.dry_run = dry_run
+        self.batch_seconds = PRICE_ALERT_BATCH_SECONDS if batch_seconds is None else batch_seconds
+        self.batch_size = batch_size or PRICE_ALERT_BATCH_SIZE
+        self.last_prices = {}
+        self.queue = asyncio.Queue()
+        self.sent_alerts = []
+        # Недоставленные оповещения: id объявления -> оповещение
+        self.pending = {}
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            self.queue.put_nowait(json.loads(payload))
+        except ValueError:
+            logger.warning(f"Некорректное уведомление: {payload[:200]}")
+
+    async def collect_batch(self, first):
+        """Собирает пакет уведомлений в течение batch_seconds после первого уведомления."""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def process_batch(self, batch, session=None):
+        """
+        Находит снижения цен в пакете и отправляет (или выводит) оповещения.
+        Цены доставленных оповещений записываются в last_prices, недоставленные
+        оповещения остаются в pending и проверяются заново со следующим пакетом.
+        """
+        # Недоставленные оповещения идут первыми, чтобы более новые уведомления их заменили
+        batch = list(self.pending.values()) + list(batch)
+        self.pending = {}
+        alerts = find_price_drops(batch, self.last_prices)
+        logger.info(f"Пакет из {len(batch)} уведомлений: снижений цены {len(alerts)}")
+        if not alerts:
+            return alerts
+        messages = build_alert_messages(alerts)
+        if self.dry_run or session is None:
+            for text, _ in messages:
+                print(text, end="\n\n")
+            sent = len(messages)
+        else:
+            sent = await send_alert_messages(session, [text for text, _ in messages])
+
+        delivered = [alert for _, message_alerts in messages[:sent] for alert in message_alerts]
+        for alert in delivered:
+            self.last_prices[alert['id']] = alert['price']
+        for _, message_alerts in messages[sent:]:
+            for alert in message_alerts:
+                self.pending[alert['id']] = alert
+        if self.pending:
+            logger.warning(f"Не доставлено оповещений: {len(self.pending)}, повторная отправка со следующим пакетом")
+        self.sent_alerts.extend(delivered)
+        return delivered
+
+    async def run(self):
+        """
+        Подписывается на канал и обрабатывает пакеты до отмены задачи.
+        При обрыве соединения переподключается; словарь цен сохраняется.
+        """
+        import aiohttp
+        import asyncpg
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            while True:
+                conn = None
+                try:
+                    conn = await connect()
+                    if not self.last_prices:
+                        self.last_prices = await load_last_prices(conn)
+                        logger.info(f"Загружены последние цены {len(self.last_prices)} объявлений")
+                    await conn.add_listener(PRICE_ALERT_CHANNEL, self._on_notification)
+                    logger.info(f"Ожидание уведомлений в канале {PRICE_ALERT_CHANNEL}")
+                    while not conn.is_closed():
+                        try:
+                            # Периодически просыпаемся, чтобы заметить закрытое соединение
+                            # и повторить отправку недоставленных оповещений
+                            first = await asyncio.wait_for(self.queue.get(), timeout=30)
+                        except asyncio.TimeoutError:
+                            batch = []
+                        else:
+                            batch = await self.collect_batch(first)
+                        if batch or self.pending:
+                            await self.process_batch(batch, session)
+                except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    logger.error(f"Соединение слушателя потеряно: {e}; переподключение через 5 с")
+                    await asyncio.sleep(5)
+                finally:
+                    if conn is not None and not conn.is_closed():
+                        await conn.close()
+
+
+async def install_trigger(uninstall=False):
+    """Создает (или удаляет) триггер уведомлений на bayut_properties."""
+    conn = await connect()
+    try:
+        await conn.execute(DROP_TRIGGER_SQL if uninstall else CREATE_TRIGGER_SQL)
+    finally:
+        await conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оповещения о снижении цен через LISTEN/NOTIFY")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('install', help=f"Создать триггер уведомлений на {TABLE_NAME}")
+    subparsers.add_parser('uninstall', help="Удалить триггер уведомлений")
+    listen_parser = subparsers.add_parser('listen', help="Запустить слушатель оповещений")
+    listen_parser.add_argument('--dry-run', action='store_true', help="Выводить оповещения вместо отправки")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if args.command in ('install', 'uninstall'):
+        asyncio.run(install_trigger(uninstall=args.command == 'uninstall'))
+        print(f"Триггер уведомлений {'удален' if args.command == 'uninstall' else 'создан'}")
+        return
+
+    if not args.dry_run and not (TELEGRAM_BOT_TOKEN and TELEGRAM_CHANNEL_ID):
+        print("ВНИМАНИЕ: Не указаны TELEGRAM_BOT_TOKEN или TELEGRAM_CHANNEL_ID, оповещения выводятся в консоль")
+        args.dry_run = True
+    try:
+        asyncio.run(PriceAlertListener(dry_run=args.dry_run).run())
+    except KeyboardInterrupt:
+        print("Слушатель остановлен")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Робастный поиск выбросов среди изменений цен.
+
+Фиксированный порог (изменения больше 25% отбрасываются) скрывает реальные
+резкие снижения цен и при этом пропускает ошибки ввода в пределах порога.
+Вместо него для каждого региона (и полосы площади, если в данных есть колонка
+band) считаются медиана и медианное абсолютное отклонение (MAD) логарифма
+отношения новой цены к предыдущей, а по ним — робастный z-score
+(Iglewicz, Hoaglin: 0.6745 * (x - медиана) / MAD).
+
+Каждое изменение получает отметку в колонке outlier:
+    ''        — обычное изменение;
+    'anomaly' — нетипичное для региона изменение (|z| > OUTLIER_Z_THRESHOLD),
+                остается в отчете и помечается;
+    'typo'    — цена изменилась почти ровно в 10, 100, ... раз (лишний или
+                пропущенный ноль), такие изменения в отчет не попадают.
+
+Все шаги — векторные операции NumPy и groupby-transform по всему набору сразу.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Порог робастного z-score для нетипичных изменений
+OUTLIER_Z_THRESHOLD = float(os.getenv('OUTLIER_Z_THRESHOLD', '3.5'))
+
+# Регионы с меньшим количеством изменений сравниваются со статистикой всего набора
+OUTLIER_MIN_GROUP = int(os.getenv('OUTLIER_MIN_GROUP', '8'))
+
+# Допуск отклонения log10(новая цена / предыдущая) от целого числа для ошибок ввода
+TYPO_LOG10_TOLERANCE = 0.02
+
+# Множитель, приводящий MAD нормального распределения к стандартному отклонению
+MAD_SCALE = 0.6745
+
+
+def outlier_groups(df):
+    """Колонки группировки: регион и, если есть, полоса площади."""
+    return ['band', 'location'] if 'band' in df.columns else ['location']
+
+
+def price_typo_mask(log_ratio):
+    """Ошибка ввода: цена изменилась в 10**n раз (n != 0) с точностью до допуска."""
+    log_ratio = np.asarray(log_ratio, dtype=np.float64)
+    orders = np.rint(log_ratio)
+    return np.isfinite(log_ratio) & (orders != 0) & (np.abs(log_ratio - orders) <= TYPO_LOG10_TOLERANCE)
+
+
+def robust_z_scores(values, groups, min_group=None):
+    """
+    Робастные z-scores values внутри групп groups (список Series или массивов).
+    Для групп меньше min_group и групп с нулевым MAD используются медиана и MAD всего набора.
+    """
+    min_group = OUTLIER_MIN_GROUP if min_group is None else min_group
+    values = pd.Series(np.asarray(values, dtype=np.float64))
+    keys = [pd.Series(np.asarray(group)) for group in groups]
+
+    grouped = values.groupby(keys, sort=False, dropna=False)
+    median = grouped.transform('median')
+    deviation = (values - median).abs()
+    mad = deviation.groupby(keys, sort=False, dropna=False).transform('median')
+    size = grouped.transform('size')
+
+    global_median = values.median()
+    global_mad = (values - global_median).abs().median()
+    small = (size < min_group) | (mad <= 0)
+    median = median.where(~small, global_median)
+    mad = mad.where(~small, global_mad)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = MAD_SCALE * (values - median) / mad
+    # Если и по всему набору MAD равен нулю, отклонение не с чем сравнивать
+    return np.where(np.isfinite(z), z, 0.0)
+
+
+def flag_price_outliers(df, z_threshold=None):
+    """
+    Добавляет колонки log_ratio, robust_z и outlier (см. описание модуля).
+    Ожидает колонки price и prev_price (или pct_change) и location.
+    """
+    z_threshold = OUTLIER_Z_THRESHOLD if z_threshold is None else z_threshold
+    df = df.copy()
+    if 'prev_price' in df.columns:
+        price = df['price'].to_numpy(dtype=np.float64)
+        prev_price = df['prev_price'].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = price / prev_price
+    else:
+        ratio = 1 + df['pct_change'].to_numpy(dtype=np.float64) / 100
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratio = np.log10(ratio)
+    valid = np.isfinite(log_ratio)
+    log_ratio = np.where(valid, log_ratio, 0.0)
+
+    typo = valid & price_typo_mask(log_ratio)
+
+    groups = [df[column] for column in outlier_groups(df)]
+    # Ошибки ввода не должны смещать статистику региона, поэтому считаем ее без них
+    clean = ~typo
+    z = np.zeros(len(df))
+    z[clean] = robust_z_scores(log_ratio[clean], [group.to_numpy()[clean] for group in groups])
+
+    df['log_ratio'] = log_ratio
+    df['robust_z'] = z
+    df['outlier'] = np.select([typo, ~valid, np.abs(z) > z_threshold], ['typo', 'typo', 'anomaly'], default='')
+    return df
@@ -0,0 +1,74 @@
+"""
+Режим профилирования запусков публикаторов.
+
+С флагом --profile запуск оборачивается в cProfile и tracemalloc; рядом с отчетами
+в каталоге reports/ сохраняются файл .prof (для snakeviz, pstats и т.п.) и текстовая
+сводка с топ-N функций и пиковым потреблением памяти.
+"""
+
+import os
+from datetime import datetime
+
+# Каталог, в который сохраняются результаты профилирования
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'reports')
+
+
+def add_profile_arguments(parser):
+    """Добавляет в argparse-парсер опции --profile и --profile-top."""
+    parser.add_argument('--profile', action='store_true',
+                        help="Профилировать запуск (cProfile + tracemalloc), результаты сохраняются в reports/")
+    parser.add_argument('--profile-top', type=int, default=30,
+                        help="Количество функций в текстовой сводке профиля")
+    return parser
+
+
+def profile_call(func, name, top_n=30):
+    """
+    Выполняет func() под cProfile и tracemalloc, сохраняет <name>_<дата>.prof
+    и текстовую сводку <name>_<дата>_profile.txt. Возвращает результат func().
+    """
+    import io
+    import pstats
+    import cProfile
+    import tracemalloc
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    current_datetime = datetime.now().strftime('%Y%m%d_%H%M%S')
+    prof_path = os.path.join(PROFILE_DIR, f"{name}_{current_datetime}.prof")
+    summary_path = os.path.join(PROFILE_DIR, f"{name}_{current_datetime}_profile.txt")
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.enable()
+        try:
+            result = func()
+        finally:
+            profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    profiler.dump_stats(prof_path)
+
+    # Формируем текстовую сводку: топ по суммарному и собственному времени, память
+    stream = io.StringIO()
+    stream.write(f"Профиль запуска {name} от {current_datetime}\n")
+    stream.write(f"Пиковое потребление памяти (tracemalloc): {peak / 1024 / 1024:.1f} МБ\n\n")
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs()
+    stream.write(f"=== Топ-{top_n} по суммарному времени (cumulative) ===\n")
+    stats.sort_stats('cumulative').print_stats(top_n)
+    stream.write(f"=== Топ-{top_n} по собственному времени (tottime) ===\n")
+    stats.sort_stats('tottime').print_stats(top_n)
+    stream.write(f"=== Топ-{top_n} мест выделения памяти на момент завершения ===\n")
+    for statistic in snapshot.statistics('lineno')[:top_n]:
+        stream.write(f"{statistic}\n")
+
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        f.write(stream.getvalue())
+
+    print(f"Профиль сохранен в файл: {prof_path}")
+    print(f"Сводка профиля сохранена в файл: {summary_path}")
+    return result
@@ -0,0 +1,111 @@
+"""
+Состояние последней публикации для отправки только изменений.
+
+Публикаторы изменений цен каждый раз отправляют полный отчет (топ-3 по каждой
+локации), хотя большая часть совпадает с прошлым запуском. Здесь для каждого
+публикатора хранится компактный отпечаток опубликованного отчета
+(id объявления -> [цена, место в топе локации]), и в режиме 'delta' в Telegram
+уходят только новые и изменившиеся объявления. Раз в PUBLISH_FULL_DIGEST_DAYS
+дней отправляется полный отчет. По умолчанию (PUBLISH_MODE=full) публикуется
+полный отчет, как и раньше; режим 'delta' включается явно.
+
+Отпечаток обновляется только после успешной отправки (stage() + save()),
+поэтому неудачная отправка будет повторена при следующем запуске.
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+
+# Режим публикации: 'delta' — только изменения и периодический полный отчет, 'full' — всегда полный отчет
+PUBLISH_MODE = os.getenv('PUBLISH_MODE', 'full')
+
+# Как часто отправлять полный отчет, дней
+PUBLISH_FULL_DIGEST_DAYS = float(os.getenv('PUBLISH_FULL_DIGEST_DAYS', '7'))
+
+# Каталог отпечатков опубликованных отчетов
+PUBLISH_STATE_DIR = os.getenv('PUBLISH_STATE_DIR', os.path.join('cache', 'published'))
+
+
+def top_per_location(sorted_df, per_location=3):
+    """
+    Топ-N объявлений каждой локации из отсортированного по важности DataFrame
+    с колонкой rank (место в локации, начиная с 1) — то, что попадает в отчет.
+    """
+    top = sorted_df[sorted_df['location'].notna() & (sorted_df['location'] != '')]
+    top = top.groupby('location', sort=False).head(per_location).copy()
+    top['rank'] = top.groupby('location', sort=False).cumcount() + 1
+    return top
+
+
+class PublishState:
+    """Отпечаток последнего опубликованного отчета одного публикатора."""
+
+    def __init__(self, name, entries=None, last_full_digest=None, state_dir=None):
+        self.name = name
+        self.state_dir = state_dir or PUBLISH_STATE_DIR
+        # id (строкой) -> [цена, место в топе локации]
+        self.entries = entries or {}
+        self.last_full_digest = last_full_digest
+        self._pending = None
+
+    @property
+    def path(self):
+        return os.path.join(self.state_dir, f"{self.name}.json")
+
+    @classmethod
+    def load(cls, name, state_dir=None):
+        """Загружает отпечаток публикатора (пустой, если публикаций еще не было)."""
+        state = cls(name, state_dir=state_dir)
+        if os.path.exists(state.path):
+            with open(state.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            state.entries = data.get('entries', {})
+            state.last_full_digest = data.get('last_full_digest')
+        return state
+
+    def full_digest_due(self, now=None):
+        """Нужен ли полный отчет: публикаций не было или с полного отчета прошло больше PUBLISH_FULL_DIGEST_DAYS."""
+        if not self.entries or not self.last_full_digest:
+            return True
+        now = now or datetime.now()
+        return now - datetime.fromisoformat(self.last_full_digest) >= timedelta(days=PUBLISH_FULL_DIGEST_DAYS)
+
+    def changed_mask(self, top_df):
+        """Маска новых объявлений и объявлений с другой ценой или местом, чем при прошлой публикации."""
+        import numpy as np
+
+        ids = top_df['id'].astype(str).to_numpy()
+        previous = [self.entries.get(listing_id) for listing_id in ids]
+        known = np.array([entry is not None for entry in previous], dtype=bool)
+        prev_price = np.array([entry[0] if entry else np.nan for entry in previous], dtype=np.float64)
+        prev_rank = np.array([entry[1] if entry else -1 for entry in previous], dtype=np.int64)
+        price = top_df['price'].to_numpy(dtype=np.float64).round(2)
+        rank = top_df['rank'].to_numpy(dtype=np.int64)
+        return ~known | (price != prev_price) | (rank != prev_rank)
+
+    def stage(self, top_df, full):
+        """Запоминает отпечаток текущего отчета; он будет сохранен в save() после успешной отправки."""
+        import numpy as np
+
+        prices = top_df['price'].to_numpy(dtype=np.float64).round(2)
+        self._pending = (
+            {str(listing_id): [float(price), int(rank)]
+             for listing_id, price, rank in zip(top_df['id'], prices, top_df['rank'])},
+            full
+        )
+
+    def save(self, now=None):
+        """Сохраняет отпечаток, подготовленный stage() (атомарно, через временный файл)."""
+        if self._pending is None:
+            return
+        self.entries, full = self._pending
+        self._pending = None
+        if full:
+            self.last_full_digest = (now or datetime.now()).isoformat(timespec='seconds')
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'last_full_digest': self.last_full_digest, 'entries': self.entries}, f,
+                      separators=(',', ':'))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,161 @@
+"""
+Параметризованный запрос самых дешевых квартир и серверные подготовленные операторы.
+
+build_cheapest_apartments_query() собирает запрос топ-N квартир по регионам
+из фильтров (диапазон площади, N на регион, количество спален, границы цены,
+список регионов). Значения фильтров передаются только связанными параметрами,
+в текст запроса попадают лишь условия для заданных фильтров, поэтому одинаковые
+наборы фильтров дают один и тот же текст и один подготовленный оператор.
+
+execute_prepared() выполняет запрос через PREPARE/EXECUTE: план строится
+один раз на соединение, а все варианты отчетов с тем же набором фильтров
+выполняются по сохраненному оператору.
+
+Условие price > 0 присутствует всегда, поэтому фильтры площади обслуживает
+частичный индекс (area) WHERE price > 0, а фильтры регионов и цены — индекс
+(location, price). Планы для разных фильтров показывает
+benchmark_publishers.py --query-plans.
+"""
+
+import re
+import hashlib
+import weakref
+
+# Фильтры по умолчанию повторяют исходный отчет: площадь до 40 кв.м., топ-3 на регион
+DEFAULT_CHEAPEST_FILTERS = {
+    'area_min': None,
+    'area_max': 40,
+    'top_n': 3,
+    'rooms': None,
+    'price_min': None,
+    'price_max': None,
+    'locations': None
+}
+
+# Условия WHERE для каждого фильтра (добавляются, только если фильтр задан)
+FILTER_CONDITIONS = {
+    'area_min': "area > %(area_min)s",
+    'area_max': "area <= %(area_max)s",
+    'rooms': "rooms = ANY(%(rooms)s)",
+    'price_min': "price >= %(price_min)s",
+    'price_max': "price <= %(price_max)s",
+    'locations': "location = ANY(%(locations)s)"
+}
+
+CHEAPEST_APARTMENTS_TEMPLATE = """
+WITH ranked_apartments AS (
+    SELECT
+        id,
+        title,
+        rooms,
+        location,
+        area,
+        price,
+        geography,
+        ROW_NUMBER() OVER (PARTITION BY location ORDER BY price ASC) as rank
+    FROM {table}
+    WHERE {conditions}
+)
+SELECT id, title, rooms, location, area, price, geography, rank
+FROM ranked_apartments
+WHERE rank <= %(top_n)s
+ORDER BY location, rank
+"""
+
+PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+# Подготовленные операторы каждого соединения: соединение -> множество имен
+_prepared = weakref.WeakKeyDictionary()
+
+
+def normalize_filters(filters=None):
+    """
+    Дополняет фильтры значениями по умолчанию и отбрасывает посторонние ключи
+    (например, имя и заголовок варианта отчета). Списки сортируются, чтобы
+    одинаковые фильтры давали одинаковые параметры и ключи кэша.
+    """
+    normalized = dict(DEFAULT_CHEAPEST_FILTERS)
+    for key in DEFAULT_CHEAPEST_FILTERS:
+        if filters and key in filters:
+            normalized[key] = filters[key]
+    for key in ('rooms', 'locations'):
+        if normalized[key] is not None:
+            normalized[key] = sorted(normalized[key])
+    if not normalized['top_n'] or int(normalized['top_n']) < 1:
+        raise ValueError("top_n должен быть положительным числом")
+    normalized['top_n'] = int(normalized['top_n'])
+    return normalized
+
+
+def build_cheapest_apartments_query(filters=None, table='bayut_properties'):
+    """
+    Собирает запрос топ-N самых дешевых квартир по регионам.
+    table — bayut_properties или представление последних снимков bayut_latest_listings.
+    Возвращает (текст запроса с плейсхолдерами %(name)s, словарь параметров).
+    """
+    filters = normalize_filters(filters)
+    conditions = ["price > 0"]
+    params = {'top_n': filters['top_n']}
+    for key, condition in FILTER_CONDITIONS.items():
+        if filters[key] is not None:
+            conditions.append(condition)
+            params[key] = filters[key]
+    query = CHEAPEST_APARTMENTS_TEMPLATE.format(table=table, conditions=" AND ".join(conditions))
+    return query, params
+
+
+def to_positional(query, params):
+    """
+    Переводит плейсхолдеры %(name)s в позиционные $1, $2, ... (для PREPARE и asyncpg).
+    Возвращает (текст запроса, список значений в порядке номеров).
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    positional_query = PLACEHOLDER.sub(replace, query).replace('%%', '%')
+    return positional_query, [params[name] for name in names]
+
+
+def statement_name(query):
+    """Имя подготовленного оператора, однозначно определяемое текстом запроса."""
+    return 'stmt_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+
+
+def execute_prepared(conn, query, params=None):
+    """
+    Выполняет запрос psycopg2 через серверный подготовленный оператор и возвращает DataFrame.
+    Оператор готовится один раз на соединение и затем переиспользуется.
+    """
+    import psycopg2
+    import pandas as pd
+
+    positional_query, values = to_positional(query, params or {})
+    name = statement_name(positional_query)
+    prepared = _prepared.setdefault(conn, set())
+    execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * len(values))})" if values else "")
+
+    cursor = conn.cursor()
+    try:
+        for attempt in range(2):
+            if name not in prepared:
+                cursor.execute(f"PREPARE {name} AS {positional_query}")
+                prepared.add(name)
+            try:
+                cursor.execute(execute_sql, values)
+                break
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Оператор потерян (например, после переподключения пула) — готовим заново
+                conn.rollback()
+                prepared.discard(name)
+                if attempt:
+                    raise
+        columns = [desc[0] for desc in cursor.description]
+        # Как и pd.read_sql_query, приводим Decimal (NUMERIC) к float
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+    finally:
+        cursor.close()
@@ -0,0 +1,193 @@
+"""
+Временной ряд агрегатов цен по регионам.
+
+При каждом запуске для диапазона площади (полосы) считаются агрегаты по всем
+актуальным объявлениям региона, а не только по топ-3: количество, минимум,
+максимум, среднее, медиана цены и цена за квадратный метр. Агрегаты дописываются
+в компактный Parquet-набор, партиционированный по дате, поэтому графики трендов
+и изменения неделя к неделе строятся по небольшим данным без повторного
+сканирования истории bayut_properties.
+
+Использование:
+    python region_history.py record [--area-min 0] [--area-max 40]
+    python region_history.py wow [--band area_0_40]
+"""
+
+import os
+import argparse
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from local_snapshot import read_analysis_query
+from schema_capabilities import get_schema_capabilities, LATEST_VIEW_NAME
+from latest_listings import use_latest_view
+
+# Каталог набора агрегатов по регионам
+REGION_HISTORY_DIR = os.getenv('REGION_HISTORY_DIR', os.path.join('history', 'region_stats'))
+
+# Актуальная версия каждого объявления (если в таблице есть updated_at)
+LATEST_LISTINGS_CTE = """
+WITH latest AS (
+    SELECT id, location, area, price
+    FROM (
+        SELECT
+            id, location, area, price,
+            ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) as rn
+        FROM bayut_properties
+    ) ranked
+    WHERE rn = 1
+)
+"""
+
+# Актуальные версии из материализованного представления (см. latest_listings.py)
+LATEST_VIEW_CTE = f"""
+WITH latest AS (
+    SELECT id, location, area, price
+    FROM {LATEST_VIEW_NAME}
+)
+"""
+
+ALL_LISTINGS_CTE = """
+WITH latest AS (
+    SELECT id, location, area, price
+    FROM bayut_properties
+)
+"""
+
+REGION_AGGREGATES_QUERY = """
+SELECT
+    location,
+    COUNT(*) as listings,
+    MIN(price) as min_price,
+    MAX(price) as max_price,
+    AVG(price) as avg_price,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY price) as median_price,
+    SUM(price) / SUM(area) as avg_price_per_sqm,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY price / area) as median_price_per_sqm
+FROM latest
+WHERE area > %(area_min)s AND area <= %(area_max)s AND price > 0 AND location IS NOT NULL
+GROUP BY location
+ORDER BY location
+"""
+
+
+def band_name(area_min, area_max):
+    """Имя полосы площади, под которым агрегаты хранятся в наборе."""
+    return f"area_{area_min:g}_{area_max:g}"
+
+
+def compute_region_aggregates(conn, area_min=0, area_max=40):
+    """Считает агрегаты цен по регионам для полосы площади по всем актуальным объявлениям."""
+    capabilities = get_schema_capabilities(conn)
+    if use_latest_view(capabilities):
+        cte = LATEST_VIEW_CTE
+    elif capabilities.has_updated_at:
+        cte = LATEST_LISTINGS_CTE
+    else:
+        cte = ALL_LISTINGS_CTE
+    df = read_analysis_query(cte + REGION_AGGREGATES_QUERY, conn, {'area_min': area_min, 'area_max': area_max})
+    value_columns = [column for column in df.columns if column not in ('location', 'listings')]
+    df[value_columns] = df[value_columns].astype(float)
+    df['listings'] = df['listings'].astype('int64')
+    return df
+
+
+def record_region_stats(conn, area_min=0, area_max=40, run_at=None, history_dir=REGION_HISTORY_DIR):
+    """
+    Считает агрегаты по регионам и дописывает их в набор как одну точку временного ряда.
+    Возвращает записанный DataFrame.
+    """
+    run_at = run_at or datetime.now()
+    df = compute_region_aggregates(conn, area_min, area_max)
+    if df.empty:
+        return df
+    df['band'] = band_name(area_min, area_max)
+    df['run_at'] = pd.Timestamp(run_at)
+    df['snapshot_date'] = run_at.strftime('%Y-%m-%d')
+    os.makedirs(history_dir, exist_ok=True)
+    df.to_parquet(history_dir, partition_cols=['snapshot_date'], index=False)
+    return df
+
+
+def load_region_history(band=None, since=None, history_dir=REGION_HISTORY_DIR):
+    """
+    Читает накопленные агрегаты (при необходимости только одной полосы и начиная с даты since).
+    Чтение ограничивается нужными партициями по дате.
+    """
+    if not os.path.isdir(history_dir):
+        return pd.DataFrame()
+    filters = []
+    if band:
+        filters.append(('band', '==', band))
+    if since:
+        filters.append(('snapshot_date', '>=', pd.Timestamp(since).strftime('%Y-%m-%d')))
+    df = pd.read_parquet(history_dir, filters=filters or None)
+    df['snapshot_date'] = df['snapshot_date'].astype(str)
+    return df.sort_values(['band', 'location', 'run_at']).reset_index(drop=True)
+
+
+def week_over_week(history, metric='median_price', days=7):
+    """
+    Для каждого региона и полосы сравнивает последнюю точку с последней точкой,
+    записанной не позже чем за days дней до нее. Возвращает DataFrame с изменением в процентах.
+    """
+    if history.empty:
+        return pd.DataFrame(columns=['band', 'location', 'run_at', metric, 'prev_run_at', f'prev_{metric}', 'pct_change'])
+    latest = history.sort_values('run_at').groupby(['band', 'location']).tail(1)
+    latest = latest[['band', 'location', 'run_at', metric]].copy()
+    latest['target_at'] = latest['run_at'] - timedelta(days=days)
+
+    previous = history[['band', 'location', 'run_at', metric]].rename(
+        columns={'run_at': 'prev_run_at', metric: f'prev_{metric}'}
+    )
+    result = pd.merge_asof(
+        latest.sort_values('target_at'),
+        previous.sort_values('prev_run_at'),
+        left_on='target_at',
+        right_on='prev_run_at',
+        by=['band', 'location'],
+        direction='backward'
+    )
+    result['pct_change'] = (result[metric] / result[f'prev_{metric}'] - 1) * 100
+    return result.drop(columns='target_at').sort_values(['band', 'location']).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Временной ряд агрегатов цен по регионам")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help="Посчитать и сохранить агрегаты для полосы площади")
+    record_parser.add_argument('--area-min', type=float, default=0)
+    record_parser.add_argument('--area-max', type=float, default=40)
+    wow_parser = subparsers.add_parser('wow', help="Изменение медианной цены неделя к неделе")
+    wow_parser.add_argument('--band', default=None, help="Полоса площади, например area_0_40")
+    wow_parser.add_argument('--metric', default='median_price')
+    args = parser.parse_args(argv)
+
+    if args.command == 'wow':
+        since = datetime.now() - timedelta(days=30)
+        changes = week_over_week(load_region_history(args.band, since), args.metric)
+        if changes.empty:
+            print("История агрегатов пуста.")
+            return
+        print(changes.to_string(index=False))
+        return
+
+    import psycopg2
+    from local_snapshot import DB_PARAMS
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        df = record_region_stats(conn, args.area_min, args.area_max)
+        print(f"Сохранены агрегаты по {len(df)} регионам ({band_name(args.area_min, args.area_max)})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
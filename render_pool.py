@@ -0,0 +1,78 @@
+"""
+Параллельный рендеринг артефактов отчетов в пуле процессов.
+
+Построение карты folium и HTML-страницы Jinja — чистый Python, загружающий
+одно ядро. Этот модуль распределяет рендеринг вариантов HTML-отчета
+(async_html_publisher) по пулу процессов ProcessPoolExecutor. DataFrame передаются воркерам не через pickle,
+а в формате Arrow IPC в разделяемой памяти: воркер получает только имя блока
+и его размер и читает таблицу из общего блока, минуя pickle и канал процесса.
+"""
+
+import os
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# Количество процессов рендеринга (по умолчанию — по числу ядер)
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0')) or None
+
+
+class SharedFrame:
+    """DataFrame, сериализованный в Arrow IPC и размещенный в разделяемой памяти."""
+
+    def __init__(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        buffer = sink.getvalue()
+
+        self.size = buffer.size
+        self._shm = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        self._shm.buf[:self.size] = memoryview(buffer).cast('B')
+        self.name = self._shm.name
+
+    @property
+    def ref(self):
+        """Легковесная ссылка (имя блока, размер), которая передается в воркер."""
+        return self.name, self.size
+
+    def release(self):
+        """Освобождает блок разделяемой памяти."""
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def read_shared_frame(ref):
+    """Читает DataFrame из блока разделяемой памяти по ссылке SharedFrame.ref."""
+    import pyarrow as pa
+
+    name, size = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Одно копирование блока в память воркера: строковые колонки pandas на Arrow
+        # иначе ссылались бы на разделяемую память, и ее нельзя было бы закрыть
+        buffer = pa.py_buffer(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+
+def render_html_report_task(ref, report_name, title):
+    """Воркер: строит карту и HTML-страницу отчета, возвращает (путь, имя файла)."""
+    import telegram_html_publisher
+
+    df = read_shared_frame(ref)
+    return telegram_html_publisher.generate_html_report(df, report_name, title)
+
+
+def create_render_pool(max_workers=None):
+    """Создает пул процессов рендеринга."""
+    return ProcessPoolExecutor(max_workers=max_workers or RENDER_WORKERS)
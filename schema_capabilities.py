@@ -0,0 +1,162 @@
+"""
+Кэшируемая проверка возможностей схемы таблицы bayut_properties.
+
+Вместо запроса к information_schema при каждом запуске схема проверяется
+один раз, а результат хранится в памяти процесса и на диске с ограниченным
+сроком жизни. Публикаторы получают типизированные флаги и заранее выбирают
+вариант запроса.
+"""
+
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass, asdict, field
+
+logger = logging.getLogger(__name__)
+
+# Параметры кэша схемы из .env
+SCHEMA_CACHE_FILE = os.getenv('SCHEMA_CACHE_FILE', os.path.join('cache', 'schema_capabilities.json'))
+SCHEMA_CACHE_TTL_SECONDS = int(os.getenv('SCHEMA_CACHE_TTL_SECONDS', str(6 * 3600)))
+
+TABLE_NAME = 'bayut_properties'
+
+# Материализованное представление актуальных объявлений (см. latest_listings.py)
+LATEST_VIEW_NAME = 'bayut_latest_listings'
+
+# Кэш в памяти процесса: (dsn, таблица) -> SchemaCapabilities
+_capabilities_cache = {}
+
+
+@dataclass(frozen=True)
+class SchemaCapabilities:
+    """Флаги наличия колонок и объектов, от которых зависят запросы публикаторов."""
+    columns: tuple = field(default_factory=tuple)
+    probed_at: float = 0.0
+    # Заполненные материализованные представления, созданные для публикаторов
+    views: tuple = field(default_factory=tuple)
+
+    def has_column(self, name):
+        return name in self.columns
+
+    @property
+    def has_id(self):
+        return self.has_column('id')
+
+    @property
+    def has_price(self):
+        return self.has_column('price')
+
+    @property
+    def has_updated_at(self):
+        return self.has_column('updated_at')
+
+    @property
+    def has_geography(self):
+        return self.has_column('geography')
+
+    @property
+    def supports_price_history(self):
+        """Можно ли вычислять изменения цен по истории записей (id, price, updated_at)."""
+        return self.has_id and self.has_price and self.has_updated_at
+
+    @property
+    def has_latest_view(self):
+        """Есть ли заполненное представление последних снимков объявлений с предыдущей ценой."""
+        return LATEST_VIEW_NAME in self.views
+
+    def is_fresh(self, ttl=SCHEMA_CACHE_TTL_SECONDS):
+        return time.time() - self.probed_at <= ttl
+
+
+def _connection_key(conn):
+    """Ключ кэша: параметры подключения без пароля."""
+    try:
+        params = conn.get_dsn_parameters()
+        return f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}"
+    except Exception:
+        return 'default'
+
+
+def probe_schema(conn):
+    """Получает список колонок таблицы и заполненных материализованных представлений."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = %s
+    """, (TABLE_NAME,))
+    columns = tuple(sorted(row[0] for row in cursor.fetchall()))
+    cursor.execute("""
+        SELECT matviewname
+        FROM pg_matviews
+        WHERE matviewname = %s AND ispopulated
+    """, (LATEST_VIEW_NAME,))
+    views = tuple(sorted(row[0] for row in cursor.fetchall()))
+    cursor.close()
+    return SchemaCapabilities(columns=columns, probed_at=time.time(), views=views)
+
+
+def _load_from_disk(key):
+    if not os.path.exists(SCHEMA_CACHE_FILE):
+        return None
+    try:
+        with open(SCHEMA_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f).get(key)
+        if not data:
+            return None
+        return SchemaCapabilities(
+            columns=tuple(data['columns']),
+            probed_at=data['probed_at'],
+            views=tuple(data.get('views', ()))
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Не удалось прочитать кэш схемы {SCHEMA_CACHE_FILE}: {e}")
+        return None
+
+
+def _save_to_disk(key, capabilities):
+    try:
+        data = {}
+        if os.path.exists(SCHEMA_CACHE_FILE):
+            with open(SCHEMA_CACHE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        data[key] = asdict(capabilities)
+        os.makedirs(os.path.dirname(SCHEMA_CACHE_FILE) or '.', exist_ok=True)
+        tmp_path = SCHEMA_CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, SCHEMA_CACHE_FILE)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось сохранить кэш схемы {SCHEMA_CACHE_FILE}: {e}")
+
+
+def get_schema_capabilities(conn, refresh=False):
+    """
+    Возвращает SchemaCapabilities для таблицы bayut_properties.
+    Сначала проверяется кэш в памяти, затем на диске, и только при отсутствии
+    свежей записи выполняется запрос к information_schema.
+    """
+    key = _connection_key(conn)
+
+    if not refresh:
+        capabilities = _capabilities_cache.get(key)
+        if capabilities is not None and capabilities.is_fresh():
+            return capabilities
+        capabilities = _load_from_disk(key)
+        if capabilities is not None and capabilities.is_fresh():
+            _capabilities_cache[key] = capabilities
+            return capabilities
+
+    capabilities = probe_schema(conn)
+    logger.info(f"Схема {TABLE_NAME} проверена, колонок: {len(capabilities.columns)}")
+    _capabilities_cache[key] = capabilities
+    _save_to_disk(key, capabilities)
+    return capabilities
+
+
+def invalidate_schema_cache():
+    """Сбрасывает кэш схемы в памяти и на диске (например, после миграции)."""
+    _capabilities_cache.clear()
+    if os.path.exists(SCHEMA_CACHE_FILE):
+        os.remove(SCHEMA_CACHE_FILE)
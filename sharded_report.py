@@ -0,0 +1,323 @@
+"""
+Отчет о самых дешевых квартирах, разбитый на страницы по регионам.
+
+Вместо одной большой страницы формируется индексная страница со сводкой
+и ссылками плюс легкая страница на каждый регион (location) со своей картой
+и таблицей. Все страницы строятся за один проход по сгруппированному DataFrame.
+Для каждой страницы в манифесте хранится отпечаток ее данных: неизменившиеся
+страницы не перезаписываются и повторно не загружаются на FTP.
+
+Использование (из telegram_html_publisher при REPORT_MODE=sharded):
+    index_path, changed = generate_sharded_report(df)
+    report_url = upload_sharded_report()
+"""
+
+import os
+import re
+import json
+import ftplib
+import hashlib
+from datetime import datetime
+
+import pandas as pd
+
+import telegram_html_publisher as html_publisher
+from metrics import stage
+
+# Каталог, в котором хранятся страницы отчетов по регионам
+SHARDED_REPORTS_DIR = os.getenv('SHARDED_REPORTS_DIR', os.path.join('reports', 'sharded'))
+
+# Версия шаблонов входит в отпечаток: при ее изменении все страницы перестраиваются
+SHARD_TEMPLATE_VERSION = 1
+
+MANIFEST_FILE = '_manifest.json'
+INDEX_FILE = 'index.html'
+
+# Колонки, от которых зависит содержимое страницы региона
+SHARD_COLUMNS = ['id', 'location', 'area', 'price', 'rank', 'latitude', 'longitude']
+
+PAGE_HEAD = """
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 0; padding: 0; }
+        .header { background-color: #003366; color: white; padding: 20px; }
+        .header a { color: #cfe2ff; }
+        .container { max-width: 1200px; margin: 0 auto; padding: 20px; }
+        .map-container { height: 400px; margin-bottom: 30px; }
+        table { width: 100%; border-collapse: collapse; }
+        th, td { padding: 10px; text-align: left; border: 1px solid #ddd; }
+        th { background-color: #f2f2f2; }
+        .footer { background-color: #f2f2f2; padding: 20px; text-align: center; }
+    </style>
+"""
+
+SHARD_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="ru">
+<head>
+    {{ head|safe }}
+    <title>{{ location }} — {{ title }}</title>
+</head>
+<body>
+    <div class="header">
+        <div class="container">
+            <p><a href="index.html">← Все регионы</a></p>
+            <h1>{{ location }}</h1>
+            <p>{{ title }}. Данные изменились: {{ current_date }}</p>
+        </div>
+    </div>
+    <div class="container">
+        <div class="map-container">
+            {{ map_html|safe }}
+        </div>
+        <table class="table table-striped">
+            <thead>
+                <tr><th>Ранг в регионе</th><th>Цена</th><th>Площадь</th><th>Ссылка</th></tr>
+            </thead>
+            <tbody>
+                {% for row in rows %}
+                <tr>
+                    <td>{{ row.rank }}</td>
+                    <td>{{ "{:,}".format(row.price|int) }} AED</td>
+                    <td>{{ "%.1f"|format(row.area) }} кв.м</td>
+                    <td><a href="{{ row.url }}" target="_blank">Открыть</a></td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    <div class="footer">
+        <p>© {{ current_year }} Wealth Compass. Все права защищены.</p>
+    </div>
+</body>
+</html>
+"""
+
+INDEX_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="ru">
+<head>
+    {{ head|safe }}
+    <title>{{ title }}</title>
+</head>
+<body>
+    <div class="header">
+        <div class="container">
+            <h1>{{ title }}</h1>
+            <p>Дата обновления: {{ current_date }}. Регионов: {{ regions|length }}</p>
+        </div>
+    </div>
+    <div class="container">
+        <table class="table table-striped">
+            <thead>
+                <tr><th>Регион</th><th>Квартир</th><th>Минимальная цена</th><th>Средняя цена</th></tr>
+            </thead>
+            <tbody>
+                {% for region in regions %}
+                <tr>
+                    <td><a href="{{ region.file }}">{{ region.location }}</a></td>
+                    <td>{{ region.count }}</td>
+                    <td>{{ "{:,}".format(region.min_price|int) }} AED</td>
+                    <td>{{ "{:,}".format(region.avg_price|int) }} AED</td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    <div class="footer">
+        <p>© {{ current_year }} Wealth Compass. Все права защищены.</p>
+    </div>
+</body>
+</html>
+"""
+
+
+def _location_hash(location):
+    return hashlib.sha1(str(location).encode('utf-8')).hexdigest()[:8]
+
+
+def location_slug(location):
+    """
+    Преобразует название региона в имя файла страницы. Названия не только из ASCII
+    получают суффикс с хешем названия, поэтому адрес страницы не зависит от других регионов.
+    """
+    text = str(location)
+    slug = re.sub(r'[^0-9A-Za-z]+', '_', text).strip('_').lower()
+    if slug and text.isascii():
+        return slug
+    return f"{slug or 'region'}_{_location_hash(text)}"
+
+
+def shard_fingerprint(group):
+    """Вычисляет отпечаток данных страницы региона."""
+    columns = [column for column in SHARD_COLUMNS if column in group.columns]
+    hashes = pd.util.hash_pandas_object(group[columns], index=False)
+    digest = hashlib.sha256(f"v{SHARD_TEMPLATE_VERSION}".encode('utf-8'))
+    digest.update(hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest(report_dir):
+    """Возвращает манифест страниц отчета или пустой манифест."""
+    path = os.path.join(report_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'shards': {}, 'pending_upload': [], 'pending_delete': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(report_dir, manifest):
+    path = os.path.join(report_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _render(template_source, **template_data):
+    import jinja2
+    env = jinja2.Environment()
+    template_data.update(
+        head=PAGE_HEAD,
+        current_date=datetime.now().strftime('%d.%m.%Y'),
+        current_year=datetime.now().year
+    )
+    return env.from_string(template_source).render(**template_data)
+
+
+def _write_page(path, html_content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+    os.replace(tmp_path, path)
+
+
+def generate_sharded_report(df, report_name='cheapest_apartments', title='Самые дешевые квартиры в Дубае',
+                            output_dir=SHARDED_REPORTS_DIR):
+    """
+    Формирует индексную страницу и страницы регионов в каталоге output_dir/report_name.
+    Перезаписываются только страницы регионов, данные которых изменились с прошлого запуска.
+    Возвращает (путь к индексной странице, список имен перезаписанных страниц).
+    """
+    report_dir = os.path.join(output_dir, report_name)
+    os.makedirs(report_dir, exist_ok=True)
+    manifest = load_manifest(report_dir)
+    old_shards = manifest['shards']
+    pending_upload = set(manifest['pending_upload'])
+
+    shards = {}
+    regions = []
+    changed = []
+    used_files = set()
+    with stage('generate_sharded_report') as record:
+        # Один проход по данным, сгруппированным по региону
+        for location, group in df.groupby('location', sort=True):
+            file_name = f"{location_slug(location)}.html"
+            if file_name in used_files:
+                # Разные названия с одинаковой транслитерацией различаются хешем названия
+                file_name = f"{location_slug(location)}_{_location_hash(location)}.html"
+            used_files.add(file_name)
+
+            group = group.sort_values('rank')
+            fingerprint = shard_fingerprint(group)
+            shards[file_name] = {'location': location, 'fingerprint': fingerprint}
+            regions.append({
+                'location': location,
+                'file': file_name,
+                'count': len(group),
+                'min_price': group['price'].min(),
+                'avg_price': group['price'].mean()
+            })
+
+            file_path = os.path.join(report_dir, file_name)
+            previous = old_shards.get(file_name)
+            if previous and previous['fingerprint'] == fingerprint and os.path.exists(file_path):
+                continue
+
+            map_html = html_publisher.create_interactive_map(group, zoom_start=13)._repr_html_()
+            _write_page(file_path, _render(
+                SHARD_TEMPLATE,
+                title=title,
+                location=location,
+                map_html=map_html,
+                rows=group.to_dict('records')
+            ))
+            changed.append(file_name)
+            pending_upload.add(file_name)
+
+        # Страницы регионов, которые пропали из выборки, удаляем локально и на FTP
+        removed = sorted(set(old_shards) - set(shards))
+        for file_name in removed:
+            file_path = os.path.join(report_dir, file_name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            pending_upload.discard(file_name)
+
+        # Индексная страница маленькая и содержит дату обновления, поэтому перестраивается всегда
+        regions.sort(key=lambda region: region['min_price'])
+        index_path = os.path.join(report_dir, INDEX_FILE)
+        _write_page(index_path, _render(INDEX_TEMPLATE, title=title, regions=regions))
+        pending_upload.add(INDEX_FILE)
+
+        record.rows = len(changed)
+
+    manifest = {
+        'shards': shards,
+        'pending_upload': sorted(pending_upload),
+        # Регион, который пропал и снова появился до успешной синхронизации, удалять с FTP нельзя
+        'pending_delete': sorted((set(manifest['pending_delete']) | set(removed)) - set(shards)),
+        'generated_at': datetime.now().isoformat()
+    }
+    _save_manifest(report_dir, manifest)
+    print(f"Страниц регионов: {len(shards)}, перезаписано: {len(changed)}, удалено: {len(removed)}")
+    return index_path, changed
+
+
+def upload_sharded_report(report_name='cheapest_apartments', output_dir=SHARDED_REPORTS_DIR):
+    """
+    Загружает на FTP за одно подключение страницы, ожидающие загрузки, и удаляет
+    страницы пропавших регионов. Возвращает URL индексной страницы или None.
+    """
+    if not all([html_publisher.FTP_HOST, html_publisher.FTP_USER, html_publisher.FTP_PASSWORD]):
+        print("ВНИМАНИЕ: Не указаны параметры FTP в .env файле")
+        return None
+
+    report_dir = os.path.join(output_dir, report_name)
+    manifest = load_manifest(report_dir)
+    # Индексная страница загружается последней, когда все страницы регионов уже на месте
+    pending = sorted(manifest['pending_upload'], key=lambda name: name == INDEX_FILE)
+
+    try:
+        with stage('upload_sharded_report') as record:
+            ftp = ftplib.FTP()
+            ftp.connect(html_publisher.FTP_HOST, html_publisher.FTP_PORT)
+            ftp.login(html_publisher.FTP_USER, html_publisher.FTP_PASSWORD)
+            try:
+                html_publisher.ensure_ftp_directory(ftp, f"{html_publisher.FTP_DIRECTORY.rstrip('/')}/{report_name}")
+                record.rows = len(pending)
+                record.bytes = 0
+                for file_name in pending:
+                    file_path = os.path.join(report_dir, file_name)
+                    with open(file_path, 'rb') as f:
+                        ftp.storbinary(f'STOR {file_name}', f)
+                    record.bytes += os.path.getsize(file_path)
+                    manifest['pending_upload'].remove(file_name)
+
+                for file_name in list(manifest['pending_delete']):
+                    try:
+                        ftp.delete(file_name)
+                    except ftplib.error_perm:
+                        # Файла уже нет на сервере
+                        pass
+                    manifest['pending_delete'].remove(file_name)
+            finally:
+                _save_manifest(report_dir, manifest)
+                ftp.quit()
+    except Exception as e:
+        print(f"Ошибка при загрузке страниц отчета на FTP: {e}")
+        return None
+
+    print(f"Загружено страниц на FTP: {len(pending)}")
+    return f"{html_publisher.BASE_URL}{report_name}/{INDEX_FILE}"
@@ -0,0 +1,348 @@
+"""
+Детерминированный генератор синтетических данных bayut_properties.
+
+Генерирует реалистичную историю цен объявлений заданного масштаба
+(локации, объявления, снимки на объявление) полностью векторизованно
+и с фиксированным seed, загружает ее в локальный PostgreSQL и служит
+источником фикстур для воспроизводимых бенчмарков публикаторов.
+
+Использование:
+    python synthetic_data.py load --scale small --truncate
+    python synthetic_data.py load --locations 200 --listings 100000 --snapshots 5 --seed 7 --truncate
+
+Данные загружаются в отдельную базу из параметров BENCH_DB_* (по умолчанию bayut_bench),
+а не в рабочую базу DB_*.
+    python synthetic_data.py export --scale medium --out synthetic.parquet
+"""
+
+import io
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import psycopg2
+from datetime import datetime
+
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from schema_capabilities import TABLE_NAME
+
+# Отдельная база для синтетических данных и бенчмарков: таблица bayut_properties в ней перезаписывается
+BENCH_DB_PARAMS = {
+    'dbname': os.getenv('BENCH_DB_NAME', 'bayut_bench'),
+    'user': os.getenv('BENCH_DB_USER', os.getenv('DB_USER', 'postgres')),
+    'password': os.getenv('BENCH_DB_PASSWORD', os.getenv('DB_PASSWORD', '')),
+    'host': os.getenv('BENCH_DB_HOST', 'localhost'),
+    'port': os.getenv('BENCH_DB_PORT', '5432')
+}
+
+# Seed по умолчанию для всех синтетических данных
+DEFAULT_SEED = int(os.getenv('SYNTHETIC_SEED', '42'))
+
+# Масштабы наборов данных для бенчмарков: (локации, объявления, снимки на объявление)
+BENCHMARK_SCALES = {
+    'small': (20, 1_000, 3),
+    'medium': (100, 20_000, 5),
+    'large': (300, 200_000, 5),
+    'xlarge': (500, 1_000_000, 4)
+}
+
+# Реальные районы Дубая: название, широта, долгота, базовая цена за кв.м. (AED)
+DUBAI_LOCATIONS = [
+    ('Dubai Marina', 25.0805, 55.1403, 21000),
+    ('Downtown Dubai', 25.1972, 55.2744, 27000),
+    ('Jumeirah Village Circle', 25.0550, 55.2090, 11000),
+    ('Business Bay', 25.1850, 55.2650, 19000),
+    ('Jumeirah Lake Towers', 25.0700, 55.1410, 14000),
+    ('International City', 25.1650, 55.4080, 6500),
+    ('Dubai Silicon Oasis', 25.1210, 55.3790, 9000),
+    ('Al Furjan', 25.0260, 55.1450, 12500),
+    ('Arjan', 25.0580, 55.2400, 10500),
+    ('Dubai Sports City', 25.0380, 55.2230, 9500),
+    ('Palm Jumeirah', 25.1124, 55.1390, 33000),
+    ('Discovery Gardens', 25.0400, 55.1400, 8500),
+    ('Dubai South', 24.8900, 55.1600, 8000),
+    ('Al Barsha', 25.1130, 55.2000, 13000),
+    ('Mirdif', 25.2200, 55.4200, 11500),
+    ('Deira', 25.2700, 55.3100, 10000),
+    ('Bur Dubai', 25.2530, 55.2950, 12000),
+    ('Dubai Hills Estate', 25.1050, 55.2450, 20000),
+    ('Motor City', 25.0480, 55.2360, 11000),
+    ('Town Square', 25.0150, 55.2800, 9500)
+]
+
+
+def get_rng(seed=None):
+    """Возвращает генератор случайных чисел NumPy с заданным (или стандартным) seed."""
+    return np.random.default_rng(DEFAULT_SEED if seed is None else seed)
+
+
+def random_pct_changes(size, rng=None, low=-5.0, high=8.0, dead_zone=0.1):
+    """
+    Векторно генерирует процентные изменения цен в диапазоне [low, high],
+    исключая "мертвую зону" [-dead_zone, dead_zone]. Значения из мертвой зоны
+    с равной вероятностью перегенерируются в отрицательный или положительный диапазон.
+    """
+    rng = rng or get_rng()
+    values = rng.uniform(low, high, size=size)
+    in_dead_zone = np.abs(values) <= dead_zone
+    n_redraw = int(in_dead_zone.sum())
+    if n_redraw:
+        negative = -rng.uniform(dead_zone, -low, size=n_redraw)
+        positive = rng.uniform(dead_zone, high, size=n_redraw)
+        values[in_dead_zone] = np.where(rng.random(n_redraw) < 0.5, negative, positive)
+    return values
+
+
+def add_demo_price_changes(df, rng=None):
+    """Добавляет в DataFrame демонстрационные колонки pct_change, absolute_change и prev_price."""
+    df['pct_change'] = random_pct_changes(len(df), rng)
+    df['absolute_change'] = df['price'] * df['pct_change'] / 100
+    df['prev_price'] = df['price'] - df['absolute_change']
+    return df
+
+
+def generate_price_changes(n_changes=1_000_000, n_locations=300, seed=None, typo_rate=0.001, anomaly_rate=0.002):
+    """
+    Генерирует набор изменений цен (price, prev_price, pct_change, location) для бенчмарка
+    поиска выбросов. У каждого района свой типичный разброс изменений; с вероятностью
+    anomaly_rate изменение — резкое снижение на 30-60%, с вероятностью typo_rate —
+    ошибка ввода (цена умножена или разделена на 10). Колонка expected содержит
+    заложенную отметку ('', 'anomaly', 'typo').
+    """
+    rng = get_rng(seed)
+    names, _, _, base_prices = _make_locations(n_locations, rng)
+    location_idx = rng.integers(0, n_locations, size=n_changes)
+    spread = rng.uniform(1.0, 4.0, size=n_locations)
+
+    prev_price = (base_prices[location_idx] * rng.lognormal(np.log(50), 0.4, size=n_changes)).round(-2)
+    pct_change = random_pct_changes(n_changes, rng, low=-1.0, high=1.0) * spread[location_idx]
+
+    kind = rng.random(n_changes)
+    anomaly = kind < anomaly_rate
+    typo = (kind >= anomaly_rate) & (kind < anomaly_rate + typo_rate)
+    pct_change[anomaly] = -rng.uniform(30, 60, size=int(anomaly.sum()))
+    price = prev_price * (1 + pct_change / 100)
+    price[typo] = np.where(rng.random(int(typo.sum())) < 0.5, price[typo] * 10, price[typo] / 10)
+
+    df = pd.DataFrame({
+        'id': np.arange(n_changes),
+        'location': names[location_idx],
+        'price': price.round(-2),
+        'prev_price': prev_price
+    })
+    df['pct_change'] = (df['price'] - df['prev_price']) / df['prev_price'] * 100
+    df['expected'] = np.select([typo, anomaly], ['typo', 'anomaly'], default='')
+    return df
+
+
+def _make_locations(n_locations, rng):
+    """Возвращает массивы названий, координат центров и базовых цен для n_locations районов."""
+    names = [loc[0] for loc in DUBAI_LOCATIONS]
+    lats = [loc[1] for loc in DUBAI_LOCATIONS]
+    lngs = [loc[2] for loc in DUBAI_LOCATIONS]
+    base_prices = [loc[3] for loc in DUBAI_LOCATIONS]
+
+    # Если районов требуется больше, чем в справочнике, добавляем синтетические
+    extra = max(0, n_locations - len(names))
+    names += [f"District {i + 1}" for i in range(extra)]
+    lats += list(rng.uniform(24.90, 25.30, size=extra))
+    lngs += list(rng.uniform(55.05, 55.45, size=extra))
+    base_prices += list(rng.lognormal(np.log(12000), 0.35, size=extra))
+
+    return (
+        np.array(names[:n_locations], dtype=object),
+        np.array(lats[:n_locations]),
+        np.array(lngs[:n_locations]),
+        np.array(base_prices[:n_locations])
+    )
+
+
+def generate_price_history(n_locations=20, n_listings=1_000, snapshots_per_listing=3,
+                           seed=None, start_date=None, typo_rate=0.001):
+    """
+    Генерирует историю цен объявлений в формате таблицы bayut_properties.
+
+    Каждое объявление получает snapshots_per_listing записей с возрастающим updated_at;
+    цена между снимками меняется случайным блужданием (в большинстве снимков без изменений),
+    а с вероятностью typo_rate в цену вносится "опечатка" (лишний ноль).
+    """
+    rng = get_rng(seed)
+    start_date = start_date or datetime(2024, 1, 1)
+
+    names, lats, lngs, base_prices = _make_locations(n_locations, rng)
+
+    # Популярность районов распределена неравномерно (закон Ципфа)
+    weights = 1.0 / np.arange(1, n_locations + 1)
+    weights /= weights.sum()
+    location_idx = rng.choice(n_locations, size=n_listings, p=weights)
+
+    area = np.clip(rng.lognormal(np.log(70), 0.5, size=n_listings), 18, 400).round(2)
+    rooms = np.select([area < 45, area < 80, area < 120, area < 180], [0, 1, 2, 3], default=4)
+    price_per_sqm = base_prices[location_idx] * rng.lognormal(0, 0.15, size=n_listings)
+    base_price = (area * price_per_sqm).round(-3)
+
+    latitude = lats[location_idx] + rng.normal(0, 0.008, size=n_listings)
+    longitude = lngs[location_idx] + rng.normal(0, 0.008, size=n_listings)
+
+    # Матрица множителей цены (объявления x снимки): первый снимок без изменений
+    changed = rng.random((n_listings, snapshots_per_listing)) < 0.3
+    steps = np.where(changed, 1 + rng.normal(-0.01, 0.03, size=changed.shape), 1.0)
+    steps[:, 0] = 1.0
+    prices = (base_price[:, None] * np.cumprod(steps, axis=1)).round(-2)
+
+    typos = rng.random(prices.shape) < typo_rate
+    prices = np.where(typos, prices * 10, prices)
+
+    # Интервалы между снимками от 1 до 14 дней
+    gaps = rng.integers(1, 15, size=(n_listings, snapshots_per_listing))
+    offsets_days = np.cumsum(gaps, axis=1)
+    updated_at = np.datetime64(start_date) + offsets_days.astype('timedelta64[D]')
+
+    ids = np.arange(1_000_000, 1_000_000 + n_listings)
+    repeat = snapshots_per_listing
+    room_labels = pd.Series(rooms).astype(str).add(' BR').where(rooms > 0, 'Studio').to_numpy()
+
+    df = pd.DataFrame({
+        'id': np.repeat(ids, repeat),
+        'location': np.repeat(names[location_idx], repeat),
+        'area': np.repeat(area, repeat),
+        'rooms': np.repeat(rooms, repeat),
+        'price': prices.ravel(),
+        'latitude': np.repeat(latitude.round(6), repeat),
+        'longitude': np.repeat(longitude.round(6), repeat),
+        'updated_at': updated_at.ravel()
+    })
+    df['title'] = pd.Series(np.repeat(room_labels, repeat)) + ' apartment in ' + df['location']
+    df['property_url'] = 'https://www.bayut.com/property/details-' + df['id'].astype(str) + '.html'
+    df['geography'] = (
+        'Широта: ' + df['latitude'].astype(str) + ', Долгота: ' + df['longitude'].astype(str)
+    )
+    return df.drop(columns=['latitude', 'longitude'])
+
+
+def add_reposted_duplicates(df, rate=0.1, seed=None, price_jitter=0.01):
+    """
+    Добавляет повторные публикации: для доли rate объявлений — копия всей истории
+    под новым id (другой агент) с тем же объектом, заголовком в другом регистре и
+    ценой, отличающейся не больше чем на price_jitter. Колонка original_id указывает
+    исходное объявление (у исходных объявлений — собственный id).
+    """
+    rng = get_rng(seed)
+    ids = df['id'].unique()
+    reposted = rng.choice(ids, size=int(len(ids) * rate), replace=False)
+    copies = df[df['id'].isin(reposted)].copy()
+    copies['original_id'] = copies['id']
+    copies['id'] = copies['id'] + (ids.max() - ids.min() + 1)
+    copies['title'] = copies['title'].str.upper()
+    jitter = 1 + rng.uniform(-price_jitter, price_jitter, size=len(copies))
+    copies['price'] = (copies['price'] * jitter).round(-2)
+    copies['property_url'] = 'https://www.bayut.com/property/details-' + copies['id'].astype(str) + '.html'
+    return pd.concat([df.assign(original_id=df['id']), copies], ignore_index=True)
+
+
+def generate_benchmark_dataset(scale='small', seed=None):
+    """Генерирует набор данных одного из масштабов BENCHMARK_SCALES."""
+    n_locations, n_listings, snapshots = BENCHMARK_SCALES[scale]
+    return generate_price_history(n_locations, n_listings, snapshots, seed=seed)
+
+
+def load_into_postgres(conn, df, table='bayut_properties', truncate=False):
+    """
+    Загружает синтетические данные в PostgreSQL через COPY.
+    Таблица создается при отсутствии; при truncate=True предыдущее содержимое удаляется.
+    В таблицу bayut_properties рабочей базы (DB_*) синтетические данные не загружаются.
+    """
+    if table == TABLE_NAME and is_production_database(conn.get_dsn_parameters()):
+        raise RuntimeError(f"Соединение указывает на рабочую базу, загрузка синтетических данных в {TABLE_NAME} запрещена")
+    columns = ['id', 'title', 'price', 'rooms', 'area', 'location', 'property_url', 'geography', 'updated_at']
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BIGINT NOT NULL,
+            title TEXT,
+            price NUMERIC,
+            rooms INTEGER,
+            area NUMERIC,
+            location TEXT,
+            property_url TEXT,
+            geography TEXT,
+            updated_at TIMESTAMP
+        )
+    """)
+    if truncate:
+        cursor.execute(f"TRUNCATE {table}")
+
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_id_updated_at_idx ON {table} (id, updated_at)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_location_price_idx ON {table} (location, price)")
+    # Частичный индекс под фильтры площади запроса самых дешевых квартир (query_builder)
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_area_idx ON {table} (area) WHERE price > 0")
+    cursor.execute(f"ANALYZE {table}")
+    conn.commit()
+    cursor.close()
+
+    # После загрузки обновляем представление последних снимков, если оно создано
+    from latest_listings import latest_view_exists, refresh_latest_view
+    if table == TABLE_NAME and latest_view_exists(conn):
+        refresh_latest_view(conn)
+    return len(df)
+
+
+def load_benchmark_dataset(conn, scale='small', seed=None, table='bayut_properties', truncate=False):
+    """Генерирует набор данных заданного масштаба и загружает его в PostgreSQL."""
+    df = generate_benchmark_dataset(scale, seed)
+    return load_into_postgres(conn, df, table=table, truncate=truncate)
+
+
+def is_production_database(db_params):
+    """Совпадают ли параметры подключения с рабочей базой из DB_*."""
+    production = (os.getenv('DB_NAME', 'postgres'), os.getenv('DB_HOST', 'localhost'), str(os.getenv('DB_PORT', '5432')))
+    return (db_params['dbname'], db_params['host'], str(db_params['port'])) == production
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных bayut_properties")
+    parser.add_argument('command', choices=['load', 'export'])
+    parser.add_argument('--scale', choices=sorted(BENCHMARK_SCALES), default=None)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--listings', type=int, default=1_000)
+    parser.add_argument('--snapshots', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--table', default='bayut_properties')
+    parser.add_argument('--truncate', action='store_true',
+                        help="Удалить прежнее содержимое таблицы перед загрузкой")
+    parser.add_argument('--out', default='synthetic_bayut_properties.parquet')
+    args = parser.parse_args(argv)
+
+    if args.scale:
+        df = generate_benchmark_dataset(args.scale, args.seed)
+    else:
+        df = generate_price_history(args.locations, args.listings, args.snapshots, seed=args.seed)
+    print(f"Сгенерировано строк: {len(df)}")
+
+    if args.command == 'export':
+        df.to_parquet(args.out, index=False)
+        print(f"Данные сохранены в файл: {args.out}")
+        return
+
+    conn = psycopg2.connect(**BENCH_DB_PARAMS)
+    try:
+        rows = load_into_postgres(conn, df, table=args.table, truncate=args.truncate)
+        print(f"В таблицу {args.table} загружено строк: {rows}")
+    except RuntimeError as e:
+        parser.error(str(e))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
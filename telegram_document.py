@@ -0,0 +1,100 @@
+"""
+Отправка длинного анализа в Telegram одним документом.
+
+Длинный текстовый анализ отправляется серией сообщений по 3000 символов
+с паузой в секунду между ними: 20 частей — это 20 запросов и 20 секунд.
+Здесь анализ один раз превращается в компактный HTML-документ (со ссылками
+на объявления) и отправляется одним вызовом sendDocument с краткой сводкой
+в подписи.
+
+Режим выбирается переменной TELEGRAM_DELIVERY_MODE:
+    'chunks'   — всегда серия сообщений (как раньше, по умолчанию);
+    'auto'     — документ, если анализ не помещается в TELEGRAM_DOCUMENT_MIN_CHUNKS сообщений;
+    'document' — всегда документ.
+"""
+
+import os
+import re
+
+# Способ доставки анализа: 'chunks', 'auto' или 'document'
+TELEGRAM_DELIVERY_MODE = os.getenv('TELEGRAM_DELIVERY_MODE', 'chunks')
+
+# В режиме 'auto' анализ длиннее этого количества сообщений отправляется документом
+TELEGRAM_DOCUMENT_MIN_CHUNKS = int(os.getenv('TELEGRAM_DOCUMENT_MIN_CHUNKS', '3'))
+
+# Ограничение Telegram на длину подписи к документу
+CAPTION_LIMIT = 1024
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"]+')
+
+DOCUMENT_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font: 14px/1.45 -apple-system, "Segoe UI", Roboto, sans-serif; margin: 0 auto; max-width: 860px; padding: 16px; color: #222; }}
+h1 {{ font-size: 18px; }}
+pre {{ white-space: pre-wrap; word-wrap: break-word; font: inherit; }}
+a {{ color: #1a6fb3; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<pre>{body}</pre>
+</body>
+</html>
+"""
+
+
+def use_document_delivery(chunk_count, mode=None):
+    """Отправлять ли анализ документом вместо серии из chunk_count сообщений."""
+    mode = mode or TELEGRAM_DELIVERY_MODE
+    if mode == 'document':
+        return True
+    if mode == 'chunks':
+        return False
+    return chunk_count > TELEGRAM_DOCUMENT_MIN_CHUNKS
+
+
+def render_analysis_document(text, title):
+    """
+    Превращает текст анализа в HTML-документ (байты UTF-8), ссылки становятся кликабельными.
+    text должен быть уже очищен clean_html_and_sanitize: спецсимволы HTML в нем экранированы.
+    """
+    import html
+
+    body = URL_PATTERN.sub(lambda match: f'<a href="{match.group(0)}">{match.group(0)}</a>', text)
+    return DOCUMENT_TEMPLATE.format(title=html.escape(title), body=body).encode('utf-8')
+
+
+def build_caption(title, lines):
+    """Подпись к документу: заголовок и строки сводки, не длиннее CAPTION_LIMIT символов."""
+    caption = "\n".join([title, ""] + list(lines))
+    if len(caption) > CAPTION_LIMIT:
+        caption = caption[:CAPTION_LIMIT - 3] + "..."
+    return caption
+
+
+def method_url(api_url, method):
+    """Адрес другого метода Bot API по адресу метода sendMessage."""
+    return api_url.rsplit('/', 1)[0] + '/' + method
+
+
+async def send_document(session, api_url, chat_id, file_name, content, caption):
+    """
+    Отправляет документ через sendDocument (api_url — адрес sendMessage бота).
+    Возвращает (успех, текст ошибки).
+    """
+    import aiohttp
+
+    form = aiohttp.FormData()
+    form.add_field('chat_id', str(chat_id))
+    form.add_field('caption', caption)
+    form.add_field('parse_mode', 'HTML')
+    form.add_field('document', content, filename=file_name, content_type='text/html')
+    async with session.post(method_url(api_url, 'sendDocument'), data=form) as response:
+        if response.status == 200:
+            return True, None
+        return False, await response.text()
@@ -1,41 +1,57 @@
 import os
-import pandas as pd
-import numpy as np
-import folium
-from folium.plugins import MarkerCluster
-import psycopg2
 import asyncio
-import telegram
-from dotenv import load_dotenv
+import argparse
 from datetime import datetime
 import ftplib
-import jinja2
 
-# Загружаем переменные окружения
-load_dotenv()
+if __name__ == "__main__":
+    # При запуске скриптом .env загружается до чтения настроек этого и импортируемых модулей
+    # (cli.py загружает его сам перед импортом)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from analysis_cache import get_data_watermark, make_cache_key, load_cached_result, save_cached_result
+from local_snapshot import DB_PARAMS, read_analysis_query, analysis_source_params
+from query_builder import normalize_filters, build_cheapest_apartments_query
+from schema_capabilities import get_schema_capabilities, TABLE_NAME, LATEST_VIEW_NAME
+from latest_listings import use_latest_view
+from parallel_fetch import parallel_fetch_enabled, parallel_read_query
+from listing_dedup import overfetch_filters, dedup_top_n
+from link_checker import drop_dead_listings
+from metrics import stage, timed, configure as configure_metrics, write_openmetrics
+from profiling import add_profile_arguments, profile_call
 
 # Параметры Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
 # Параметры FTP
 FTP_HOST = os.getenv("FTP_HOST", "")
+FTP_PORT = int(os.getenv("FTP_PORT", "21"))
 FTP_USER = os.getenv("FTP_USER", "")
 FTP_PASSWORD = os.getenv("FTP_PASSWORD", "")
 FTP_DIRECTORY = os.getenv("FTP_DIRECTORY", "/public_html/dubai-reports/")
 BASE_URL = os.getenv("BASE_URL", "https://ваш-домен.com/dubai-reports/")
 
+# Режим отчета: 'single' — одна страница, 'sharded' — индекс и страницы по регионам
+REPORT_MODE = os.getenv("REPORT_MODE", "single")
+
+# Режим таблицы квартир: 'virtual' — данные в JSON и виртуализированная таблица
+# с сортировкой и фильтром в браузере, 'html' — все строки в разметке страницы
+REPORT_TABLE_MODE = os.getenv("REPORT_TABLE_MODE", "virtual")
+
+# Адрес объявления на Bayut, к которому добавляется id
+PROPERTY_URL_PREFIX = "https://www.bayut.com/property/"
+
 # Функция для подключения к БД
+@timed('connect_to_db')
 def connect_to_db():
     """Устанавливает соединение с базой данных PostgreSQL."""
+    import psycopg2
+
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT")
-        )
+        conn = psycopg2.connect(**DB_PARAMS)
         return conn
     except Exception as e:
         print(f"Ошибка подключения к БД: {e}")
@@ -58,71 +74,108 @@ def parse_geography(geo_str):
         pass
     return None, None
 
-# Функция для получения данных о самых дешевых квартирах
-def fetch_cheapest_apartments_by_region(conn):
+# Функция для подготовки выборки квартир к отображению
+def prepare_apartments_frame(df):
     """
-    Извлекает топ-3 самых дешевых квартир по каждому региону с площадью до 40 кв.м.
+    Добавляет координаты из колонки geography и ссылки на объявления,
+    удаляет строки без координат.
     """
-    query = """
-    WITH ranked_apartments AS (
-        SELECT 
-            id, 
-            location, 
-            area, 
-            price, 
-            geography,
-            ROW_NUMBER() OVER (PARTITION BY location ORDER BY price ASC) as rank
-        FROM bayut_properties
-        WHERE area <= 40 AND price > 0
-    )
-    SELECT 
-        id, 
-        location, 
-        area, 
-        price, 
-        geography,
-        rank
-    FROM ranked_apartments
-    WHERE rank <= 3
-    ORDER BY location, rank
+    import pandas as pd
+
+    # Обрабатываем географические данные
+    df[['latitude', 'longitude']] = df['geography'].apply(lambda x: pd.Series(parse_geography(x)))
+    
+    # Удаляем строки без координат
+    df = df.dropna(subset=['latitude', 'longitude'])
+    
+    # Создаем URL-ссылки на объявления
+    df['url'] = df['id'].apply(lambda x: f"{PROPERTY_URL_PREFIX}{x}/")
+    
+    return df
+
+@timed('select_published_apartments', rows=len)
+def select_published_apartments(df, top_n):
     """
+    Оставляет по одному объявлению на квартиру, убирает снятые с публикации
+    и заново ранжирует регионы: top_n различных действующих объявлений в каждом.
+    """
+    select = lambda frame: dedup_top_n(frame, top_n)
+    return select(drop_dead_listings(df, select))
+
+# Функция для получения данных о самых дешевых квартирах
+@timed('fetch_cheapest_apartments', rows=len)
+def fetch_cheapest_apartments_by_region(conn, filters=None):
+    """
+    Извлекает топ-N самых дешевых квартир по каждому региону.
+    filters задает диапазон площади, N на регион, спальни, границы цены и список регионов
+    (см. query_builder.DEFAULT_CHEAPEST_FILTERS); по умолчанию — топ-3 с площадью до 40 кв.м.
+    """
+    filters = normalize_filters(filters)
     
     try:
-        # Выполняем запрос
-        df = pd.read_sql_query(query, conn)
+        # Если есть представление последних снимков, ранжируем только актуальные версии объявлений
+        table = LATEST_VIEW_NAME if use_latest_view(get_schema_capabilities(conn)) else TABLE_NAME
+        # Повторные публикации одной квартиры схлопываются после выборки, поэтому запрашиваем строки с запасом
+        query_filters = overfetch_filters(filters)
+        query, params = build_cheapest_apartments_query(query_filters, table)
+        
+        # Если таблица не менялась с прошлого запуска, берем готовую выборку из кэша.
+        # Кэшируется выборка с запасом: снятые объявления проверяются при каждом запуске
+        cache_key = make_cache_key('cheapest_apartments', get_data_watermark(conn),
+                                   {**query_filters, 'source': table, **analysis_source_params()})
+        df = load_cached_result(cache_key)
+        if df is not None:
+            print("Данные не изменились с прошлого запуска, используем кэшированный результат.")
+            return select_published_apartments(df, filters['top_n'])
+        
+        if parallel_fetch_enabled():
+            # Ранжирование идет внутри региона, поэтому запрос делится по хешу location без потери точности
+            df = parallel_read_query(query, params, partition_by='location', order_by=['location', 'rank'],
+                                     db_params=DB_PARAMS, table=table)
+        else:
+            # Выполняем запрос через подготовленный оператор
+            df = read_analysis_query(query, conn, params, prepared=True)
         
         if df.empty: 
             print("Данные не найдены в БД.")
             return None
         
-        # Обрабатываем географические данные
-        df[['latitude', 'longitude']] = df['geography'].apply(lambda x: pd.Series(parse_geography(x)))
-        
-        # Удаляем строки без координат
-        df = df.dropna(subset=['latitude', 'longitude'])
+        df = prepare_apartments_frame(df)
         
-        # Создаем URL-ссылки на объявления
-        df['url'] = df['id'].apply(lambda x: f"https://www.bayut.com/property/{x}/")
+        save_cached_result(cache_key, df)
         
-        return df
+        return select_published_apartments(df, filters['top_n'])
     
     except Exception as e:
         print(f"Ошибка при извлечении данных из БД: {e}")
         return None
 
 # Функция для создания интерактивной карты с Folium
-def create_interactive_map(df):
+@timed('create_interactive_map')
+def create_interactive_map(df, zoom_start=11):
     """
     Создает интерактивную карту с маркерами для квартир.
+    При большом количестве точек (см. map_aggregation.MAP_MARKER_MODE) вместо
+    отдельных маркеров на карту выводятся ячейки сетки, рассчитанные на сервере.
     """
+    # folium загружается только при построении карты, чтобы не замедлять запуск
+    import folium
+    from folium.plugins import MarkerCluster
+    import map_aggregation
+    
     # Создаем карту, центрированную по среднему значению координат
     center_lat = df['latitude'].mean()
     center_lon = df['longitude'].mean()
     
     m = folium.Map(location=[center_lat, center_lon], 
-                   zoom_start=11, 
+                   zoom_start=zoom_start, 
                    tiles='CartoDB positron')
     
+    # Для большого количества точек отправляем в браузер только агрегированные ячейки
+    if map_aggregation.use_grid_markers(len(df)):
+        map_aggregation.add_grid_layer(m, df, PROPERTY_URL_PREFIX)
+        return m
+    
     # Добавляем кластеры маркеров для лучшей производительности
     marker_cluster = MarkerCluster().add_to(m)
     
@@ -170,17 +223,47 @@ def create_region_stats(df):
     
     return region_stats
 
+# Функция для сериализации таблицы квартир в компактный JSON
+def build_table_payload(df):
+    """
+    Сериализует таблицу квартир для виртуализированной таблицы на странице.
+    Регионы передаются словарем (отсортированным по алфавиту, поэтому сортировка
+    по региону в браузере — это сортировка по номеру), строки — массивами
+    [номер региона, цена, площадь, ранг, id]. Ссылки собираются в браузере из id.
+    """
+    import json
+    import pandas as pd
+    
+    codes, locations = pd.factorize(df['location'], sort=True)
+    rows = pd.DataFrame({
+        'location': codes,
+        'price': df['price'].round().astype('int64'),
+        'area': df['area'].astype(float).round(1),
+        'rank': df['rank'].astype('int64'),
+        'id': df['id']
+    })
+    payload = (
+        '{"url_prefix":' + json.dumps(PROPERTY_URL_PREFIX)
+        + ',"locations":' + json.dumps([str(location) for location in locations], ensure_ascii=False)
+        + ',"rows":' + rows.to_json(orient='values')
+        + '}'
+    )
+    # JSON встраивается в тег <script>, поэтому экранируем закрывающие теги
+    return payload.replace('</', '<\\/')
+
 # Функция для генерации HTML-страницы с отчетом
-def generate_html_report(df):
+@timed('generate_html_report', size=lambda result: os.path.getsize(result[0]))
+def generate_html_report(df, report_name='cheapest_apartments', title='Самые дешевые квартиры в Дубае'):
     """
     Генерирует HTML-страницу с отчетом о самых дешевых квартирах.
+    report_name задает префикс имени файла, title — заголовок страницы.
     """
     # Создаем папку для отчетов, если ее нет
     os.makedirs('reports', exist_ok=True)
     
     # Генерируем уникальное имя файла
     current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
-    file_name = f"cheapest_apartments_{current_date}.html"
+    file_name = f"{report_name}_{current_date}.html"
     file_path = os.path.join('reports', file_name)
     
     # Получаем карту и статистику
@@ -191,10 +274,17 @@ def generate_html_report(df):
     map_html = map_obj._repr_html_()
     
     # Подготавливаем данные для таблицы
-    table_data = df.copy()
-    table_data['price_formatted'] = table_data['price'].apply(lambda x: f"{int(x):,} AED")
-    table_data['area_formatted'] = table_data['area'].apply(lambda x: f"{x:.1f} кв.м")
-    table_data['link'] = table_data.apply(lambda row: f'<a href="{row["url"]}" target="_blank">Открыть</a>', axis=1)
+    if REPORT_TABLE_MODE == 'virtual':
+        # Строки таблицы рисует браузер, на сервере только сериализуем данные
+        table_data = None
+        table_json = build_table_payload(df)
+    else:
+        table_data = df.copy()
+        table_data['price_formatted'] = table_data['price'].apply(lambda x: f"{int(x):,} AED")
+        table_data['area_formatted'] = table_data['area'].apply(lambda x: f"{x:.1f} кв.м")
+        table_data['link'] = table_data.apply(lambda row: f'<a href="{row["url"]}" target="_blank">Открыть</a>', axis=1)
+        table_data = table_data[['location', 'price_formatted', 'area_formatted', 'rank', 'link']]
+        table_json = None
     
     # Создаем HTML-шаблон
     template = """
@@ -203,7 +293,7 @@ def generate_html_report(df):
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Самые дешевые квартиры в Дубае</title>
+        <title>{{ title }}</title>
         <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
         <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
         <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
@@ -220,12 +310,22 @@ def generate_html_report(df):
             tr:nth-child(even) { background-color: #f9f9f9; }
             .footer { background-color: #f2f2f2; padding: 20px; text-align: center; }
             .card { margin-bottom: 20px; }
+            .vgrid-controls { display: flex; gap: 20px; align-items: center; margin-bottom: 10px; }
+            .vgrid-controls input { max-width: 300px; }
+            .vgrid-header, .vgrid-row { display: grid; grid-template-columns: 3fr 2fr 2fr 1.5fr 1.5fr; }
+            .vgrid-header > div, .vgrid-row > div { padding: 8px 10px; border-bottom: 1px solid #ddd; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+            .vgrid-header > div { background-color: #f2f2f2; font-weight: bold; }
+            .vgrid-header > div[data-key] { cursor: pointer; user-select: none; }
+            .vgrid-viewport { height: 600px; overflow-y: auto; position: relative; }
+            .vgrid-body { position: relative; }
+            .vgrid-row { position: absolute; left: 0; right: 0; height: 36px; }
+            .vgrid-row.even { background-color: #f9f9f9; }
         </style>
     </head>
     <body>
         <div class="header">
             <div class="container">
-                <h1>Самые дешевые квартиры в Дубае</h1>
+                <h1>{{ title }}</h1>
                 <p>Дата обновления: {{ current_date }}</p>
             </div>
         </div>
@@ -312,6 +412,121 @@ def generate_html_report(df):
                             <h2>Полный список квартир</h2>
                         </div>
                         <div class="card-body">
+                            {% if table_json %}
+                            <div class="table-container">
+                                <div class="vgrid-controls">
+                                    <input id="tableFilter" class="form-control" type="search" placeholder="Фильтр по региону">
+                                    <span id="tableCount"></span>
+                                </div>
+                                <div class="vgrid-header">
+                                    <div data-key="0">Регион</div>
+                                    <div data-key="1">Цена</div>
+                                    <div data-key="2">Площадь</div>
+                                    <div data-key="3">Ранг в регионе</div>
+                                    <div>Ссылка</div>
+                                </div>
+                                <div id="tableViewport" class="vgrid-viewport">
+                                    <div id="tableBody" class="vgrid-body"></div>
+                                </div>
+                            </div>
+                            <script type="application/json" id="tableData">{{ table_json|safe }}</script>
+                            <script>
+                                (function () {
+                                    var ROW_HEIGHT = 36, OVERSCAN = 10;
+                                    var payload = JSON.parse(document.getElementById('tableData').textContent);
+                                    var rows = payload.rows;
+                                    var viewport = document.getElementById('tableViewport');
+                                    var body = document.getElementById('tableBody');
+                                    var filterInput = document.getElementById('tableFilter');
+                                    var countLabel = document.getElementById('tableCount');
+                                    var headers = document.querySelectorAll('.vgrid-header [data-key]');
+                                    var numberFormat = new Intl.NumberFormat('en-US');
+                                    var escapeBox = document.createElement('div');
+                                    var locationsHtml = payload.locations.map(function (name) {
+                                        escapeBox.textContent = name;
+                                        return escapeBox.innerHTML;
+                                    });
+                                    var locationsLower = payload.locations.map(function (name) { return name.toLowerCase(); });
+                                    var view = [], sortKey = null, sortDir = 1, renderedRange = '', scheduled = false;
+
+                                    // Пересчитывает список видимых строк после фильтрации и сортировки
+                                    function applyView() {
+                                        var query = filterInput.value.trim().toLowerCase();
+                                        var matches = locationsLower.map(function (name) { return !query || name.indexOf(query) !== -1; });
+                                        view = [];
+                                        for (var i = 0; i < rows.length; i++) {
+                                            if (matches[rows[i][0]]) view.push(i);
+                                        }
+                                        if (sortKey !== null) {
+                                            view.sort(function (a, b) {
+                                                var x = rows[a][sortKey], y = rows[b][sortKey];
+                                                // Строки без значения (площадь не указана) всегда в конце
+                                                if (x === null || y === null) return x === y ? a - b : (x === null ? 1 : -1);
+                                                return x === y ? a - b : (x < y ? -sortDir : sortDir);
+                                            });
+                                        }
+                                        body.style.height = (view.length * ROW_HEIGHT) + 'px';
+                                        countLabel.textContent = 'Показано квартир: ' + numberFormat.format(view.length) + ' из ' + numberFormat.format(rows.length);
+                                        renderedRange = '';
+                                        render();
+                                    }
+
+                                    // Рисует только строки, попадающие в область прокрутки
+                                    function render() {
+                                        scheduled = false;
+                                        var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+                                        var last = Math.min(view.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+                                        if (renderedRange === first + ':' + last) return;
+                                        renderedRange = first + ':' + last;
+                                        var html = [];
+                                        for (var i = first; i < last; i++) {
+                                            var row = rows[view[i]];
+                                            html.push(
+                                                '<div class="vgrid-row' + (i % 2 ? ' even' : '') + '" style="top:' + (i * ROW_HEIGHT) + 'px">'
+                                                + '<div>' + locationsHtml[row[0]] + '</div>'
+                                                + '<div>' + numberFormat.format(row[1]) + ' AED</div>'
+                                                + '<div>' + (row[2] === null ? '—' : row[2].toFixed(1) + ' кв.м') + '</div>'
+                                                + '<div>' + row[3] + '</div>'
+                                                + '<div><a href="' + payload.url_prefix + encodeURIComponent(row[4]) + '/" target="_blank">Открыть</a></div>'
+                                                + '</div>'
+                                            );
+                                        }
+                                        body.innerHTML = html.join('');
+                                    }
+
+                                    viewport.addEventListener('scroll', function () {
+                                        if (!scheduled) {
+                                            scheduled = true;
+                                            window.requestAnimationFrame(render);
+                                        }
+                                    });
+
+                                    var filterTimer = null;
+                                    filterInput.addEventListener('input', function () {
+                                        clearTimeout(filterTimer);
+                                        filterTimer = setTimeout(function () {
+                                            viewport.scrollTop = 0;
+                                            applyView();
+                                        }, 150);
+                                    });
+
+                                    headers.forEach(function (header) {
+                                        header.dataset.label = header.textContent;
+                                        header.addEventListener('click', function () {
+                                            var key = Number(header.dataset.key);
+                                            sortDir = sortKey === key ? -sortDir : 1;
+                                            sortKey = key;
+                                            headers.forEach(function (other) {
+                                                other.textContent = other.dataset.label + (other === header ? (sortDir > 0 ? ' ▲' : ' ▼') : '');
+                                            });
+                                            applyView();
+                                        });
+                                    });
+
+                                    applyView();
+                                })();
+                            </script>
+                            {% else %}
                             <div class="table-container">
                                 <table class="table table-striped">
                                     <thead>
@@ -336,6 +551,7 @@ def generate_html_report(df):
                                     </tbody>
                                 </table>
                             </div>
+                            {% endif %}
                         </div>
                     </div>
                 </div>
@@ -356,15 +572,18 @@ def generate_html_report(df):
     
     # Подготавливаем данные для шаблона
     template_data = {
+        'title': title,
         'current_date': datetime.now().strftime('%d.%m.%Y'),
         'current_year': datetime.now().year,
         'map_html': map_html,
         'region_labels': region_labels,
         'region_prices': region_prices,
-        'table_data': table_data[['location', 'price_formatted', 'area_formatted', 'rank', 'link']]
+        'table_data': table_data,
+        'table_json': table_json
     }
     
     # Генерируем HTML с использованием Jinja2
+    import jinja2
     env = jinja2.Environment()
     template = env.from_string(template)
     html_content = template.render(**template_data)
@@ -375,7 +594,30 @@ def generate_html_report(df):
     
     return file_path, file_name
 
+# Функция для перехода в директорию на FTP-сервере
+def ensure_ftp_directory(ftp, directory):
+    """
+    Переходит в директорию на FTP-сервере, при ее отсутствии создает ее
+    вместе с родительскими директориями.
+    """
+    try:
+        ftp.cwd(directory)
+    except ftplib.error_perm:
+        # Если директории нет, пытаемся создать ее
+        dirs = directory.split('/')
+        current_dir = ""
+        for d in dirs:
+            if not d:
+                continue
+            current_dir += f"/{d}"
+            try:
+                ftp.cwd(current_dir)
+            except:
+                ftp.mkd(current_dir)
+                ftp.cwd(current_dir)
+
 # Функция для загрузки файла на FTP-сервер
+@timed('upload_to_ftp')
 def upload_to_ftp(local_file_path, remote_file_name):
     """
     Загружает файл на FTP-сервер.
@@ -386,28 +628,16 @@ def upload_to_ftp(local_file_path, remote_file_name):
     
     try:
         # Подключаемся к FTP-серверу
-        ftp = ftplib.FTP(FTP_HOST)
+        ftp = ftplib.FTP()
+        ftp.connect(FTP_HOST, FTP_PORT)
         ftp.login(FTP_USER, FTP_PASSWORD)
         
         # Переходим в нужную директорию
-        try:
-            ftp.cwd(FTP_DIRECTORY)
-        except ftplib.error_perm:
-            # Если директории нет, пытаемся создать ее
-            dirs = FTP_DIRECTORY.split('/')
-            current_dir = ""
-            for d in dirs:
-                if not d:
-                    continue
-                current_dir += f"/{d}"
-                try:
-                    ftp.cwd(current_dir)
-                except:
-                    ftp.mkd(current_dir)
-                    ftp.cwd(current_dir)
+        ensure_ftp_directory(ftp, FTP_DIRECTORY)
         
         # Загружаем файл
-        with open(local_file_path, 'rb') as f:
+        with stage('ftp_transfer') as record, open(local_file_path, 'rb') as f:
+            record.bytes = os.path.getsize(local_file_path)
             ftp.storbinary(f'STOR {remote_file_name}', f)
         
         # Закрываем соединение
@@ -421,10 +651,14 @@ def upload_to_ftp(local_file_path, remote_file_name):
         return None
 
 # Функция для отправки сообщения в Telegram
+@timed('telegram_send')
 async def send_telegram_message(bot_token, chat_id, message, disable_web_page_preview=False):
     """Отправляет сообщение в Telegram."""
+    # python-telegram-bot загружается только при отправке
+    import telegram
+    
     try:
-        bot = telegram.Bot(token=bot_token)
+        bot = telegram.Bot(token=bot_token, base_url=f"{TELEGRAM_API_URL}/bot")
         await bot.send_message(
             chat_id=chat_id,
             text=message,
@@ -439,10 +673,13 @@ async def send_telegram_message(bot_token, chat_id, message, disable_web_page_pr
 
 # Основная функция
 def main():
+    configure_metrics('telegram_html')
+    
     # Подключаемся к БД
     conn = connect_to_db()
     if not conn:
         print("Не удалось подключиться к базе данных.")
+        write_openmetrics()
         return
     
     try:
@@ -454,13 +691,31 @@ def main():
             print("Нет данных для отображения.")
             return
         
-        # Генерируем HTML-отчет
-        print("Генерация HTML-отчета...")
-        html_file_path, html_file_name = generate_html_report(apartments_data)
+        # Дописываем агрегаты по регионам во временной ряд для графиков трендов
+        try:
+            from region_history import record_region_stats
+            band = normalize_filters()
+            with stage('record_region_stats') as record:
+                region_stats = record_region_stats(conn, band['area_min'] or 0, band['area_max'])
+                record.rows = len(region_stats)
+        except Exception as e:
+            print(f"Ошибка при сохранении агрегатов по регионам: {e}")
         
-        # Загружаем отчет на FTP
-        print("Загрузка отчета на FTP...")
-        report_url = upload_to_ftp(html_file_path, html_file_name)
+        if REPORT_MODE == 'sharded':
+            # Индексная страница и страницы регионов; на FTP уходят только изменившиеся
+            from sharded_report import generate_sharded_report, upload_sharded_report
+            print("Генерация страниц отчета по регионам...")
+            html_file_path, _ = generate_sharded_report(apartments_data)
+            print("Загрузка изменившихся страниц на FTP...")
+            report_url = upload_sharded_report()
+        else:
+            # Генерируем HTML-отчет
+            print("Генерация HTML-отчета...")
+            html_file_path, html_file_name = generate_html_report(apartments_data)
+            
+            # Загружаем отчет на FTP
+            print("Загрузка отчета на FTP...")
+            report_url = upload_to_ftp(html_file_path, html_file_name)
         
         if not report_url:
             print("Не удалось загрузить отчет на FTP.")
@@ -503,6 +758,13 @@ def main():
     finally:
         # Закрываем соединение с БД
         conn.close()
+        # Сохраняем метрики этапов для мониторинга
+        write_openmetrics()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Публикация HTML-отчета о самых дешевых квартирах")
+    args = add_profile_arguments(parser).parse_args()
+    if args.profile:
+        profile_call(main, 'telegram_html_publisher', args.profile_top)
+    else:
+        main()
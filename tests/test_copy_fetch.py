@@ -0,0 +1,76 @@
+"""Типы колонок выборки через COPY (copy_fetch) без подключения к базе."""
+
+from collections import namedtuple
+
+import pyarrow as pa
+import pytest
+
+import copy_fetch
+
+Column = namedtuple('Column', 'name type_code')
+
+
+class FakeCursor:
+    """Курсор psycopg2: описание колонок после execute и заранее заданный CSV для COPY."""
+
+    def __init__(self, columns, csv_data=b''):
+        self.columns = columns
+        self.csv_data = csv_data
+        self.description = None
+        self.executed = []
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        self.description = self.columns
+
+    def mogrify(self, query, params):
+        return query.encode('utf-8')
+
+    def copy_expert(self, sql, buffer):
+        self.description = None
+        buffer.write(self.csv_data)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    encoding = 'UTF8'
+    dsn = 'dbname=test'
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+@pytest.mark.parametrize('oid', sorted(copy_fetch.PG_TYPE_OIDS))
+def test_every_known_oid_maps_to_arrow_type(oid):
+    cursor = FakeCursor([Column('value', oid)])
+    column_types = copy_fetch._arrow_column_types(cursor, 'SELECT 1')
+    assert column_types == {'value': copy_fetch.PG_TYPE_OIDS[oid]}
+    assert isinstance(column_types['value'], pa.DataType)
+
+
+def test_unknown_oid_is_read_as_string():
+    assert copy_fetch._arrow_column_types(FakeCursor([Column('value', 25)]), 'SELECT 1') == {'value': pa.string()}
+
+
+def test_copy_csv_is_parsed_and_description_is_reused(monkeypatch):
+    monkeypatch.setattr(copy_fetch, '_column_types_cache', {})
+    cursor = FakeCursor(
+        [Column('id', 20), Column('updated_at', 1184), Column('created_at', 1114), Column('active', 16)],
+        b'id,updated_at,created_at,active\n1,2026-10-19 17:08:11.260153+04,2026-10-19 13:08:11,t\n'
+    )
+    conn = FakeConnection(cursor)
+
+    for _ in range(2):
+        df = copy_fetch.read_sql_copy('SELECT id, updated_at, created_at, active FROM bayut_properties', conn)
+        assert str(df['updated_at'].dtype) == 'datetime64[us, UTC]'
+        assert df['updated_at'].iloc[0].hour == 13
+        assert str(df['created_at'].dtype) == 'datetime64[us]'
+        assert df['id'].tolist() == [1]
+        assert df['active'].tolist() == [True]
+    # Описание колонок запрашивается только при первой выборке
+    assert len(cursor.executed) == 1
@@ -0,0 +1,15 @@
+"""Бюджеты времени импорта публикаторов и CLI (python -X importtime, см. cli.IMPORT_BUDGETS_MS)."""
+
+import pytest
+
+import cli
+
+
+@pytest.mark.parametrize('module_name', sorted(cli.IMPORT_BUDGETS_MS))
+def test_import_within_budget(module_name):
+    elapsed_ms, packages = cli.measure_import(module_name, runs=3)
+
+    forbidden = sorted(set(cli.FORBIDDEN_AT_IMPORT[module_name]) & packages)
+    assert not forbidden, f"{module_name} загружает при импорте: {', '.join(forbidden)}"
+    assert elapsed_ms is not None
+    assert elapsed_ms <= cli.IMPORT_BUDGETS_MS[module_name], f"{module_name}: {elapsed_ms:.1f} мс"
@@ -0,0 +1,101 @@
+"""Проверка ссылок объявлений на локальной имитации сайта (mock_services.MockListingSite)."""
+
+import time
+import asyncio
+
+import pandas as pd
+import pytest
+
+import link_checker
+import listing_dedup
+from link_checker import LinkStatusCache, check_links, drop_dead_listings_async
+from mock_services import MockListingSite
+
+
+@pytest.fixture
+def site():
+    """Имитация сайта: id, кратные 10, сняты (404), на id с остатком 1 HEAD отвечает 405."""
+    mock = MockListingSite(latency=0.05)
+    url = mock.start()
+    yield mock, url
+    mock.stop()
+
+
+def urls(base, ids):
+    return [(listing_id, f"{base}/property/{listing_id}/") for listing_id in ids]
+
+
+def test_removed_listing_is_dead(site):
+    mock, base = site
+    statuses = asyncio.run(check_links(urls(base, [10, 12])))
+    assert statuses == {10: 'dead', 12: 'alive'}
+    assert mock.calls == {'HEAD': 2}
+
+
+def test_head_not_allowed_falls_back_to_get(site):
+    mock, base = site
+    statuses = asyncio.run(check_links(urls(base, [11])))
+    assert statuses == {11: 'alive'}
+    assert mock.calls == {'HEAD': 1, 'GET': 1}
+
+
+def test_per_host_limit(site):
+    mock, base = site
+    port = base.rsplit(':', 1)[1]
+    # Два хоста одного сервера: 127.0.0.1 и localhost
+    items = urls(base, range(2, 50, 2)) + urls(f"http://localhost:{port}", range(102, 150, 2))
+    statuses = asyncio.run(check_links(items, concurrency=20, per_host=3))
+    assert len(statuses) == len(items)
+    assert mock.max_active == {f"127.0.0.1:{port}": 3, f"localhost:{port}": 3}
+
+
+def test_cached_statuses_are_not_rechecked(site, tmp_path):
+    mock, base = site
+    items = urls(base, [10, 11, 12])
+    cache = LinkStatusCache(path=str(tmp_path / 'link_status.json'))
+    first = asyncio.run(check_links(items, cache))
+    cache.save()
+    calls = dict(mock.calls)
+
+    second = asyncio.run(check_links(items, LinkStatusCache.load(cache.path)))
+    assert second == first == {10: 'dead', 11: 'alive', 12: 'alive'}
+    assert mock.calls == calls
+
+
+def test_expired_statuses_are_rechecked(site, tmp_path):
+    mock, base = site
+    cache = LinkStatusCache(path=str(tmp_path / 'link_status.json'), ttl_hours=24)
+    cache.set(12, 'alive', now=time.time() - 25 * 3600)
+    assert cache.get(12) is None
+
+    asyncio.run(check_links(urls(base, [12]), cache))
+    assert mock.calls == {'HEAD': 1}
+    assert cache.get(12) == 'alive'
+
+
+def test_unknown_status_is_not_cached(tmp_path):
+    cache = LinkStatusCache(path=str(tmp_path / 'link_status.json'))
+    cache.set(12, 'unknown')
+    assert cache.get(12) is None
+
+
+def test_dead_listings_are_replaced_and_reranked(site, monkeypatch, tmp_path):
+    mock, base = site
+    monkeypatch.setattr(link_checker, 'LINK_CHECK', True)
+    monkeypatch.setattr(listing_dedup, 'LISTING_DEDUP', False)
+    df = pd.DataFrame({
+        'id': [10, 12, 13, 14, 20, 22],
+        'location': ['Marina'] * 3 + ['JVC'] * 3,
+        'price': [100, 200, 300, 100, 200, 300],
+        'rank': [1, 2, 3, 1, 2, 3]
+    })
+    df['url'] = [f"{base}/property/{listing_id}/" for listing_id in df['id']]
+    select = lambda frame: listing_dedup.dedup_top_n(frame, 2)
+    cache = LinkStatusCache(path=str(tmp_path / 'link_status.json'))
+
+    published = select(asyncio.run(drop_dead_listings_async(df, select, cache)))
+    published = published.set_index('id')['rank'].to_dict()
+    # Снятые 10 и 20 заменены следующими по цене, места пересчитаны
+    assert published == {14: 1, 22: 2, 12: 1, 13: 2}
+    # Проверялись только кандидаты в отчет, а не вся выборка
+    assert mock.calls['HEAD'] == 6
@@ -0,0 +1,35 @@
+"""Схлопывание повторов и пересчет топ-N регионов (listing_dedup)."""
+
+import pandas as pd
+import pytest
+
+import listing_dedup
+
+
+@pytest.mark.parametrize('dedup', [True, False])
+def test_listings_without_location_keep_their_group(monkeypatch, dedup):
+    monkeypatch.setattr(listing_dedup, 'LISTING_DEDUP', dedup)
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5],
+        'title': ['Studio A', 'Studio B', 'Studio C', 'Studio D', 'Studio E'],
+        'location': ['Marina', 'Marina', None, None, None],
+        'price': [100, 200, 300, 150, 250],
+        'area': [30, 31, 32, 33, 34]
+    })
+    top = listing_dedup.dedup_top_n(df, 2)
+    assert top.set_index('id')['rank'].to_dict() == {1: 1, 2: 2, 4: 1, 5: 2}
+
+
+def test_copies_are_collapsed_before_ranking(monkeypatch):
+    monkeypatch.setattr(listing_dedup, 'LISTING_DEDUP', True)
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'title': ['Studio, sea view', 'sea view studio', 'Loft', 'Duplex'],
+        'location': ['Marina'] * 4,
+        'price': [100, 101, 150, 200],
+        'area': [30, 30, 45, 60]
+    })
+    top = listing_dedup.dedup_top_n(df, 2)
+    assert top['id'].tolist() == [1, 3]
+    assert top['rank'].tolist() == [1, 2]
+    assert top['duplicates'].tolist() == [1, 0]
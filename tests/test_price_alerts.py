@@ -0,0 +1,109 @@
+"""Оповещения о снижении цен: некорректные уведомления и недоставленные сообщения."""
+
+import asyncio
+
+import aiohttp
+import pytest
+
+import price_alerts
+from price_alerts import PriceAlertListener, find_price_drops
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+    async def text(self):
+        return 'error'
+
+
+class FakeSession:
+    """Сессия aiohttp: каждый запрос получает следующий ответ (код или исключение) из списка."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.posted = []
+
+    def post(self, url, json):
+        session = self
+
+        class Request:
+            async def __aenter__(self):
+                outcome = session.outcomes.pop(0)
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                session.posted.append(json['text'])
+                return FakeResponse(outcome)
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+        return Request()
+
+
+def notification(listing_id, price, **fields):
+    return {'id': listing_id, 'price': price, 'area': 35, 'location': 'Marina', 'title': f"Квартира {listing_id}", **fields}
+
+
+def test_malformed_notifications_are_skipped():
+    last_prices = {1: 1000.0, 2: 1000.0}
+    batch = [
+        {'price': 500},
+        notification(2, 'n/a'),
+        notification(2, None),
+        'not an object',
+        notification(1, 800),
+        notification(3, 700, area='?')
+    ]
+    alerts = find_price_drops(batch, last_prices, drop_pct=5)
+    assert [alert['id'] for alert in alerts] == [1]
+    # Цена со снижением записывается только после доставки оповещения
+    assert last_prices == {1: 1000.0, 2: 1000.0}
+
+
+@pytest.mark.parametrize('failure', [
+    aiohttp.ServerDisconnectedError(),
+    asyncio.TimeoutError(),
+    OSError('network is unreachable'),
+    502
+])
+def test_undelivered_alerts_are_retried(monkeypatch, failure):
+    monkeypatch.setattr(price_alerts, 'TELEGRAM_MESSAGE_LIMIT', 200)
+    listener = PriceAlertListener(batch_seconds=0)
+    listener.last_prices = {1: 1000.0, 2: 2000.0, 3: 3000.0}
+    batch = [notification(1, 800), notification(2, 1500), notification(3, 2900)]
+
+    # Первое сообщение доставлено, второе — нет: отправка прерывается
+    session = FakeSession([200, failure])
+    delivered = asyncio.run(listener.process_batch(batch, session))
+    assert [alert['id'] for alert in delivered] == [2]
+    assert listener.last_prices == {1: 1000.0, 2: 1500.0, 3: 2900.0}
+    assert set(listener.pending) == {1}
+
+    # Повторная отправка без новых уведомлений
+    session = FakeSession([200])
+    delivered = asyncio.run(listener.process_batch([], session))
+    assert [alert['id'] for alert in delivered] == [1]
+    assert listener.last_prices[1] == 800.0
+    assert not listener.pending
+
+
+def test_newer_notification_replaces_pending_alert():
+    listener = PriceAlertListener(batch_seconds=0)
+    listener.last_prices = {1: 1000.0}
+    asyncio.run(listener.process_batch([notification(1, 800)], FakeSession([asyncio.TimeoutError()])))
+    assert set(listener.pending) == {1}
+
+    # Цена вернулась к прежней: оповещать уже не о чем
+    session = FakeSession([])
+    assert asyncio.run(listener.process_batch([notification(1, 1000)], session)) == []
+    assert listener.last_prices == {1: 1000.0}
+    assert not listener.pending and not session.posted
+
+
+def test_rejected_message_is_not_retried():
+    listener = PriceAlertListener(batch_seconds=0)
+    listener.last_prices = {1: 1000.0}
+    asyncio.run(listener.process_batch([notification(1, 800)], FakeSession([400])))
+    assert not listener.pending
+    assert listener.last_prices == {1: 800.0}
@@ -0,0 +1,32 @@
+"""Загрузка синтетических данных не затрагивает рабочую базу DB_*."""
+
+import pytest
+
+import synthetic_data
+
+
+class FakeConnection:
+    def __init__(self, dbname, host='localhost', port='5432'):
+        self.params = {'dbname': dbname, 'host': host, 'port': port}
+
+    def get_dsn_parameters(self):
+        return self.params
+
+    def cursor(self):
+        raise AssertionError("к рабочей базе не должно быть запросов")
+
+
+@pytest.mark.parametrize('truncate', [False, True])
+def test_load_into_production_is_refused(monkeypatch, truncate):
+    monkeypatch.setenv('DB_NAME', 'bayut')
+    monkeypatch.setenv('DB_HOST', 'localhost')
+    monkeypatch.setenv('DB_PORT', '5432')
+    df = synthetic_data.generate_price_history(2, 10, 2, seed=1)
+    with pytest.raises(RuntimeError):
+        synthetic_data.load_into_postgres(FakeConnection('bayut'), df, truncate=truncate)
+
+
+def test_bench_database_is_not_production(monkeypatch):
+    monkeypatch.setenv('DB_NAME', 'bayut')
+    assert not synthetic_data.is_production_database({'dbname': 'bayut_bench', 'host': 'localhost', 'port': '5432'})
+    assert synthetic_data.is_production_database({'dbname': 'bayut', 'host': 'localhost', 'port': 5432})